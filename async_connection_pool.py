@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import os
+import sqlite3
+
+import aiosqlite
+
+
+class AsyncPooledConnection:
+    """
+    Thin proxy around a pooled aiosqlite connection, the asyncio counterpart of PooledConnection.
+
+    Everything is forwarded to the underlying connection except close(), which hands the
+    connection back to its pool instead of closing it. Awaiting close() more than once is safe.
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    async def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            await self._pool.release(conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a connection returned to the pool.')
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+class AsyncConnectionPool:
+    """
+    Bounded pool of aiosqlite connections shared by the coroutines of one event loop.
+
+    Behaves like ConnectionPool: connections are opened lazily up to max_size, PRAGMAs are applied
+    once per connection, unhealthy connections are replaced on checkout and a pool inherited through
+    fork() starts over. Each aiosqlite connection runs its queries on its own thread, so max_size is
+    also the number of queries that can run at once; any number of coroutines can wait for a
+    connection without holding a thread. A released connection goes straight to the longest waiter.
+
+    Parameters:
+    - database (str): Path of the SQLite database file.
+    - max_size (int): Maximum number of open connections.
+    - timeout (float): Seconds to wait for a free connection before raising asyncio.TimeoutError.
+    - pragmas (dict): PRAGMA name -> value applied to every new connection.
+    - cached_statements (int): Prepared statements each connection keeps, keyed by SQL text. Make it at
+      least the number of distinct query shapes the app runs, so hot queries are not re-prepared.
+    """
+
+    def __init__(self, database, max_size=8, timeout=5.0, pragmas=None, cached_statements=128):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = dict(pragmas or {})
+        self.cached_statements = cached_statements
+        self.reset_after_fork()
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.database, cached_statements=self.cached_statements)
+        for name, value in self.pragmas.items():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    @staticmethod
+    async def _is_healthy(conn):
+        try:
+            await conn.execute("SELECT 1")
+            return True
+        except (sqlite3.Error, ValueError):
+            return False
+
+    async def _discard(self, conn):
+        self._open -= 1
+        self._discarded += 1
+        # A waiting task can open a connection in the freed slot
+        self._hand_over(None)
+        try:
+            await conn.close()
+        except (sqlite3.Error, ValueError):
+            pass
+
+    def reset_after_fork(self):
+        """Forget the parent's connections (without closing them, they still belong to the parent)."""
+        self._idle = []
+        self._waiters = collections.deque()
+        self._open = self._in_use = self._created = self._reused = self._discarded = self._waits = 0
+        self._closed = False
+        self._pid = os.getpid()
+
+    async def acquire(self):
+        """Check a connection out of the pool, opening a new one if the pool is not yet full."""
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        while True:
+            if self._idle:
+                conn = self._idle.pop()
+            elif self._open < self.max_size:
+                self._open += 1
+                try:
+                    conn = await self._connect()
+                except sqlite3.Error:
+                    self._open -= 1
+                    self._hand_over(None)
+                    raise
+                self._created += 1
+                self._in_use += 1
+                return AsyncPooledConnection(self, conn)
+            else:
+                self._waits += 1
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    conn = await asyncio.wait_for(waiter, self.timeout)
+                except BaseException:
+                    if waiter.done() and not waiter.cancelled():
+                        # Handed a connection or a free slot just as the wait was abandoned; pass it on
+                        if waiter.result() is None:
+                            self._hand_over(None)
+                        else:
+                            self._in_use += 1
+                            await self.release(waiter.result())
+                    else:
+                        self._waiters.remove(waiter)
+                    raise
+                if conn is None:
+                    continue  # a connection was discarded, open one in its place
+
+            if not await self._is_healthy(conn):
+                await self._discard(conn)
+                continue
+            self._reused += 1
+            self._in_use += 1
+            return AsyncPooledConnection(self, conn)
+
+    async def release(self, conn):
+        """Return a connection to the pool, rolling back anything the caller left uncommitted."""
+        if self._pid != os.getpid():
+            return
+        self._in_use -= 1
+        if self._closed:
+            await self._discard(conn)
+            return
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except (sqlite3.Error, ValueError):
+            await self._discard(conn)
+            return
+        if not self._hand_over(conn):
+            self._idle.append(conn)
+
+    def _hand_over(self, conn):
+        """Give conn, or None for a freed slot, to the first task still waiting; False if there is none."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return True
+        return False
+
+    async def close_all(self):
+        """Close every idle connection. Connections currently checked out are closed on release."""
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        self._closed = True
+        while self._idle:
+            await self._discard(self._idle.pop())
+
+    def stats(self):
+        return {
+            'max_size': self.max_size,
+            'cached_statements': self.cached_statements,
+            'open': self._open,
+            'in_use': self._in_use,
+            'idle': self._open - self._in_use,
+            'created': self._created,
+            'reused': self._reused,
+            'discarded': self._discarded,
+            'waits': self._waits,
+        }
@@ -0,0 +1,331 @@
+# Async mirror of model.py for aiosqlite connections (see async_rest_application.py).
+# Every function has the same name, arguments, SQL and return value as its model.py counterpart and is
+# awaited instead of called. Writes go through model.notify_write, so write listeners, table versions
+# and status cascades behave the same whichever variant made the change.
+import sqlite3
+
+from model import (BatchInsertError, EVENT_COLUMNS, EVENT_STATUS_CASCADE, EVENTS_WITH_ACTIVE_SELECTIONS_QUERY,
+                   IN_CHUNK_SIZE, SELECTION_COLUMNS, SPORT_COLUMNS, SPORT_STATUS_CASCADE,
+                   SPORTS_WITH_ACTIVE_EVENTS_QUERY, STREAM_BATCH_SIZE, TABLE_FIELDS, TIMEFRAME_QUERY, card_fields,
+                   event_starts_to_utc, event_status_cascade_params, keyed_rows, notify_write, row_change,
+                   search_query, sport_status_cascade_params, to_epoch)
+
+
+async def fetchall(conn, query, params=()):
+    async with conn.execute(query, params) as c:
+        return await c.fetchall()
+
+
+async def fetchone(conn, query, params=()):
+    async with conn.execute(query, params) as c:
+        return await c.fetchone()
+
+
+# Insert all rows in one transaction, or none of them, and return the new ids (see model.insert_many)
+async def insert_many(conn, query, rows):
+    rows = list(rows)
+    try:
+        await conn.executemany(query, rows)
+    except sqlite3.Error:
+        await conn.rollback()
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                await conn.execute(query, row)
+            except sqlite3.Error as e:
+                errors.append({'index': index, 'error': str(e)})
+        await conn.rollback()
+        raise BatchInsertError(errors)
+
+    last_id = (await fetchone(conn, "SELECT last_insert_rowid()"))[0]
+    await conn.commit()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+# Search results as a list. Rows are tuples, or dicts keyed by field name when fields are given.
+async def search_table(conn, table, filters, limit=None, after_id=None, fields=None):
+    query, params = search_query(table, filters, limit, after_id, fields)
+    async with conn.execute(query, params) as c:
+        if fields:
+            c.row_factory = keyed_rows(fields)
+        return await c.fetchall()
+
+
+# Yield search results in lists of up to batch_size rows, so only one batch is held in memory at a time
+async def stream_search(conn, table, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    query, params = search_query(table, filters, limit, after_id, fields)
+    async with conn.execute(query, params) as c:
+        if fields:
+            c.row_factory = keyed_rows(fields)
+        while True:
+            rows = await c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+async def create_sport(conn, name, slug, active):
+    c = await conn.execute("INSERT INTO Sports (name, slug, active) VALUES (?, ?, ?)", (name, slug, active))
+    await conn.commit()
+    notify_write('Sports', changes=[row_change('created', c.lastrowid, SPORT_COLUMNS, (name, slug, active))])
+
+
+async def create_sport_many(conn, sports):
+    sports = list(sports)
+    ids = await insert_many(conn, "INSERT INTO Sports (name, slug, active) VALUES (?, ?, ?)", sports)
+    notify_write('Sports', changes=[row_change('created', id, SPORT_COLUMNS, sport) for id, sport in zip(ids, sports)])
+
+
+async def read_sport(conn, id):
+    return await fetchone(conn, "SELECT * FROM Sports WHERE id = ?", (id,))
+
+
+async def update_sport(conn, id, name, slug, active):
+    await conn.execute("UPDATE Sports SET name = ?, slug = ?, active = ? WHERE id = ?", (name, slug, active, id))
+    await conn.commit()
+    notify_write('Sports', changes=[row_change('updated', id, SPORT_COLUMNS, (name, slug, active))])
+
+
+# When all the events of a sport are inactive, the sport becomes inactive
+async def check_and_update_sport_status(conn, sport_id):
+    c = await conn.execute(SPORT_STATUS_CASCADE, sport_status_cascade_params(sport_id))
+    if c.rowcount:
+        await conn.commit()
+        notify_write('Sports', changes=[row_change('updated', sport_id, ('active',), (False,))])
+
+
+async def delete_sport(conn, id):
+    await conn.execute("DELETE FROM Sports WHERE id = ?", (id,))
+    await conn.commit()
+    notify_write('Sports', changes=[row_change('deleted', id)])
+
+
+async def search_sports(conn, filters, limit=None, after_id=None, fields=None):
+    return await search_table(conn, 'Sports', filters, limit, after_id, fields)
+
+
+def stream_sports(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    return stream_search(conn, 'Sports', filters, limit, after_id, batch_size, fields)
+
+
+async def search_sports_with_active_events_greater_than(conn, threshold):
+    return await fetchall(conn, SPORTS_WITH_ACTIVE_EVENTS_QUERY, (threshold,))
+
+
+async def search_events_with_active_selections_greater_than(conn, threshold):
+    return await fetchall(conn, EVENTS_WITH_ACTIVE_SELECTIONS_QUERY, (threshold,))
+
+
+async def create_event(conn, name, slug, active, type, sport_id, status, scheduled_start, actual_start):
+    c = await conn.execute(
+        "INSERT INTO Events (name, slug, active, type, sport_id, status, scheduled_start, actual_start) VALUES (?, ?, "
+        "?, ?, ?, ?, ?, ?)",
+        (name, slug, active, type, sport_id, status, scheduled_start, actual_start)
+    )
+    await conn.commit()
+    notify_write('Events', sport_id, [row_change('created', c.lastrowid, EVENT_COLUMNS,
+                                                 (name, slug, active, type, sport_id, status, scheduled_start,
+                                                  actual_start))])
+
+
+async def create_event_many(conn, events, tz_str=None):
+    events = list(events)
+    if tz_str is not None:
+        events = event_starts_to_utc(events, tz_str)
+    ids = await insert_many(
+        conn,
+        "INSERT INTO Events (name, slug, active, type, sport_id, status, scheduled_start, actual_start) VALUES (?, ?, "
+        "?, ?, ?, ?, ?, ?)",
+        events
+    )
+    changes_by_sport = {}
+    for id, event in zip(ids, events):
+        changes_by_sport.setdefault(event[4], []).append(row_change('created', id, EVENT_COLUMNS, event))
+    for sport_id, changes in changes_by_sport.items():
+        notify_write('Events', sport_id, changes)
+
+
+async def read_event(conn, id):
+    return await fetchone(conn, "SELECT * FROM Events WHERE id = ?", (id,))
+
+
+async def read_sport_events(conn, sport_id):
+    return await fetchall(conn, 'SELECT * FROM Events WHERE sport_id = ?', (sport_id,))
+
+
+async def update_event(conn, event_id, data):
+    params = (data.get('name'), data.get('active'), data.get('type'), data.get('status'),
+              data.get('scheduled_start'), data.get('actual_start'), event_id)
+    await conn.execute(
+        "UPDATE Events SET name = ?, active = ?, type = ?, status = ?, scheduled_start = ?, actual_start = ? WHERE id "
+        "= ?",
+        params)
+    await check_and_update_sport_status(conn, data.get('sport_id'))
+    await conn.commit()
+    columns = ('name', 'active', 'type', 'status', 'scheduled_start', 'actual_start', 'sport_id')
+    notify_write('Events', data.get('sport_id'),
+                 [row_change('updated', event_id, columns, params[:-1] + (data.get('sport_id'),))])
+
+
+# When all the selections of a particular event are inactive, the event becomes inactive
+async def check_and_update_event_status(conn, event_id):
+    c = await conn.execute(EVENT_STATUS_CASCADE, event_status_cascade_params(event_id))
+    if c.rowcount:
+        await conn.commit()
+        notify_write('Events', changes=[row_change('updated', event_id, ('active',), (False,))])
+
+
+async def delete_event(conn, id):
+    await conn.execute("DELETE FROM Events WHERE id = ?", (id,))
+    await conn.commit()
+    notify_write('Events', changes=[row_change('deleted', id)])
+
+
+async def search_events(conn, filters, limit=None, after_id=None, fields=None):
+    return await search_table(conn, 'Events', filters, limit, after_id, fields)
+
+
+def stream_events(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    return stream_search(conn, 'Events', filters, limit, after_id, batch_size, fields)
+
+
+# Events scheduled to start in a specific timeframe for a specific timezone
+async def search_events_in_timeframe(conn, start_time, end_time):
+    st = to_epoch(start_time, 'Europe/London')
+    et = to_epoch(end_time, 'Europe/London')
+    return await fetchall(conn, TIMEFRAME_QUERY, (st, et))
+
+
+async def create_selection(conn, name, event_id, price, active, outcome):
+    c = await conn.execute(
+        "INSERT INTO Selections (name, event_id, price, active, outcome) VALUES (?, ?, ?, ?, ?)",
+        (name, event_id, price, active, outcome)
+    )
+    await conn.commit()
+    notify_write('Selections', event_id, [row_change('created', c.lastrowid, SELECTION_COLUMNS,
+                                                     (name, event_id, price, active, outcome))])
+
+
+async def create_selection_many(conn, selections):
+    selections = list(selections)
+    ids = await insert_many(conn,
+                            "INSERT INTO Selections (name, event_id, price, active, outcome) VALUES (?, ?, ?, ?, ?)",
+                            selections)
+    changes_by_event = {}
+    for id, selection in zip(ids, selections):
+        changes_by_event.setdefault(selection[1], []).append(row_change('created', id, SELECTION_COLUMNS, selection))
+    for event_id, changes in changes_by_event.items():
+        notify_write('Selections', event_id, changes)
+
+
+async def read_selection(conn, id):
+    return await fetchone(conn, "SELECT * FROM Selections WHERE id = ?", (id,))
+
+
+async def read_event_selections(conn, event_id):
+    return await fetchall(conn, 'SELECT * FROM Selections WHERE event_id = ?', (event_id,))
+
+
+# Selections of many events as {event_id: [selection dict, ...]} (see model.read_selections_for_events)
+async def read_selections_for_events(conn, event_ids):
+    event_ids = list(event_ids)
+    by_event = {}
+    for start in range(0, len(event_ids), IN_CHUNK_SIZE):
+        rows = await search_selections(conn, {'event_id__in': event_ids[start:start + IN_CHUNK_SIZE]},
+                                       fields=TABLE_FIELDS['Selections'])
+        for row in rows:
+            by_event.setdefault(row['event_id'], []).append(row)
+    for selections in by_event.values():
+        selections.sort(key=lambda row: row['id'])
+    return by_event
+
+
+async def attach_selections(conn, events):
+    selections = await read_selections_for_events(conn, [event['id'] for event in events])
+    for event in events:
+        event['selections'] = selections.get(event['id'], [])
+    return events
+
+
+async def search_event_cards(conn, filters, limit=None, after_id=None, fields=None):
+    return await attach_selections(conn, await search_events(conn, filters, limit, after_id, card_fields(fields)))
+
+
+async def stream_event_cards(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    async for events in stream_events(conn, filters, limit, after_id, batch_size, card_fields(fields)):
+        yield await attach_selections(conn, events)
+
+
+async def update_selection(conn, selection_id, data):
+    params = (data.get('name'), data.get('price'), data.get('active'), data.get('outcome'), selection_id)
+    await conn.execute("UPDATE Selections SET name = ?, price = ?, active = ?, outcome = ? WHERE id = ?", params)
+
+    await check_and_update_event_status(conn, data.get('event_id'))
+
+    await conn.commit()
+    columns = ('name', 'price', 'active', 'outcome', 'event_id')
+    notify_write('Selections', data.get('event_id'),
+                 [row_change('updated', selection_id, columns, params[:-1] + (data.get('event_id'),))])
+
+
+# prices: iterable of (selection_id, price) or (selection_id, price, active) tuples, applied in one
+# transaction together with the event cascade (see model.update_selection_prices)
+async def update_selection_prices(conn, prices):
+    prices = list(prices)
+    price_only = [(row[1], row[0]) for row in prices if len(row) == 2]
+    price_and_active = [(row[1], row[2], row[0]) for row in prices if len(row) == 3]
+
+    updated = 0
+    try:
+        if price_only:
+            c = await conn.executemany("UPDATE Selections SET price = ? WHERE id = ?", price_only)
+            updated += c.rowcount
+        if price_and_active:
+            c = await conn.executemany("UPDATE Selections SET price = ?, active = ? WHERE id = ?", price_and_active)
+            updated += c.rowcount
+
+        selection_ids = list({row[0] for row in prices})
+        selection_events = {}
+        for start in range(0, len(selection_ids), IN_CHUNK_SIZE):
+            chunk = selection_ids[start:start + IN_CHUNK_SIZE]
+            rows = await fetchall(conn, f"SELECT id, event_id FROM Selections WHERE id IN "
+                                        f"({', '.join('?' * len(chunk))})", chunk)
+            selection_events.update((row[0], row[1]) for row in rows)
+
+        event_ids = sorted({event_id for event_id in selection_events.values() if event_id is not None})
+        events_deactivated = []
+        for event_id in event_ids:
+            c = await conn.execute(EVENT_STATUS_CASCADE, event_status_cascade_params(event_id))
+            if c.rowcount:
+                events_deactivated.append(event_id)
+    except sqlite3.Error:
+        await conn.rollback()
+        raise
+    await conn.commit()
+
+    changes_by_event = {}
+    for row in prices:
+        if row[0] in selection_events:
+            event_id = selection_events[row[0]]
+            changes_by_event.setdefault(event_id, []).append(
+                row_change('updated', row[0], ('event_id', 'price', 'active'), (event_id,) + tuple(row[1:])))
+    for event_id, changes in changes_by_event.items():
+        notify_write('Selections', event_id, changes)
+    if events_deactivated:
+        notify_write('Events', changes=[row_change('updated', event_id, ('active',), (False,))
+                                        for event_id in events_deactivated])
+    return updated
+
+
+async def delete_selection(conn, id):
+    await conn.execute("DELETE FROM Selections WHERE id = ?", (id,))
+    await conn.commit()
+    notify_write('Selections', changes=[row_change('deleted', id)])
+
+
+async def search_selections(conn, filters, limit=None, after_id=None, fields=None):
+    return await search_table(conn, 'Selections', filters, limit, after_id, fields)
+
+
+def stream_selections(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    return stream_search(conn, 'Selections', filters, limit, after_id, batch_size, fields)
@@ -0,0 +1,629 @@
+"""
+Async variant of rest_application.py: the same routes, served by Quart on an event loop.
+
+Handlers await an aiosqlite connection from an AsyncConnectionPool instead of holding a worker thread
+for the whole database round trip, so one process can keep thousands of clients (and open
+/events/<id>/stream subscriptions) in flight while POOL_SIZE queries run at once. Validation, the
+response cache, ETags and the stream broadcaster are shared with rest_application.py, and writes go
+through async_model.py, which notifies the same write listeners as model.py.
+
+Run with an ASGI server, e.g.:
+
+    uvicorn --host 0.0.0.0 --port 5000 async_rest_application:app
+"""
+import asyncio
+import signal
+import threading
+
+from quart import Blueprint, Quart, Response, abort, current_app, g, jsonify, request
+
+import async_model
+import model
+from async_connection_pool import AsyncConnectionPool
+from event_stream import Broadcaster
+from json_backend import use_fast_json
+from rest_application import (CACHE_MISS, COUNT_FILTER_TABLES, EVENT_PARAMS, INCLUDE_TABLES, ROUTE_TABLES,
+                              STREAM_FORMATS, broadcaster, cache_key_part, current_etag, import_timezone,
+                              HOT_TIER_TTL, WRITE_QUEUE_DELAY, WRITE_QUEUE_MAX_BATCH, parse_active_filters,
+                              parse_count_filters, parse_fields, parse_paging, parse_time_filters, response_cache,
+                              row_id, split_list_filters, valid_filter, validate_event, validate_price_update,
+                              validate_selection, validate_sport)
+from hot_tier import HotTier
+from set_up_database import STORAGE_PROFILE, initialize_database
+from write_queue import WriteQueue
+
+DATABASE = 'sportsbook.db'
+# Queries running at once; requests beyond that wait on the pool without holding a thread
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+STREAM_HEARTBEAT = 15.0
+
+# Connection pool of this process, sized from the app's config by create_app()
+pool = None
+# Signal handlers of the server, wrapped by end_streams_on_exit() while the app serves
+server_signal_handlers = {}
+# Tasks closing the pools replaced by create_app(), referenced until they finish
+closing_pools = set()
+# Writer thread the write routes go through when the app's WRITE_QUEUE_ENABLED is set, otherwise None
+write_queue = None
+# Replica of the active rows answering active=true searches when the app's HOT_TIER_ENABLED is set, otherwise None
+hot_tier = None
+
+
+# One pooled connection per request, kept on the app context and handed back to the pool on teardown
+async def get_db():
+    if 'db' not in g or g.db.closed:
+        g.db = await pool.acquire()
+    return g.db
+
+
+# As in rest_application.py. The writer thread runs the model.py function of the same name, and the
+# handler awaits its Future without blocking the event loop.
+async def run_write(write, *args):
+    """Await write(conn, *args), an async_model.py write function, and return its result."""
+    if write_queue is not None:
+        return await asyncio.wrap_future(write_queue.submit(getattr(model, write.__name__), *args))
+    conn = await get_db()
+    result = await write(conn, *args)
+    await conn.close()
+    return result
+
+
+api = Blueprint('api', __name__)
+
+
+async def release_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        await db.close()
+
+
+# Conditional GET, as in rest_application.py
+@api.before_request
+async def answer_not_modified():
+    tables = ROUTE_TABLES.get(request.endpoint)
+    if request.method != 'GET' or tables is None:
+        return None
+    tables += INCLUDE_TABLES.get(request.args.get('include'), ())
+    for key in COUNT_FILTER_TABLES.keys() & request.args.keys():
+        tables += COUNT_FILTER_TABLES[key]
+
+    g.etag = current_etag(tables)
+    if request.if_none_match.contains(g.etag):
+        response = Response('', status=304)
+        response.set_etag(g.etag)
+        return response
+    return None
+
+
+@api.after_request
+async def add_etag(response):
+    etag = g.get('etag')
+    if etag is not None and response.status_code == 200:
+        response.set_etag(etag)
+    return response
+
+
+@api.route('/stats', methods=['GET'])
+async def get_stats():
+    return {'pool': pool.stats(), 'response_cache': response_cache.stats(), 'streams': broadcaster.stats(),
+            'query_shapes': model.query_builder.stats(),
+            'write_queue': write_queue.stats() if write_queue is not None else None,
+            'hot_tier': hot_tier.stats() if hot_tier is not None else None}, 200
+
+
+async def create_many(rows, validate, create_many_rows, columns, *args):
+    if not rows:
+        abort(400, 'Expected at least one row in the JSON array')
+
+    errors = []
+    for index, row in enumerate(rows):
+        error = validate(row)
+        if error:
+            errors.append({'index': index, 'error': error})
+    if errors:
+        return {'status': 'failure', 'errors': errors}, 400
+
+    try:
+        await run_write(create_many_rows, [tuple(row[column] for column in columns) for row in rows], *args)
+    except model.BatchInsertError as e:
+        return {'status': 'failure', 'errors': e.errors}, 400
+    except Exception as e:
+        abort(500, str(e))
+
+    return {'status': 'success', 'created': len(rows)}, 201
+
+
+# Creating
+@api.route('/sports', methods=['POST'])
+async def create_sport():
+    data = await request.get_json()
+    if isinstance(data, list):
+        return await create_many(data, validate_sport, async_model.create_sport_many, ('name', 'slug', 'active'))
+
+    error = validate_sport(data)
+    if error:
+        abort(400, error)
+
+    try:
+        await run_write(async_model.create_sport, data['name'], data['slug'], data['active'])
+    except Exception as e:
+        abort(500, str(e))
+
+    return {'status': 'success'}, 201
+
+
+@api.route('/events', methods=['POST'])
+async def create_event():
+    data = await request.get_json()
+    if isinstance(data, list):
+        try:
+            tz = import_timezone(request.args)
+        except ValueError as e:
+            abort(400, str(e))
+        return await create_many(data, validate_event, async_model.create_event_many, tuple(EVENT_PARAMS), tz)
+
+    error = validate_event(data)
+    if error:
+        abort(400, error)
+
+    try:
+        await run_write(async_model.create_event, data['name'], data['slug'], data['active'], data['type'],
+                        data['sport_id'], data['status'], data['scheduled_start'], data['actual_start'])
+    except Exception as e:
+        abort(500, str(e))
+
+    return {'status': 'success'}, 201
+
+
+@api.route('/selections', methods=['POST'])
+async def create_selection():
+    data = await request.get_json()
+    if isinstance(data, list):
+        return await create_many(data, validate_selection, async_model.create_selection_many,
+                                 ('name', 'event_id', 'price', 'active', 'outcome'))
+
+    error = validate_selection(data)
+    if error:
+        abort(400, error)
+
+    try:
+        await run_write(async_model.create_selection, data['name'], data['event_id'], data['price'], data['active'],
+                        data['outcome'])
+    except Exception as e:
+        abort(500, str(e))
+
+    return {'status': 'success'}, 201
+
+
+# Updating
+@api.route('/sports/<int:sport_id>', methods=['PUT'])
+async def update_sport(sport_id):
+    data = await request.get_json()
+
+    if not data or 'name' not in data or 'slug' not in data or 'active' not in data:
+        abort(400, description="Invalid data. 'name', 'slug', and 'active' are required.")
+    if not isinstance(data['name'], str) or not isinstance(data['slug'], str) or not isinstance(data['active'], bool):
+        abort(400, description="Invalid data types. 'name' and 'slug' should be strings. 'active' should be a boolean.")
+
+    try:
+        await run_write(async_model.update_sport, sport_id, data['name'], data['slug'], data['active'])
+    except Exception as e:
+        return {'status': 'failure', 'message': str(e)}, 500
+
+    return {'status': 'success'}, 200
+
+
+@api.route('/events/<int:event_id>', methods=['PUT'])
+async def update_event(event_id):
+    data = await request.get_json()
+
+    required_fields = {'name', 'slug', 'active', 'type', 'sport_id', 'status', 'scheduled_start', 'actual_start'}
+    if not data or not required_fields.issubset(data.keys()):
+        abort(400, description="Invalid data. Required fields: {}".format(", ".join(required_fields)))
+
+    if not all(isinstance(data[field], str) for field in ['name', 'slug', 'type', 'status']):
+        abort(400, description="Invalid data types. 'name', 'slug', 'type', and 'status' should be strings.")
+    if not isinstance(data['active'], bool):
+        abort(400, description="Invalid data type. 'active' should be a boolean.")
+    if not isinstance(data['sport_id'], int):
+        abort(400, description="Invalid data type. 'sport_id' should be an integer.")
+    if not (isinstance(data['scheduled_start'], str) and isinstance(data['actual_start'], str)):
+        abort(400,
+              description="Invalid data types. 'scheduled_start' and 'actual_start' should be strings (ISO 8601 "
+                          "format).")
+
+    try:
+        await run_write(async_model.update_event, event_id, data)
+    except Exception as e:
+        return {'status': 'failure', 'message': str(e)}, 500
+
+    return {'message': 'Event updated successfully'}, 200
+
+
+@api.route('/selections/<int:selection_id>', methods=['PUT'])
+async def update_selection(selection_id):
+    data = await request.get_json()
+
+    required_fields = {'name', 'event_id', 'price', 'active', 'outcome'}
+    if not data or not required_fields.issubset(data.keys()):
+        abort(400, description="Invalid data. Required fields: {}".format(", ".join(required_fields)))
+
+    if not isinstance(data['name'], str):
+        abort(400, description="Invalid data type. 'name' should be a string.")
+    if not isinstance(data['event_id'], int):
+        abort(400, description="Invalid data type. 'event_id' should be an integer.")
+    if not isinstance(data['price'], (int, float)):
+        abort(400, description="Invalid data type. 'price' should be a numeric value.")
+    if not isinstance(data['active'], bool):
+        abort(400, description="Invalid data type. 'active' should be a boolean.")
+    if not isinstance(data['outcome'], str):
+        abort(400, description="Invalid data type. 'outcome' should be a string.")
+
+    try:
+        await run_write(async_model.update_selection, selection_id, data)
+    except Exception as e:
+        return {'status': 'failure', 'message': str(e)}, 500
+
+    return {'message': 'Selection updated successfully'}, 200
+
+
+@api.route('/selections/prices', methods=['PATCH'])
+async def update_selection_prices():
+    data = await request.get_json()
+
+    if not isinstance(data, list) or not data:
+        abort(400, description="Invalid data. Expected a non-empty list of [selection_id, price(, active)].")
+
+    errors = []
+    for index, row in enumerate(data):
+        error = validate_price_update(row)
+        if error:
+            errors.append({'index': index, 'error': error})
+    if errors:
+        return {'status': 'failure', 'errors': errors}, 400
+
+    try:
+        updated = await run_write(async_model.update_selection_prices, [tuple(row) for row in data])
+    except Exception as e:
+        return {'status': 'failure', 'message': str(e)}, 500
+
+    return {'message': 'Prices updated successfully', 'updated': updated}, 200
+
+
+# Paging and streaming for the search routes, as in rest_application.py
+def paged_response(key, rows, page):
+    next_after_id = row_id(rows[-1]) if rows and 'limit' in page and len(rows) == page['limit'] else None
+    return jsonify({key: rows, 'next_after_id': next_after_id}), 200
+
+
+def streamed_response(key, stream_search, filters, page, stream, projection):
+    dumps = current_app.json.dumps
+
+    async def generate():
+        # The body is sent after the request context is gone, so the connection is taken from the pool directly
+        conn = await pool.acquire()
+        try:
+            if stream == 'json':
+                yield '{"%s": [' % key
+            separator = ''
+            async for rows in stream_search(conn, filters, **page, **projection):
+                if stream == 'ndjson':
+                    yield ''.join(dumps(row) + '\n' for row in rows)
+                else:
+                    yield separator + ','.join(dumps(row) for row in rows)
+                    separator = ','
+            if stream == 'json':
+                yield ']}'
+        finally:
+            await conn.close()
+
+    response = Response(generate(), mimetype=STREAM_FORMATS[stream])
+    response.timeout = None
+    return response
+
+
+# As in rest_application.py; the hot tier answers from memory, so it is called without awaiting
+# A search of the replica takes microseconds and runs on the event loop, but a (re)load reads every active
+# row from SQLite, so it runs on a worker thread while other coroutines go on
+async def hot_search(table, filters, page, projection):
+    if hot_tier is None:
+        return None
+    if hot_tier.stale():
+        await asyncio.get_running_loop().run_in_executor(None, hot_tier.load)
+    return hot_tier.search(table, filters, **page, **projection, reload=False)
+
+
+async def cached_read(table, parent_id, read, *args, **kwargs):
+    """Await read(conn, *args, **kwargs) on a pooled connection, going through the shared response cache."""
+    async def load():
+        conn = await get_db()
+        rows = await read(conn, *args, **kwargs)
+        await conn.close()
+        return rows
+
+    if not current_app.config['RESPONSE_CACHE_ENABLED']:
+        return await load()
+
+    key = (request.path, read.__name__, tuple(cache_key_part(arg) for arg in args), cache_key_part(kwargs))
+    rows = response_cache.get(key, CACHE_MISS)
+    if rows is CACHE_MISS:
+        generation = response_cache.generation(table)
+        rows = await load()
+        response_cache.set(key, rows, table, parent_id, generation)
+    return rows
+
+
+# Searching
+@api.route('/sports', methods=['GET'])
+async def get_sports():
+    valid_filters = {'name', 'active', 'min_active_events'}
+    filters = request.args.to_dict()
+    try:
+        page, stream = parse_paging(filters)
+        projection = parse_fields(filters, 'Sports', page)
+        counted = parse_count_filters(filters, 'Sports')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if 'active' in filters:
+        if filters['active'].lower() == "true":
+            filters['active'] = 1
+        elif filters['active'].lower() == "false":
+            filters['active'] = 0
+        else:
+            return jsonify({'error': 'Invalid active value, must be true or false.'}), 400
+
+    if not set(filters.keys()).issubset(valid_filters):
+        invalid_filters = set(filters.keys()) - valid_filters
+        abort(400, description="Invalid filters: {}".format(", ".join(invalid_filters)))
+
+    if stream:
+        return streamed_response('sports', async_model.stream_sports, filters, page, stream, projection)
+
+    try:
+        table = 'SportsByActiveEvents' if counted else 'Sports'
+        sports = await hot_search('Sports', filters, page, projection)
+        if sports is None:
+            sports = await cached_read(table, None, async_model.search_sports, filters, **page, **projection)
+    except Exception as e:
+        return {'status': 'failure', 'message': str(e)}, 500
+
+    if page:
+        return paged_response('sports', sports, page)
+    return {'sports': sports}, 200
+
+
+@api.route('/sports/<int:sport_id>/events', methods=['GET'])
+async def get_sport_events(sport_id):
+    try:
+        events = await cached_read('Events', sport_id, async_model.read_sport_events, sport_id)
+        if events:
+            return jsonify({'events': events}), 200
+        else:
+            return jsonify({'error': 'No events found for this sport'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@api.route('/events', methods=['GET'])
+async def get_events():
+    valid_event_filters = ['name', 'type', 'status', 'scheduled_start', 'actual_start', 'active', 'sport_id']
+
+    try:
+        filters = request.args.to_dict()
+        page, stream = parse_paging(filters)
+        projection = parse_fields(filters, 'Events', page)
+        include = filters.pop('include', None)
+        if include not in (None, 'selections'):
+            return jsonify({'error': 'Invalid include value, must be selections.'}), 400
+        parse_active_filters(filters)
+        counted = parse_count_filters(filters, 'Events')
+        parse_time_filters(filters)
+        for key in filters.keys():
+            if key not in model.EXTRA_FILTERS['Events'] and not valid_filter(key, valid_event_filters):
+                return {'error': f'Invalid filter: {key}'}, 400
+        split_list_filters(filters)
+
+        if include:
+            # Event cards: each event with its selections embedded, read in two queries instead of N+1
+            table, search, stream_search = 'EventCards', async_model.search_event_cards, async_model.stream_event_cards
+        else:
+            table = 'EventsByActiveSelections' if counted else 'Events'
+            search, stream_search = async_model.search_events, async_model.stream_events
+
+        if stream:
+            return streamed_response('events', stream_search, filters, page, stream, projection)
+
+        events = None if include else await hot_search('Events', filters, page, projection)
+        if events is None:
+            events = await cached_read(table, None, search, filters, **page, **projection)
+        if page:
+            return paged_response('events', events, page)
+        if events:
+            return jsonify({'events': events}), 200
+        else:
+            return jsonify({'error': 'No events found for the provided filters.'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@api.route('/events/<int:event_id>/selections', methods=['GET'])
+async def get_event_selections(event_id):
+    try:
+        selections = await cached_read('Selections', event_id, async_model.read_event_selections, event_id)
+        if selections:
+            return jsonify({'selections': selections}), 200
+        else:
+            return jsonify({'error': 'No selections found for the provided event id.'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@api.route('/selections', methods=['GET'])
+async def get_selections():
+    try:
+        filters = request.args.to_dict()
+        page, stream = parse_paging(filters)
+        projection = parse_fields(filters, 'Selections', page)
+        parse_active_filters(filters)
+
+        valid_filters = ["name", "event_id", "price", "active", "outcome"]
+        for filter_name in filters.keys():
+            if not valid_filter(filter_name, valid_filters):
+                return jsonify({'error': f'Invalid filter: {filter_name}. Valid filters are {valid_filters}'}), 400
+        split_list_filters(filters)
+
+        if stream:
+            return streamed_response('selections', async_model.stream_selections, filters, page, stream, projection)
+
+        selections = await hot_search('Selections', filters, page, projection)
+        if selections is None:
+            selections = await cached_read('Selections', None, async_model.search_selections, filters, **page,
+                                         **projection)
+
+        if page:
+            return paged_response('selections', selections, page)
+        if selections:
+            return jsonify({'selections': selections}), 200
+        else:
+            return jsonify({'error': 'No selections found for the provided filters.'}), 404
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# Server-Sent Events, as in rest_application.py. A waiting subscriber is a parked coroutine, not a thread.
+@api.route('/events/<int:event_id>/stream', methods=['GET'])
+async def stream_event(event_id):
+    subscription = broadcaster.subscribe(event_id)
+
+    async def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                messages = await subscription.wait_async(timeout=STREAM_HEARTBEAT)
+                if messages is None:
+                    return
+                if not messages:
+                    yield ': heartbeat\n\n'
+                else:
+                    yield ''.join('event: reset\ndata: {}\n\n' if message is Broadcaster.RESET else message
+                                  for message in messages)
+        finally:
+            subscription.close()
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+
+# Startup check: create or migrate the schema before serving, as rest_application.ensure_schema does.
+# It opens its own SQLite connection, so it runs off the event loop.
+async def ensure_schema():
+    if current_app.config['SCHEMA_CHECK_ENABLED']:
+        await asyncio.get_running_loop().run_in_executor(None, initialize_database, current_app.config['DATABASE'])
+
+
+# uvicorn installs its own SIGINT and SIGTERM handlers when it starts serving, and runs after_serving
+# hooks only once every connection has closed, so an open stream would hold the shutdown up until the
+# graceful timeout. End the streams as soon as the signal arrives instead. The handler interrupts the
+# event loop's own thread, so it only schedules broadcaster.close() on the loop.
+async def end_streams_on_exit():
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        handle_exit = signal.getsignal(signum)
+        if not callable(handle_exit):
+            continue
+
+        def close_streams_and_exit(signum, frame, handle_exit=handle_exit):
+            loop.call_soon_threadsafe(broadcaster.close)
+            handle_exit(signum, frame)
+
+        server_signal_handlers[signum] = handle_exit
+        signal.signal(signum, close_streams_and_exit)
+
+
+def restore_signal_handlers():
+    while server_signal_handlers:
+        signal.signal(*server_signal_handlers.popitem())
+
+
+async def close_pool():
+    # Ends the event streams still open, when no signal has ended them already
+    broadcaster.close()
+    if write_queue is not None:
+        # Commits the writes still queued; close() joins the writer thread, so it runs off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, write_queue.close)
+    await pool.close_all()
+    restore_signal_handlers()
+
+
+# close_all() of the pool a new app replaces. aiosqlite runs each connection on its own thread, so the
+# connections can be closed from any event loop: a task on the running one, or a private loop when there
+# is none (as when gunicorn calls create_app() after the module-level app was built at import).
+def close_replaced_pool(replaced):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(replaced.close_all())
+        finally:
+            loop.close()
+        return
+    closing = loop.create_task(replaced.close_all())
+    closing_pools.add(closing)
+    closing.add_done_callback(closing_pools.discard)
+
+
+def create_app(config=None):
+    """
+    Build the async application; settings work as in rest_application.create_app().
+
+    The schema is brought up to date when serving starts (ensure_schema). Connections are opened on
+    first use, on the serving event loop, and closed when serving stops, after the write queue (if
+    WRITE_QUEUE_ENABLED) has committed what it still holds.
+    """
+    global pool, write_queue, hot_tier
+    app = Quart(__name__)
+    app.config.update(DATABASE=DATABASE, POOL_SIZE=POOL_SIZE, STATEMENT_CACHE_SIZE=STATEMENT_CACHE_SIZE,
+                      RESPONSE_CACHE_ENABLED=True, FAST_JSON=True, WRITE_QUEUE_ENABLED=False,
+                      WRITE_QUEUE_DELAY=WRITE_QUEUE_DELAY, WRITE_QUEUE_MAX_BATCH=WRITE_QUEUE_MAX_BATCH,
+                      HOT_TIER_ENABLED=False, HOT_TIER_TTL=HOT_TIER_TTL, SCHEMA_CHECK_ENABLED=True)
+    app.config.from_prefixed_env('SPORTSBOOK')
+    if config:
+        app.config.update(config)
+    use_fast_json(app)
+
+    if pool is not None:
+        close_replaced_pool(pool)
+    pool = AsyncConnectionPool(app.config['DATABASE'], max_size=app.config['POOL_SIZE'], pragmas=STORAGE_PROFILE,
+                               cached_statements=app.config['STATEMENT_CACHE_SIZE'])
+    if write_queue is not None:
+        write_queue.close()
+    write_queue = None
+    if app.config['WRITE_QUEUE_ENABLED']:
+        write_queue = WriteQueue(app.config['DATABASE'], max_delay=app.config['WRITE_QUEUE_DELAY'],
+                                 max_batch=app.config['WRITE_QUEUE_MAX_BATCH'])
+    if hot_tier is not None:
+        hot_tier.close()
+    hot_tier = None
+    if app.config['HOT_TIER_ENABLED']:
+        hot_tier = HotTier(app.config['DATABASE'], ttl=app.config['HOT_TIER_TTL'], pragmas=STORAGE_PROFILE)
+    app.register_blueprint(api)
+    app.teardown_appcontext(release_db)
+    app.before_serving(ensure_schema)
+    app.before_serving(end_streams_on_exit)
+    app.after_serving(close_pool)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
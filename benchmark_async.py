@@ -0,0 +1,126 @@
+"""
+Concurrency scaling of the sync (gunicorn gthread) and async (uvicorn + Quart) variants of the API.
+
+Each server runs one worker process on a scratch database. For every client count, that many
+keep-alive connections are opened at once and each sends GET /events/<id>/selections back to back
+for the given time; throughput, latency percentiles and failed requests are reported per variant.
+The response cache is off unless --cache is passed, so every request is a database round trip.
+Run with:
+
+    python benchmark_async.py [--clients 100 1000 2000] [--seconds 10] [--threads 8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_serving import NUM_EVENTS, build_database, stop_server
+
+PORTS = {'sync': 5001, 'async': 5002}
+
+
+def server_command(variant, threads):
+    if variant == 'sync':
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{PORTS[variant]}",
+                '--workers', '1', '--threads', str(threads), '--worker-connections', '10000', '--backlog', '4096']
+    return [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(PORTS[variant]),
+            '--backlog', '4096', '--no-access-log', 'async_rest_application:app']
+
+
+async def wait_until_up(port, deadline):
+    while time.time() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def get(reader, writer, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def client(port, stop_at, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        errors.append('connect')
+        return
+    try:
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            status = await get(reader, writer, f"/events/{random.randint(1, NUM_EVENTS)}/selections")
+            if status != 200:
+                errors.append(status)
+            latencies.append(time.perf_counter() - start)
+    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+        errors.append('connection')
+    finally:
+        writer.close()
+
+
+async def run(port, clients, seconds):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    stop_at = start + seconds
+    await asyncio.gather(*(client(port, stop_at, latencies, errors) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests/s': len(latencies) / elapsed,
+        'p50 ms': latencies[len(latencies) // 2] * 1000 if latencies else float('nan'),
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan'),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--variants', nargs='+', choices=sorted(PORTS), default=['sync', 'async'])
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000, 2000])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--threads', type=int, default=8, help='Threads of the sync worker, and pool size of both')
+    parser.add_argument('--cache', action='store_true', help='Leave the response cache on')
+    args = parser.parse_args()
+
+    for variant in args.variants:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'bench.db')
+        build_database(path)
+        env = dict(os.environ, SPORTSBOOK_DATABASE=path, SPORTSBOOK_POOL_SIZE=str(args.threads),
+                   SPORTSBOOK_RESPONSE_CACHE_ENABLED='true' if args.cache else 'false')
+        process = subprocess.Popen(server_command(variant, args.threads), env=env, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, start_new_session=True)
+        try:
+            asyncio.run(wait_until_up(PORTS[variant], time.time() + 30))
+            for clients in args.clients:
+                result = asyncio.run(run(PORTS[variant], clients, args.seconds))
+                print(f"{variant:5} {clients:5} clients  requests/s={result['requests/s']:7.0f}  "
+                      f"p50={result['p50 ms']:7.1f}ms  p99={result['p99 ms']:8.1f}ms  errors={result['errors']}")
+        finally:
+            stop_server(process)
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
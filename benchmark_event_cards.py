@@ -0,0 +1,90 @@
+"""
+Cost of building an event card (events with their selections) with and without ?include=selections.
+
+Builds a card of 500 events with 3 selections each and reads it through the Flask test client
+(response cache off, one pooled connection, so every SQL statement is counted):
+
+    n+1      GET /events, then GET /events/<id>/selections for every event
+    include  GET /events?include=selections
+
+Reports HTTP requests, SQL statements and milliseconds per card. Run with:
+
+    python benchmark_event_cards.py [--events 500] [--selections-per-event 3] [--repeat 20]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import model
+import rest_application
+from set_up_database import create_database_and_tables
+
+
+def build_database(path, events, selections_per_event):
+    create_database_and_tables(path)
+    conn = sqlite3.connect(path)
+    model.create_sport(conn, 'Football', 'football', True)
+    model.create_event_many(conn, [(f'Event {i}', f'event-{i}', True, 'preplay', 1, 'Pending',
+                                    '2023-07-10 20:00:00', None) for i in range(events)])
+    model.create_selection_many(conn, [(f'Selection {i}', i // selections_per_event + 1, 2.0, True, 'Unsettled')
+                                       for i in range(events * selections_per_event)])
+    conn.close()
+
+
+def n_plus_one(client):
+    events = client.get('/events?sport_id=1').get_json()['events']
+    card = [(event, client.get(f"/events/{event[0]}/selections").get_json()['selections']) for event in events]
+    return 1 + len(events), card
+
+
+def include(client):
+    card = client.get('/events?sport_id=1&include=selections').get_json()['events']
+    return 1, card
+
+
+def run(client, statements, read, repeat):
+    requests = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        requests, card = read(client)
+    elapsed = time.perf_counter() - start
+    count = len(statements)
+    statements.clear()
+    return requests, count // repeat, elapsed / repeat * 1000, card
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--selections-per-event', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    build_database(path, args.events, args.selections_per_event)
+    app = rest_application.create_app({'DATABASE': path, 'POOL_SIZE': 1, 'RESPONSE_CACHE_ENABLED': False})
+    try:
+        statements = []
+        conn = rest_application.pool.acquire()
+        conn.set_trace_callback(statements.append)
+        conn.close()
+
+        client = app.test_client()
+        for name, read in (('n+1', n_plus_one), ('include', include)):
+            read(client)
+            statements.clear()
+            requests, count, milliseconds, card = run(client, statements, read, args.repeat)
+            selections = sum(len(entry[1] if name == 'n+1' else entry['selections']) for entry in card)
+            print(f"{name:8} events={len(card)}  selections={selections}  HTTP requests={requests:4}  "
+                  f"SQL statements={count:4}  ms/card={milliseconds:8.2f}")
+    finally:
+        rest_application.pool.close_all()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
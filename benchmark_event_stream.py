@@ -0,0 +1,112 @@
+"""
+Load test for the /events/<id>/stream fan-out.
+
+One writer pushes selection price updates through model.update_selection (so the messages are built
+by the same listener the REST app uses) while N subscriber threads block on the event's channel,
+as each streaming request does in a threaded server. Reports delivery throughput and the latency
+between a write and the moment each subscriber sees it. Run with:
+
+    python benchmark_event_stream.py [--subscribers 100 1000 5000] [--messages 200]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import model
+import rest_application
+from set_up_database import create_database_and_tables
+
+EVENT_ID = 1
+
+
+def build_database(path):
+    create_database_and_tables(path)
+    conn = sqlite3.connect(path)
+    model.create_sport(conn, 'Football', 'football', True)
+    model.create_event(conn, 'Final', 'final', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', None)
+    model.create_selection_many(conn, [(f'Selection {i}', EVENT_ID, 2.0, True, 'Unsettled') for i in range(10)])
+    conn.close()
+
+
+def run(path, subscribers, messages):
+    broadcaster = rest_application.broadcaster
+    published_at = {}
+    latencies = []
+    resets = []
+    received = [0] * subscribers
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1)
+
+    def subscriber(index):
+        subscription = broadcaster.subscribe(EVENT_ID)
+        own = []
+        ready.wait()
+        while received[index] < messages:
+            for message in subscription.wait(timeout=5):
+                if message is rest_application.Broadcaster.RESET:
+                    # Fell behind by more than STREAM_HISTORY messages; a real client would reload here
+                    received[index] = messages
+                    with lock:
+                        resets.append(index)
+                    break
+                now = time.perf_counter()
+                price = message.split('"price": ')[1].split(',')[0]
+                own.append(now - published_at[price])
+                received[index] += 1
+        subscription.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=subscriber, args=(index,), daemon=True) for index in range(subscribers)]
+    for t in threads:
+        t.start()
+    ready.wait()
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    start = time.perf_counter()
+    for number in range(messages):
+        price = 1.0 + number / 1000
+        published_at[repr(price)] = time.perf_counter()
+        model.update_selection(conn, number % 10 + 1, {'name': 'Selection', 'event_id': EVENT_ID, 'price': price,
+                                                        'active': True, 'outcome': 'Unsettled'})
+        # Spread the writes out a little, as a feed would, instead of one burst
+        time.sleep(0.001)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    latencies.sort()
+    return {
+        'deliveries/s': subscribers * messages / elapsed,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'resets': len(resets),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    build_database(path)
+    try:
+        for subscribers in args.subscribers:
+            result = run(path, subscribers, args.messages)
+            print(f"{subscribers:6} subscribers  deliveries/s={result['deliveries/s']:,.0f}  "
+                  f"p50={result['p50 ms']:.1f}ms  p99={result['p99 ms']:.1f}ms  resets={result['resets']}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
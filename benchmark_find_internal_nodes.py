@@ -0,0 +1,79 @@
+"""
+Time to count the internal nodes of parent arrays from 10^3 to 10^7 nodes.
+
+Builds a random tree per size (node 0 is the root, every other node's parent is an earlier node) and counts
+its internal nodes with:
+
+    quadratic  the original `node in tree` loop, only up to --quadratic-max nodes
+    set        find_internal_nodes_num on a list
+    numpy      find_internal_nodes_num on a NumPy array (skipped without NumPy)
+    file       find_internal_nodes_in_file on the array written to disk, read in chunks through a memory map
+
+and checks that all of them agree. Run with:
+
+    python benchmark_find_internal_nodes.py [--sizes 1000 10000 100000 1000000 10000000] [--quadratic-max 10000]
+"""
+import argparse
+import array
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from find_internal_nodes import find_internal_nodes_in_file, find_internal_nodes_num, numpy, write_parent_array
+
+
+def quadratic_find_internal_nodes_num(tree):
+    internal_nodes = 0
+    for node in range(len(tree)):
+        if node in tree:
+            internal_nodes += 1
+    return internal_nodes
+
+
+def random_tree(size, seed=1):
+    rng = random.Random(seed)
+    tree = array.array('i', [-1])
+    tree.extend(int(rng.random() * node) for node in range(1, size))
+    return tree
+
+
+def timed(count):
+    start = time.perf_counter()
+    result = count()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+    parser.add_argument('--quadratic-max', type=int, default=10 ** 4)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'tree.bin')
+    try:
+        for size in args.sizes:
+            tree = random_tree(size)
+            write_parent_array(path, tree)
+            tree_list = tree.tolist()
+            runs = {'set': lambda: find_internal_nodes_num(tree_list),
+                    'file': lambda: find_internal_nodes_in_file(path)}
+            if size <= args.quadratic_max:
+                runs['quadratic'] = lambda: quadratic_find_internal_nodes_num(tree_list)
+            if numpy is not None:
+                tree_array = numpy.frombuffer(tree, dtype=numpy.int32)
+                runs['numpy'] = lambda: find_internal_nodes_num(tree_array)
+
+            results = {}
+            for name, count in runs.items():
+                results[name], elapsed = timed(count)
+                print(f"n={size:>10,}  {name:9} internal={results[name]:>10,}  {elapsed * 1000:10.2f} ms")
+            assert len(set(results.values())) == 1, results
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
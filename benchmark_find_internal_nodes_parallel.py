@@ -0,0 +1,49 @@
+"""
+Scaling of the parallel internal node count across process counts.
+
+Builds one random tree of --size nodes (as benchmark_find_internal_nodes.py does) and counts its internal
+nodes serially, then with find_internal_nodes_parallel (shared memory) and find_internal_nodes_in_file
+(memory-mapped file, one map per process) for each of --processes, checking every result against the serial
+count. Reports the time and the speedup over the serial run of the same input; a speedup needs as many
+free CPU cores as processes. Run with:
+
+    python benchmark_find_internal_nodes_parallel.py [--size 10000000] [--processes 1 2 4 8]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from benchmark_find_internal_nodes import random_tree, timed
+from find_internal_nodes import (find_internal_nodes_in_file, find_internal_nodes_num, find_internal_nodes_parallel,
+                                 write_parent_array)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=10 ** 7)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"n={args.size:,}  {os.cpu_count()} CPUs")
+    tree = random_tree(args.size)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'tree.bin')
+    try:
+        write_parent_array(path, tree)
+        expected, serial = timed(lambda: find_internal_nodes_num(tree))
+        _, serial_file = timed(lambda: find_internal_nodes_in_file(path))
+        print(f"serial     memory {serial * 1000:10.2f} ms  file {serial_file * 1000:10.2f} ms  internal={expected:,}")
+        for processes in args.processes:
+            result, elapsed = timed(lambda: find_internal_nodes_parallel(tree, processes))
+            assert result == expected, (processes, result, expected)
+            result, elapsed_file = timed(lambda: find_internal_nodes_in_file(path, processes=processes))
+            assert result == expected, (processes, result, expected)
+            print(f"{processes:3} procs  memory {elapsed * 1000:10.2f} ms ({serial / elapsed:4.2f}x)  "
+                  f"file {elapsed_file * 1000:10.2f} ms ({serial_file / elapsed_file:4.2f}x)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Latency of active=true searches answered by SQLite versus the in-memory hot tier.
+
+Builds a database of --events events with --selections-per-event selections each, --active-share of them
+active, and runs each search --repeat times through model.search_table on one connection and through
+HotTier.search:
+
+    selections of an event   active=1, event_id=<random event>
+    events of a sport        active=1, sport_id=<random sport>, fields=id,name
+    page of selections       active=1, limit=100, after_id=<random id>
+    selections at a price    active=1, price=2.5, limit=100
+
+and checks that both return the same rows. Reports microseconds per search. Run with:
+
+    python benchmark_hot_tier.py [--events 20000] [--selections-per-event 10] [--active-share 0.2]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import model
+from hot_tier import HotTier
+from set_up_database import create_database_and_tables
+
+SPORTS = 20
+
+
+def build_database(path, events, selections_per_event, active_share, rng):
+    create_database_and_tables(path)
+    conn = sqlite3.connect(path)
+    model.create_sport_many(conn, [(f'Sport {i}', f'sport-{i}', True) for i in range(SPORTS)])
+    model.create_event_many(conn, [(f'Event {i}', f'event-{i}', rng.random() < active_share, 'preplay',
+                                    i % SPORTS + 1, 'Pending', '2023-07-10 20:00:00', None)
+                                   for i in range(events)])
+    model.create_selection_many(conn, [(f'Selection {i}', i // selections_per_event + 1, 1.5 + i % 4,
+                                        rng.random() < active_share, 'Unsettled')
+                                       for i in range(events * selections_per_event)])
+    return conn
+
+
+def timed(search, arguments):
+    start = time.perf_counter()
+    results = [search(*args) for args in arguments]
+    return results, (time.perf_counter() - start) / len(arguments) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--selections-per-event', type=int, default=10)
+    parser.add_argument('--active-share', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    conn = build_database(path, args.events, args.selections_per_event, args.active_share, rng)
+    tier = HotTier(path)
+    try:
+        start = time.perf_counter()
+        tier.load()
+        print(f"loaded {tier.stats()['rows']} in {time.perf_counter() - start:.2f} s")
+
+        selections = args.events * args.selections_per_event
+        searches = {
+            'selections of an event': [('Selections', {'active': 1, 'event_id': str(rng.randint(1, args.events))}, {})
+                                       for _ in range(args.repeat)],
+            'events of a sport': [('Events', {'active': 1, 'sport_id': str(rng.randint(1, SPORTS))},
+                                   {'fields': ('id', 'name')}) for _ in range(args.repeat)],
+            'page of selections': [('Selections', {'active': 1}, {'limit': 100, 'after_id': rng.randrange(selections)})
+                                   for _ in range(args.repeat)],
+            'selections at a price': [('Selections', {'active': 1, 'price': '2.5'}, {'limit': 100})
+                                      for _ in range(args.repeat)],
+        }
+        for name, arguments in searches.items():
+            expected, sqlite_us = timed(lambda table, filters, kwargs:
+                                        model.search_table(conn, table, filters, **kwargs), arguments)
+            rows, tier_us = timed(lambda table, filters, kwargs: tier.search(table, filters, **kwargs), arguments)
+            # Without paging SQLite returns rows in the order of the index it used; the hot tier in id order
+            assert [sorted(map(repr, r)) for r in rows] == [sorted(map(repr, r)) for r in expected], name
+            print(f"{name:24} sqlite {sqlite_us:9.1f} us  hot tier {tier_us:9.1f} us")
+    finally:
+        tier.close()
+        conn.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
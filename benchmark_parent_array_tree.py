@@ -0,0 +1,72 @@
+"""
+Build time, memory and query throughput of ParentArrayTree on multi-million-node trees.
+
+Builds a random market hierarchy per size: --sports sports, each with competitions, events and markets
+below it (4 levels, as sport -> competition -> event -> market), the nodes numbered in shuffled order.
+For each tree reports the build time, the bytes its arrays hold, and the throughput of --queries random
+queries through the batch methods (depths, subtree_sizes, internal_flags, lcas), and checks
+internal_count against find_internal_nodes_num. Run with:
+
+    python benchmark_parent_array_tree.py [--sizes 1000000 4000000] [--queries 100000]
+"""
+import argparse
+import random
+import time
+from array import array
+
+from find_internal_nodes import find_internal_nodes_num
+from parent_array_tree import ParentArrayTree
+
+# Children per node at each level below a sport: competitions, events, markets
+FAN_OUT = (20, 50)
+
+
+def market_hierarchy(size, sports, rng):
+    """Parent array of about size nodes: sports are roots, and every other node hangs off the level above."""
+    labels = list(range(size))
+    rng.shuffle(labels)
+    parents = array('q', [-1]) * size
+    level = labels[:sports]
+    placed = sports
+    for fan_out in FAN_OUT + (None,):
+        count = size - placed if fan_out is None else min(len(level) * fan_out, size - placed)
+        below = labels[placed:placed + count]
+        for node in below:
+            parents[node] = level[rng.randrange(len(level))]
+        placed += count
+        level = below
+    return parents
+
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 4000000])
+    parser.add_argument('--sports', type=int, default=40)
+    parser.add_argument('--queries', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    for size in args.sizes:
+        parents = market_hierarchy(size, args.sports, rng)
+        tree, elapsed = timed(lambda: ParentArrayTree(parents))
+        print(f"n={size:>10,}  build {elapsed:6.2f} s  height={tree.height}  internal={tree.internal_count:,}  "
+              f"{tree.nbytes() / size:.0f} bytes/node")
+        assert tree.internal_count == find_internal_nodes_num(parents)
+
+        nodes = [rng.randrange(size) for _ in range(args.queries)]
+        pairs = [(rng.randrange(size), rng.randrange(size)) for _ in range(args.queries)]
+        tree.lca(0, 0)  # builds the lifting table, timed separately from the queries
+        for name, run in (('depths', lambda: tree.depths(nodes)), ('subtree_sizes', lambda: tree.subtree_sizes(nodes)),
+                          ('internal_flags', lambda: tree.internal_flags(nodes)), ('lcas', lambda: tree.lcas(pairs))):
+            result, elapsed = timed(run)
+            print(f"             {name:15} {args.queries / elapsed:14,.0f} queries/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Search throughput with and without canonical query shapes.
+
+Runs random equality searches on Selections whose filters are a random subset of its columns given in
+random order, as query strings from different clients are. 'unordered' builds the SQL in the filters'
+own order (as before the query builder), so every ordering is a different statement; 'canonical' goes
+through model.search_query. Reports searches/s and how many distinct SQL strings each produced, for a
+few sizes of the connection's statement cache. Run with:
+
+    python benchmark_query_shapes.py [--searches 50000] [--cached-statements 16 128 256]
+"""
+import argparse
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import model
+from set_up_database import STORAGE_PROFILE, apply_storage_profile, create_database_and_tables
+
+FILTER_VALUES = {'name': ['Home', 'Away', 'Draw'], 'event_id': list(range(1, 201)), 'price': [1.5, 2.0, 3.0],
+                 'active': [0, 1], 'outcome': ['Unsettled', 'Win', 'Lose']}
+
+
+def unordered_query(table, filters):
+    return f"SELECT * FROM {table} WHERE " + " AND ".join(f"{key} = ?" for key in filters), tuple(filters.values())
+
+
+def build_database(path):
+    create_database_and_tables(path)
+    conn = sqlite3.connect(path)
+    model.create_sport(conn, 'Football', 'football', True)
+    model.create_event_many(conn, [(f'Event {i}', f'event-{i}', True, 'preplay', 1, 'Pending',
+                                    '2023-07-10 20:00:00', None) for i in range(200)])
+    model.create_selection_many(conn, [(random.choice(FILTER_VALUES['name']), i // 3 + 1,
+                                        random.choice(FILTER_VALUES['price']), i % 2,
+                                        random.choice(FILTER_VALUES['outcome'])) for i in range(600)])
+    conn.close()
+
+
+def random_filters(rng):
+    columns = rng.sample(list(FILTER_VALUES), rng.randint(1, len(FILTER_VALUES)))
+    return {column: rng.choice(FILTER_VALUES[column]) for column in columns}
+
+
+def run(path, build, cached_statements, searches):
+    conn = sqlite3.connect(path, cached_statements=cached_statements)
+    apply_storage_profile(conn, STORAGE_PROFILE)
+    rng = random.Random(1)
+    workload = [random_filters(rng) for _ in range(searches)]
+    distinct = set()
+
+    start = time.perf_counter()
+    for filters in workload:
+        query, params = build('Selections', filters)
+        distinct.add(query)
+        conn.execute(query, params).fetchall()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return searches / elapsed, len(distinct)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--searches', type=int, default=50000)
+    parser.add_argument('--cached-statements', type=int, nargs='+', default=[16, 128, 256])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    build_database(path)
+    try:
+        builders = {'unordered': unordered_query, 'canonical': model.search_query}
+        for cached_statements, (name, build) in itertools.product(args.cached_statements, builders.items()):
+            model.query_builder.clear()
+            rate, distinct = run(path, build, cached_statements, args.searches)
+            print(f"cached_statements={cached_statements:4}  {name:9}  searches/s={rate:8.0f}  "
+                  f"distinct SQL={distinct}")
+        print(f"query shape cache: {model.query_builder.stats()}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Requests/sec and latency of the API under the dev server and under gunicorn.
+
+Starts the server on a scratch copy of the database, runs a mixed load (odds reads plus a share of
+price updates) from keep-alive client threads, then stops it:
+
+    dev       python rest_application.py  (Werkzeug, debug and reloader on)
+    gunicorn  gunicorn -c gunicorn.conf.py
+
+Run with:
+
+    python benchmark_serving.py [--modes dev gunicorn] [--clients 16] [--seconds 10]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import model
+from set_up_database import create_database_and_tables
+
+NUM_EVENTS = 200
+SELECTIONS_PER_EVENT = 3
+PORTS = {'dev': 5000, 'gunicorn': 5001}
+
+
+def build_database(path):
+    create_database_and_tables(path)
+    conn = sqlite3.connect(path)
+    model.create_sport(conn, 'Football', 'football', True)
+    model.create_event_many(conn, [(f'Event {i}', f'event-{i}', True, 'preplay', 1, 'Pending',
+                                    '2023-07-10 20:00:00', None) for i in range(NUM_EVENTS)])
+    model.create_selection_many(conn, [(f'Selection {i}', i // SELECTIONS_PER_EVENT + 1, 2.0, True, 'Unsettled')
+                                       for i in range(NUM_EVENTS * SELECTIONS_PER_EVENT)])
+    conn.close()
+
+
+def start_server(mode, path):
+    env = dict(os.environ, SPORTSBOOK_DATABASE=path)
+    if mode == 'dev':
+        command = [sys.executable, 'rest_application.py']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{PORTS[mode]}"]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORTS[mode], timeout=1)
+            conn.request('GET', '/stats')
+            conn.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait(timeout=60)
+
+
+def request(port, connection, method, path, body=None):
+    for attempt in range(2):
+        if connection[0] is None:
+            connection[0] = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection[0].request(method, path, body=body, headers=headers)
+            response = connection[0].getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            connection[0].close()
+            connection[0] = None
+    return None
+
+
+def run(port, clients, seconds, write_ratio):
+    stop = threading.Event()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        connection = [None]
+        own = []
+        own_errors = 0
+        while not stop.is_set():
+            if random.random() < write_ratio:
+                selection_id = random.randint(1, NUM_EVENTS * SELECTIONS_PER_EVENT)
+                method, path = 'PATCH', '/selections/prices'
+                body = json.dumps([[selection_id, round(random.uniform(1.1, 10.0), 2)]])
+            else:
+                method, body = 'GET', None
+                path = random.choice([f"/events/{random.randint(1, NUM_EVENTS)}/selections", '/events?active=true',
+                                      f"/selections?event_id={random.randint(1, NUM_EVENTS)}"])
+            start = time.perf_counter()
+            status = request(port, connection, method, path, body)
+            own.append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                own_errors += 1
+        with lock:
+            latencies.extend(own)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    return {
+        'requests/s': len(latencies) / seconds,
+        'p50 ms': latencies[len(latencies) // 2] * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--modes', nargs='+', choices=sorted(PORTS), default=['dev', 'gunicorn'])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'bench.db')
+        build_database(path)
+        process = start_server(mode, path)
+        try:
+            result = run(PORTS[mode], args.clients, args.seconds, args.write_ratio)
+        finally:
+            stop_server(process)
+            shutil.rmtree(directory)
+        print(f"{mode:9} requests/s={result['requests/s']:8.0f}  p50={result['p50 ms']:6.1f}ms  "
+              f"p99={result['p99 ms']:7.1f}ms  errors={result['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Mixed read/write throughput of the sportsbook database with and without STORAGE_PROFILE.
+
+One writer thread keeps updating selection prices through model.update_selection while reader
+threads run the /events/<id>/selections and /events?active= queries, which is the shape of our
+traffic when odds are moving. Run with:
+
+    python benchmark_storage_profile.py [--seconds 5] [--readers 4]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import model
+from set_up_database import create_database_and_tables, apply_storage_profile, STORAGE_PROFILE
+
+NUM_EVENTS = 2000
+SELECTIONS_PER_EVENT = 3
+
+# SQLite's defaults, i.e. what set_up_database produced before the storage profile existed
+DEFAULT_PROFILE = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def build_database(path, profile):
+    create_database_and_tables(path, profile)
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("INSERT INTO Sports (name, slug, active) VALUES ('Football', 'football', 1)")
+    c.executemany(
+        "INSERT INTO Events (name, slug, active, type, sport_id, status, scheduled_start, actual_start) "
+        "VALUES (?, ?, 1, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', NULL)",
+        [(f'Event {i}', f'event-{i}') for i in range(NUM_EVENTS)]
+    )
+    c.executemany(
+        "INSERT INTO Selections (name, event_id, price, active, outcome) VALUES (?, ?, ?, 1, 'Unsettled')",
+        [(f'Selection {i}', i // SELECTIONS_PER_EVENT + 1, 2.0) for i in range(NUM_EVENTS * SELECTIONS_PER_EVENT)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(path, profile, seconds, readers):
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def connect():
+        conn = sqlite3.connect(path, timeout=5)
+        apply_storage_profile(conn, profile)
+        return conn
+
+    def reader():
+        conn = connect()
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                event_id = random.randint(1, NUM_EVENTS)
+                model.search_selections(conn, {'event_id': event_id})
+                model.search_events(conn, {'active': 1, 'sport_id': 1})
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        conn.close()
+        with lock:
+            counts['reads'] += done
+            counts['errors'] += errors
+
+    def writer():
+        conn = connect()
+        done = errors = 0
+        while not stop.is_set():
+            selection_id = random.randint(1, NUM_EVENTS * SELECTIONS_PER_EVENT)
+            data = {'name': f'Selection {selection_id}', 'event_id': (selection_id - 1) // SELECTIONS_PER_EVENT + 1,
+                    'price': round(random.uniform(1.1, 10.0), 2), 'active': True, 'outcome': 'Unsettled'}
+            try:
+                model.update_selection(conn, selection_id, data)
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        conn.close()
+        with lock:
+            counts['writes'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return {key: value / seconds if key != 'errors' else value for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    for label, profile in (('default (rollback journal)', DEFAULT_PROFILE), ('STORAGE_PROFILE (WAL)', STORAGE_PROFILE)):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'bench.db')
+        build_database(path, profile)
+        result = run(path, profile, args.seconds, args.readers)
+        print(f"{label:28} reads/s={result['reads']:10.0f} writes/s={result['writes']:8.0f} "
+              f"errors={result['errors']}")
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+How many /events/<id>/stream subscribers a gunicorn worker serves, end to end over HTTP.
+
+Starts gunicorn -c gunicorn.conf.py with one worker on a scratch copy of the database, in each mode:
+
+    gthread  the Flask app on SPORTSBOOK_THREADS request threads (the default configuration)
+    async    the Quart app on a uvicorn worker (SPORTSBOOK_ASYNC=true)
+
+opens --subscribers SSE connections to one event from a single selector loop, then sends --messages
+price updates through PATCH /selections/prices on the same server. Reports how many subscribers got
+their stream opened, how many updates the server accepted, and the share and latency of deliveries.
+One worker, because stream messages only reach subscribers of the worker process that made the write.
+Run with:
+
+    python benchmark_stream_serving.py [--modes gthread async] [--subscribers 10 100 1000] [--messages 20]
+"""
+import argparse
+import http.client
+import json
+import os
+import resource
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark_serving import build_database
+
+PORT = 5002
+MODES = {'gthread': {}, 'async': {'SPORTSBOOK_ASYNC': 'true'}}
+OPENED = b'retry:'
+MESSAGE = b'event: selection'
+# Seconds to wait for the streams to open and for each update to reach every subscriber
+TIMEOUT = 10.0
+
+
+def start_server(mode, path):
+    with socket.socket() as probe:
+        if probe.connect_ex(('127.0.0.1', PORT)) == 0:
+            raise RuntimeError(f"port {PORT} is already in use")
+    env = dict(os.environ, SPORTSBOOK_DATABASE=path, SPORTSBOOK_WORKERS='1', **MODES[mode])
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{PORT}']
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            conn.request('GET', '/stats')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+class Subscriber:
+    def __init__(self, selector):
+        self.sock = socket.create_connection(('127.0.0.1', PORT))
+        self.sock.sendall(b'GET /events/1/stream HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        self.sock.setblocking(False)
+        self.opened = False
+        self.received = 0
+        self.tail = b''
+        selector.register(self.sock, selectors.EVENT_READ, self)
+
+    def read(self):
+        data = self.sock.recv(65536)
+        if not data:
+            return False
+        # Prefix the end of the previous read, so a marker split across two reads is still found; it is
+        # shorter than a marker, so no marker is counted twice
+        data = self.tail + data
+        self.tail = data[1 - len(MESSAGE):]
+        self.opened = self.opened or OPENED in data
+        self.received += data.count(MESSAGE)
+        return True
+
+
+def read_ready(selector, timeout=0.05):
+    for key, events in selector.select(timeout=timeout):
+        if not key.data.read():
+            selector.unregister(key.fileobj)
+
+
+def poll(selector, until, deadline):
+    while not until() and time.monotonic() < deadline:
+        read_ready(selector)
+
+
+def update(selection_id, price, accepted):
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=TIMEOUT)
+        conn.request('PATCH', '/selections/prices', body=json.dumps([[selection_id, price]]),
+                     headers={'Content-Type': 'application/json'})
+        accepted.append(conn.getresponse().status == 200)
+        conn.close()
+    except OSError:
+        accepted.append(False)
+
+
+def run(subscribers, messages):
+    selector = selectors.DefaultSelector()
+    clients = [Subscriber(selector) for _ in range(subscribers)]
+    try:
+        poll(selector, lambda: all(client.opened for client in clients), time.monotonic() + TIMEOUT)
+        opened = [client for client in clients if client.opened]
+        accepted, latencies, missed = [], [], 0
+        for number in range(1, messages + 1):
+            # Selections 1 to 3 belong to event 1
+            writer = threading.Thread(target=update, args=(number % 3 + 1, 1.5 + number / 100, accepted))
+            start = time.monotonic()
+            writer.start()
+            waiting = set(opened)
+            deadline = start + TIMEOUT
+            while waiting and time.monotonic() < deadline:
+                read_ready(selector)
+                now = time.monotonic()
+                for client in [client for client in waiting if client.received >= number]:
+                    latencies.append(now - start)
+                    waiting.discard(client)
+                if not writer.is_alive() and not accepted[-1]:
+                    break
+            missed += len(waiting)
+            writer.join()
+            for client in waiting:
+                client.received = number  # count the next message from here on
+    finally:
+        for client in clients:
+            client.sock.close()
+        selector.close()
+
+    latencies.sort()
+    expected = len(opened) * messages
+    return {
+        'opened': len(opened),
+        'accepted': sum(accepted),
+        'delivered': (expected - missed) / expected if expected else 0.0,
+        'p50 ms': latencies[len(latencies) // 2] * 1000 if latencies else None,
+        'p99 ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['gthread', 'async'])
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages', type=int, default=20)
+    args = parser.parse_args()
+
+    # Every subscriber is a socket on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    for mode in args.modes:
+        for subscribers in args.subscribers:
+            directory = tempfile.mkdtemp()
+            path = os.path.join(directory, 'bench.db')
+            build_database(path)
+            process = start_server(mode, path)
+            try:
+                result = run(subscribers, args.messages)
+            finally:
+                stop_server(process)
+                shutil.rmtree(directory)
+            latency = (f"p50={result['p50 ms']:7.1f}ms  p99={result['p99 ms']:7.1f}ms"
+                       if result['p50 ms'] is not None else 'no deliveries')
+            print(f"{mode:8} subscribers={subscribers:>6,}  opened={result['opened']:>6,}  "
+                  f"updates accepted={result['accepted']:>3}/{args.messages}  "
+                  f"delivered={result['delivered']:6.1%}  {latency}")
+
+
+if __name__ == '__main__':
+    main()
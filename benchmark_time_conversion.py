@@ -0,0 +1,64 @@
+"""
+Time to convert a column of local timestamps to UTC, one call at a time versus convert_many_to_utc.
+
+Converts --count random '%Y-%m-%d %H:%M:%S' timestamps spread over --days days in each timezone three ways:
+
+    uncached  convert_to_utc as it was: pytz.timezone() and strptime() on every call
+    per-call  model.convert_to_utc (memoized timezone lookup)
+    batch     model.convert_many_to_utc (one offset per local day, fromisoformat parsing)
+
+and checks that all three give the same datetimes. Run with:
+
+    python benchmark_time_conversion.py [--count 1000000] [--days 365] [--timezones Europe/London ...]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+import model
+
+
+def uncached_convert_to_utc(time_str, format_str=model.TIME_FORMAT, tz_str='Europe/London'):
+    local_tz = pytz.timezone(tz_str)
+    local_dt = local_tz.localize(datetime.strptime(time_str, format_str))
+    return local_dt.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def timestamps(count, days, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    return [str(start + timedelta(seconds=rng.randrange(days * 86400))) for _ in range(count)]
+
+
+def timed(convert):
+    start = time.perf_counter()
+    result = convert()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--timezones', nargs='+', default=['Europe/London', 'America/New_York'])
+    args = parser.parse_args()
+
+    time_strs = timestamps(args.count, args.days)
+    for tz_str in args.timezones:
+        runs = {
+            'uncached': lambda: [uncached_convert_to_utc(time_str, tz_str=tz_str) for time_str in time_strs],
+            'per-call': lambda: [model.convert_to_utc(time_str, tz_str=tz_str) for time_str in time_strs],
+            'batch': lambda: model.convert_many_to_utc(time_strs, tz_str=tz_str),
+        }
+        results = {}
+        for name, convert in runs.items():
+            results[name], elapsed = timed(convert)
+            print(f"{tz_str:18} {name:9} {args.count / elapsed:12,.0f} timestamps/s  {elapsed:7.2f} s")
+        assert results['uncached'] == results['per-call'] == results['batch'], tz_str
+
+
+if __name__ == '__main__':
+    main()
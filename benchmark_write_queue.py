@@ -0,0 +1,109 @@
+"""
+Throughput of concurrent single-row writes, each committing on its own versus group-committed by WriteQueue.
+
+Starts --threads threads that each update --writes selection prices with model.update_selection_prices, one
+row per call, in three ways:
+
+    direct         every thread on its own connection, STORAGE_PROFILE (synchronous=NORMAL)
+    direct-full    the same with synchronous=FULL, i.e. one fsync per acknowledged write
+    queued         every call through one WriteQueue (synchronous=FULL, one fsync per batch)
+
+Reports writes per second and, for the queue, batches committed and the largest batch. Run with:
+
+    python benchmark_write_queue.py [--threads 1 8 32] [--writes 200] [--max-delay 0.002]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import model
+from set_up_database import STORAGE_PROFILE, create_database_and_tables
+from write_queue import WRITER_PROFILE, WriteQueue
+
+
+def build_database(path, selections):
+    create_database_and_tables(path)
+    conn = sqlite3.connect(path)
+    model.create_sport(conn, 'Football', 'football', True)
+    model.create_event(conn, 'Final', 'final', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', None)
+    model.create_selection_many(conn, [(f'Selection {i}', 1, 2.0, True, 'Unsettled') for i in range(selections)])
+    conn.close()
+
+
+def connect(path, pragmas):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def run_threads(threads, writes, write):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(number):
+        barrier.wait()
+        for i in range(writes):
+            write(number, [(number * writes + i + 1, 2.0 + i / 100)])
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def direct(path, threads, writes, pragmas):
+    connections = [connect(path, pragmas) for _ in range(threads)]
+    try:
+        elapsed = run_threads(threads, writes,
+                              lambda number, prices: model.update_selection_prices(connections[number], prices))
+    finally:
+        for conn in connections:
+            conn.close()
+    return elapsed, ''
+
+
+def queued(path, threads, writes, max_delay):
+    write_queue = WriteQueue(path, max_delay=max_delay)
+    try:
+        elapsed = run_threads(threads, writes,
+                              lambda number, prices: write_queue.call(model.update_selection_prices, prices))
+    finally:
+        write_queue.close()
+    stats = write_queue.stats()
+    return elapsed, f"batches={stats['batches']:6}  largest batch={stats['largest_batch']:4}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--writes', type=int, default=200)
+    parser.add_argument('--max-delay', type=float, default=0.002)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    build_database(path, max(args.threads) * args.writes)
+    runs = {
+        'direct': lambda threads: direct(path, threads, args.writes, STORAGE_PROFILE),
+        'direct-full': lambda threads: direct(path, threads, args.writes, WRITER_PROFILE),
+        'queued': lambda threads: queued(path, threads, args.writes, args.max_delay),
+    }
+    try:
+        for threads in args.threads:
+            for name, run in runs.items():
+                elapsed, detail = run(threads)
+                print(f"threads={threads:3}  {name:12} {threads * args.writes / elapsed:10,.0f} writes/s  {detail}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
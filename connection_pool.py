@@ -0,0 +1,206 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled sqlite3 connection.
+
+    Everything is forwarded to the underlying connection except close(), which hands the
+    connection back to its pool instead of closing it. Calling close() more than once is safe.
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a connection returned to the pool.')
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections shared between request threads.
+
+    Connections are opened lazily up to max_size, PRAGMAs are applied once when a connection is
+    opened, and a connection that fails its health check on checkout is discarded and replaced.
+    A pool inherited through fork() starts over with fresh connections in the child process, since
+    SQLite connections must not be shared between processes.
+
+    Parameters:
+    - database (str): Path of the SQLite database file.
+    - max_size (int): Maximum number of open connections. Size it to the worker's thread count.
+    - timeout (float): Seconds to wait for a free connection before raising queue.Empty.
+    - pragmas (dict): PRAGMA name -> value applied to every new connection.
+    - cached_statements (int): Prepared statements each connection keeps, keyed by SQL text. Make it at
+      least the number of distinct query shapes the app runs, so hot queries are not re-prepared.
+    """
+
+    def __init__(self, database, max_size=8, timeout=5.0, pragmas=None, cached_statements=128):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = dict(pragmas or {})
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Signalled when a connection is returned or a slot is freed, under _lock
+        self._available = threading.Condition(self._lock)
+        self._open = 0
+        self._in_use = 0
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+        self._waits = 0
+        self._closed = False
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._discarded += 1
+            # A waiting thread can open a connection in the freed slot
+            self._available.notify()
+
+    def reset_after_fork(self):
+        """Forget the parent's connections (without closing them, they still belong to the parent)."""
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._open = self._in_use = self._created = self._reused = self._discarded = self._waits = 0
+        self._closed = False
+        self._pid = os.getpid()
+
+    def acquire(self):
+        """Check a connection out of the pool, opening a new one if the pool is not yet full."""
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        deadline = None
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open < self.max_size
+                    if can_open:
+                        self._open += 1
+                    elif deadline is None:
+                        self._waits += 1
+                        deadline = time.monotonic() + self.timeout
+                if can_open:
+                    try:
+                        conn = self._connect()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._open -= 1
+                            self._available.notify()
+                        raise
+                    with self._lock:
+                        self._created += 1
+                        self._in_use += 1
+                    return PooledConnection(self, conn)
+                self._wait_for_connection(deadline)
+                continue
+
+            if not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+            with self._lock:
+                self._reused += 1
+                self._in_use += 1
+            return PooledConnection(self, conn)
+
+    def _wait_for_connection(self, deadline):
+        """Block until a connection is idle or a slot is free, raising queue.Empty at the deadline."""
+        with self._available:
+            if not self._available.wait_for(lambda: self._idle.qsize() or self._open < self.max_size,
+                                            deadline - time.monotonic()):
+                raise queue.Empty
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything the caller left uncommitted."""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._in_use -= 1
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+        with self._available:
+            self._available.notify()
+
+    def close_all(self):
+        """Close every idle connection. Connections currently checked out are closed on release."""
+        if self._pid != os.getpid():
+            self.reset_after_fork()
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'cached_statements': self.cached_statements,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use,
+                'created': self._created,
+                'reused': self._reused,
+                'discarded': self._discarded,
+                'waits': self._waits,
+            }
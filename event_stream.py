@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+
+class Channel:
+    def __init__(self, history):
+        self.messages = deque(maxlen=history)  # (sequence, message)
+        self.sequence = 0
+        self.subscribers = 0
+        self.condition = threading.Condition()
+        # Future shared by every subscriber awaiting this channel with wait_async(), resolved on publish
+        self.waiter = None
+
+
+def wake(waiter):
+    if waiter is not None and not waiter.done():
+        waiter.get_loop().call_soon_threadsafe(resolve, waiter)
+
+
+def resolve(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Subscription:
+    """
+    A subscriber's position in a channel's message log.
+
+    wait() returns the messages published since the previous call. If the subscriber fell so far
+    behind that messages were dropped from the log, it returns [Broadcaster.RESET] instead, and the
+    subscriber should reload its state before carrying on. Once the broadcaster is closed, wait()
+    returns None and the subscriber should stop.
+
+    wait_async() is the same for subscribers running on an event loop; it parks the coroutine instead
+    of a thread. All asynchronous subscribers of a channel must run on the same loop.
+    """
+
+    def __init__(self, broadcaster, key, channel):
+        self._broadcaster = broadcaster
+        self._key = key
+        self._channel = channel
+        self._seen = channel.sequence
+        self.closed = False
+
+    def wait(self, timeout=None):
+        channel = self._channel
+        with channel.condition:
+            channel.condition.wait_for(lambda: channel.sequence > self._seen or self._broadcaster.closed, timeout)
+            return self._collect()
+
+    async def wait_async(self, timeout=None):
+        channel = self._channel
+        with channel.condition:
+            waiter = None
+            if channel.sequence == self._seen and not self._broadcaster.closed:
+                loop = asyncio.get_running_loop()
+                if channel.waiter is None or channel.waiter.get_loop() is not loop:
+                    channel.waiter = loop.create_future()
+                waiter = channel.waiter
+        if waiter is not None:
+            # asyncio.wait() leaves the shared future alone on timeout, unlike wait_for()
+            await asyncio.wait((waiter,), timeout=timeout)
+        with channel.condition:
+            return self._collect()
+
+    # Called with the channel's condition held
+    def _collect(self):
+        channel = self._channel
+        if self._broadcaster.closed:
+            return None
+        if channel.sequence == self._seen:
+            return []
+        oldest = channel.messages[0][0]
+        if oldest > self._seen + 1:
+            self._seen = channel.sequence
+            return [Broadcaster.RESET]
+        messages = [message for sequence, message in
+                    itertools.islice(channel.messages, self._seen - oldest + 1, None)]
+        self._seen = channel.sequence
+        return messages
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._broadcaster.unsubscribe(self._key)
+
+
+class Broadcaster:
+    """
+    In-process fan-out of messages to any number of subscribers per channel.
+
+    Each channel keeps one bounded log shared by all of its subscribers. publish() appends to it and
+    wakes the waiting subscribers (one shared future for those on an event loop), so its cost does not
+    depend on the number of subscribers and a message is encoded once however many clients receive it.
+    Channels exist only while somebody is subscribed; publishing to a channel nobody watches is a dict
+    lookup.
+
+    Parameters:
+    - history (int): Messages kept per channel for subscribers that are momentarily behind.
+    """
+
+    RESET = object()
+
+    def __init__(self, history=1024):
+        self.history = history
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._published = 0
+        self.closed = False
+
+    def subscribe(self, key):
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._channels[key] = Channel(self.history)
+            channel.subscribers += 1
+        with channel.condition:
+            return Subscription(self, key, channel)
+
+    def unsubscribe(self, key):
+        with self._lock:
+            channel = self._channels[key]
+            channel.subscribers -= 1
+            if not channel.subscribers:
+                del self._channels[key]
+
+    def has_subscribers(self, key):
+        return key in self._channels
+
+    def publish(self, key, message):
+        channel = self._channels.get(key)
+        if channel is None:
+            return
+        with channel.condition:
+            channel.sequence += 1
+            channel.messages.append((channel.sequence, message))
+            channel.condition.notify_all()
+            waiter, channel.waiter = channel.waiter, None
+        wake(waiter)
+        self._published += 1
+
+    def close(self):
+        """Release every waiting subscriber, e.g. so open streams end when the server shuts down."""
+        self.closed = True
+        with self._lock:
+            channels = list(self._channels.values())
+        for channel in channels:
+            with channel.condition:
+                channel.condition.notify_all()
+                waiter, channel.waiter = channel.waiter, None
+            wake(waiter)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(channel.subscribers for channel in self._channels.values()),
+                'published': self._published,
+            }
@@ -1,17 +1,200 @@
+import array
+import mmap
+import multiprocessing
+import os
+import tempfile
 import unittest
+from multiprocessing.shared_memory import SharedMemory
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Parent values read per chunk in streaming mode
+CHUNK_SIZE = 1 << 20
+
+
+# A node is internal when it is the parent of another node, so the answer is the number of distinct
+# parent values that are node indexes (the root's -1 is not). Complexity of O(n): one pass to collect
+# the distinct parents, then a check of their range, instead of a `node in tree` scan per node.
+# A NumPy array is counted with a vectorized bitmap when NumPy is installed.
 def find_internal_nodes_num(tree):
     num_of_nodes = len(tree)
-    internal_nodes = 0
-    # Complexity of O(n)
-    for node in range(num_of_nodes):
-        if node in tree:
-            internal_nodes += 1
-    return internal_nodes
+    if numpy is not None and isinstance(tree, numpy.ndarray):
+        return count_parents_numpy(tree, num_of_nodes)
+    parents = set(tree)
+    if not parents:
+        return 0
+    if min(parents) >= -1 and max(parents) < num_of_nodes:
+        return len(parents) - (-1 in parents)
+    return sum(1 for parent in parents if 0 <= parent < num_of_nodes)
+
+
+def count_parents_numpy(parents, num_of_nodes):
+    parents = parents[(parents >= 0) & (parents < num_of_nodes)]
+    seen = numpy.zeros(num_of_nodes, dtype=bool)
+    seen[parents] = True
+    return int(numpy.count_nonzero(seen))
+
+
+# Streaming mode: the parent array arrives in chunks (e.g. from iter_parent_chunks), so it never has to
+# be in memory as a whole. Each chunk marks its distinct parents in a bytearray with one byte per node.
+# num_of_nodes is the total length when known up front; otherwise the bitmap grows with the nodes seen,
+# and parents beyond it so far are kept aside until the end shows whether they are node indexes.
+def find_internal_nodes_chunks(chunks, num_of_nodes=None):
+    if num_of_nodes is not None:
+        seen = bytearray(num_of_nodes)
+        for chunk in chunks:
+            mark_parents(seen, chunk, num_of_nodes)
+        return seen.count(1)
+
+    seen = bytearray()
+    ahead = set()
+    count = 0
+    for chunk in chunks:
+        count += len(chunk)
+        if len(seen) < count:
+            seen.extend(bytes(max(count, 2 * len(seen)) - len(seen)))
+        mark_parents(seen, chunk, len(seen))
+        if numpy is not None and isinstance(chunk, numpy.ndarray):
+            ahead.update(numpy.unique(chunk[chunk >= len(seen)]).tolist())
+        else:
+            ahead.update(parent for parent in set(chunk) if parent >= len(seen))
+    return seen.count(1, 0, count) + sum(1 for parent in ahead if parent < count and not seen[parent])
+
+
+# Set seen[parent] = 1 for every parent in chunk that is a node index below num_of_nodes. seen is a
+# bytearray or any writable byte buffer, such as a shared memory block.
+def mark_parents(seen, chunk, num_of_nodes):
+    if numpy is not None and isinstance(chunk, numpy.ndarray):
+        marked = numpy.frombuffer(seen, dtype=numpy.uint8, count=num_of_nodes)
+        marked[chunk[(chunk >= 0) & (chunk < num_of_nodes)]] = 1
+        del marked  # a bytearray cannot be resized, nor shared memory closed, while a view of it exists
+        return
+    for parent in set(chunk):
+        if 0 <= parent < num_of_nodes:
+            seen[parent] = 1
+
+
+# Chunks of a parent array stored as raw machine integers (array.array(typecode).tofile()), read through a
+# memory map without copying: NumPy arrays if NumPy is installed, otherwise memoryview slices. A chunk is
+# only valid until the next one is requested.
+# start and stop select a range of nodes, so several processes can each read their own part of one file.
+def iter_parent_chunks(path, typecode='i', chunk_size=CHUNK_SIZE, start=0, stop=None):
+    if os.path.getsize(path) == 0:
+        return
+    if numpy is not None:
+        parents = numpy.memmap(path, dtype=numpy.dtype(typecode), mode='r')
+        yield from iter_view_chunks(parents, chunk_size, start, stop)
+        return
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        parents = memoryview(mapped).cast(typecode)
+        try:
+            yield from iter_view_chunks(parents, chunk_size, start, stop)
+        finally:
+            parents.release()
+
+
+# Zero-copy slices of a NumPy array or memoryview. The map or shared memory block behind a memoryview
+# cannot be closed while views of it are alive, so each slice is released once the caller moves on or stops.
+def iter_view_chunks(parents, chunk_size, start=0, stop=None):
+    stop = len(parents) if stop is None else min(stop, len(parents))
+    for chunk_start in range(start, stop, chunk_size):
+        chunk = parents[chunk_start:min(chunk_start + chunk_size, stop)]
+        try:
+            yield chunk
+        finally:
+            if isinstance(chunk, memoryview):
+                chunk.release()
+
 
+# processes > 1 splits the file into one range of nodes per process (see find_internal_nodes_parallel),
+# each read through the process's own memory map of the file
+def find_internal_nodes_in_file(path, typecode='i', chunk_size=CHUNK_SIZE, processes=1):
+    num_of_nodes = os.path.getsize(path) // array.array(typecode).itemsize
+    if processes > 1 and num_of_nodes:
+        return count_in_processes(('file', path), typecode, num_of_nodes, processes, chunk_size)
+    return find_internal_nodes_chunks(iter_parent_chunks(path, typecode, chunk_size), num_of_nodes)
 
-my_tree = [4, 4, 1, 5, -1, 4, 5]
-print(find_internal_nodes_num(my_tree))
+
+# Parallel mode: the parent array is copied once into a shared memory block, which every worker process
+# maps without copying. Each worker takes one range of nodes, collects the distinct parents of its range
+# and marks them in a second shared block, one byte per node; since a mark only ever sets a byte to 1,
+# the workers' marks merge in place without locking. The count of marked bytes equals
+# find_internal_nodes_num(tree). processes defaults to the number of CPUs.
+def find_internal_nodes_parallel(tree, processes=None, typecode='i', chunk_size=CHUNK_SIZE):
+    if numpy is not None and isinstance(tree, numpy.ndarray):
+        parents = numpy.ascontiguousarray(tree, dtype=numpy.dtype(typecode))
+    elif isinstance(tree, array.array) and tree.typecode == typecode:
+        parents = tree
+    else:
+        parents = array.array(typecode, tree)
+    num_of_nodes = len(parents)
+    if not num_of_nodes:
+        return 0
+
+    nbytes = num_of_nodes * array.array(typecode).itemsize
+    shared = SharedMemory(create=True, size=nbytes)
+    try:
+        shared.buf[:nbytes] = memoryview(parents).cast('B')
+        return count_in_processes(('memory', shared.name), typecode, num_of_nodes, processes, chunk_size)
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def count_in_processes(source, typecode, num_of_nodes, processes=None, chunk_size=CHUNK_SIZE):
+    processes = processes or os.cpu_count()
+    seen = SharedMemory(create=True, size=num_of_nodes)  # starts zeroed
+    try:
+        step = -(-num_of_nodes // processes)
+        ranges = [(start, min(start + step, num_of_nodes)) for start in range(0, num_of_nodes, step)]
+        with multiprocessing.Pool(len(ranges)) as pool:
+            pool.starmap(mark_range, [(source, typecode, num_of_nodes, start, stop, chunk_size, seen.name)
+                                      for start, stop in ranges])
+        return bytes(seen.buf[:num_of_nodes]).count(1)
+    finally:
+        seen.close()
+        seen.unlink()
+
+
+# Worker of count_in_processes: marks the parents of nodes start to stop, read from the parent array's
+# shared memory block ('memory', name) or file ('file', path)
+def mark_range(source, typecode, num_of_nodes, start, stop, chunk_size, seen_name):
+    seen = SharedMemory(name=seen_name)
+    try:
+        kind, location = source
+        if kind == 'file':
+            for chunk in iter_parent_chunks(location, typecode, chunk_size, start, stop):
+                mark_parents(seen.buf, chunk, num_of_nodes)
+            return
+
+        shared = SharedMemory(name=location)
+        try:
+            nbytes = num_of_nodes * array.array(typecode).itemsize
+            if numpy is not None:
+                parents = numpy.frombuffer(shared.buf, dtype=numpy.dtype(typecode), count=num_of_nodes)
+                for chunk in iter_view_chunks(parents, chunk_size, start, stop):
+                    mark_parents(seen.buf, chunk, num_of_nodes)
+                del parents, chunk
+            else:
+                parents = shared.buf[:nbytes].cast(typecode)
+                try:
+                    for chunk in iter_view_chunks(parents, chunk_size, start, stop):
+                        mark_parents(seen.buf, chunk, num_of_nodes)
+                finally:
+                    parents.release()
+        finally:
+            shared.close()
+    finally:
+        seen.close()
+
+
+def write_parent_array(path, tree, typecode='i'):
+    with open(path, 'wb') as f:
+        array.array(typecode, tree).tofile(f)
 
 
 class TestFindInternalNodesNum(unittest.TestCase):
@@ -40,6 +223,62 @@ class TestFindInternalNodesNum(unittest.TestCase):
         result = find_internal_nodes_num(tree)
         self.assertEqual(result, 3)
 
+    def test_empty_tree_and_parents_out_of_range(self):
+        self.assertEqual(find_internal_nodes_num([]), 0)
+        # 7 and -2 are not node indexes, so they do not count
+        self.assertEqual(find_internal_nodes_num([-1, 0, 7, -2, 0]), 1)
+
+    def test_array_input(self):
+        tree = array.array('i', [4, 4, 1, 5, -1, 4, 5])
+        self.assertEqual(find_internal_nodes_num(tree), 3)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_input(self):
+        for tree in ([4, 4, 1, 5, -1, 4, 5], [-1, -1, -1], [-1, 0, 7, -2, 0], []):
+            self.assertEqual(find_internal_nodes_num(numpy.array(tree, dtype=numpy.int64)),
+                             find_internal_nodes_num(tree), tree)
+
+    def test_chunks_match_whole_array(self):
+        # Parents after their children, so some parents arrive before the bitmap covers them
+        trees = ([4, 4, 1, 5, -1, 4, 5], [9, 9, 8, 8, 7, 7, 6, 6, -1, 6, 12], [-1] * 5, [])
+        for tree in trees:
+            for chunk_size in (1, 2, 3, 100):
+                chunks = [tree[start:start + chunk_size] for start in range(0, len(tree), chunk_size)]
+                self.assertEqual(find_internal_nodes_chunks(chunks), find_internal_nodes_num(tree), (tree, chunk_size))
+                self.assertEqual(find_internal_nodes_chunks(chunks, len(tree)), find_internal_nodes_num(tree))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tree.bin')
+            tree = [-1] + [(node - 1) // 3 for node in range(1, 1000)]
+            for typecode in ('i', 'q'):
+                write_parent_array(path, tree, typecode)
+                self.assertEqual(find_internal_nodes_in_file(path, typecode, chunk_size=64),
+                                 find_internal_nodes_num(tree))
+            write_parent_array(path, [])
+            self.assertEqual(find_internal_nodes_in_file(path), 0)
+
+    def test_parallel_matches_serial(self):
+        trees = ([4, 4, 1, 5, -1, 4, 5], [9, 9, 8, 8, 7, 7, 6, 6, -1, 6, 12], [-1, 0, 7, -2, 0], [-1] * 5, [],
+                 [-1] + [(node - 1) // 3 for node in range(1, 1000)])
+        for tree in trees:
+            for processes in (1, 2, 3):
+                self.assertEqual(find_internal_nodes_parallel(tree, processes, chunk_size=64),
+                                 find_internal_nodes_num(tree), (tree, processes))
+        tree = array.array('q', trees[-1])
+        self.assertEqual(find_internal_nodes_parallel(tree, 2, 'q'), find_internal_nodes_num(tree))
+
+    def test_parallel_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tree.bin')
+            tree = [-1] + [(node - 1) // 3 for node in range(1, 1000)] + [5000, -2]
+            write_parent_array(path, tree)
+            for processes in (2, 3):
+                self.assertEqual(find_internal_nodes_in_file(path, chunk_size=64, processes=processes),
+                                 find_internal_nodes_num(tree))
+
 
 if __name__ == '__main__':
+    my_tree = [4, 4, 1, 5, -1, 4, 5]
+    print(find_internal_nodes_num(my_tree))
     unittest.main()
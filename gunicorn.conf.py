@@ -0,0 +1,80 @@
+# Production serving: gunicorn -c gunicorn.conf.py
+# Every setting can be overridden with the environment variable named next to it.
+import importlib
+import multiprocessing
+import os
+import signal
+
+import set_up_database
+
+# SPORTSBOOK_ASYNC=true serves async_rest_application on uvicorn workers instead of the Flask app on
+# threads. Use it for /events/<id>/stream subscribers: under gthread each open stream holds one of a
+# worker's threads for as long as it is connected, so a worker serves at most `threads` subscribers,
+# and once they are all taken it cannot answer any other request either. An event loop worker parks a
+# subscriber as a coroutine instead, and keeps thousands open beside ordinary requests
+# (benchmark_stream_serving.py measures both). Either way a subscriber hears the writes made through
+# its own worker process only, as stream messages are fanned out in process.
+ASYNC = os.environ.get('SPORTSBOOK_ASYNC', '').lower() in ('1', 'true')
+APP_MODULE = 'async_rest_application' if ASYNC else 'rest_application'
+
+wsgi_app = f'{APP_MODULE}:create_app()'
+bind = os.environ.get('SPORTSBOOK_BIND', '0.0.0.0:5000')
+
+workers = int(os.environ.get('SPORTSBOOK_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+if ASYNC:
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    # Threaded workers: request threads block on SQLite and on /events/<id>/stream, not on the CPU.
+    # Keep SPORTSBOOK_POOL_SIZE at least equal to threads so no request waits for a connection.
+    worker_class = 'gthread'
+    threads = int(os.environ.get('SPORTSBOOK_THREADS', 8))
+    os.environ.setdefault('SPORTSBOOK_POOL_SIZE', str(threads))
+
+# Seconds in-flight requests get to finish after SIGTERM before the worker is killed
+graceful_timeout = int(os.environ.get('SPORTSBOOK_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('SPORTSBOOK_TIMEOUT', 60))
+keepalive = int(os.environ.get('SPORTSBOOK_KEEPALIVE', 5))
+# Recycle workers now and then so slow leaks cannot build up
+max_requests = int(os.environ.get('SPORTSBOOK_MAX_REQUESTS', 100000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('SPORTSBOOK_ACCESS_LOG')
+errorlog = '-'
+
+
+def on_starting(server):
+    # Schema and storage profile are set up once, in the master, before any worker is forked
+    set_up_database.initialize_database(os.environ.get('SPORTSBOOK_DATABASE', set_up_database.DATABASE))
+
+
+def post_worker_init(worker):
+    import rest_application
+    app_module = importlib.import_module(APP_MODULE)
+
+    # Open event streams never finish by themselves; end them on SIGTERM so the graceful shutdown
+    # only waits for ordinary requests. uvicorn replaces this handler when it starts serving, so the
+    # async app wraps uvicorn's instead (async_rest_application.end_streams_on_exit).
+    if not ASYNC:
+        handle_exit = signal.getsignal(signal.SIGTERM)
+
+        def close_streams_and_exit(signum, frame):
+            rest_application.broadcaster.close()
+            handle_exit(signum, frame)
+
+        signal.signal(signal.SIGTERM, close_streams_and_exit)
+
+    # Load the active rows before the first request instead of during it
+    if app_module.hot_tier is not None:
+        app_module.hot_tier.load()
+
+
+def worker_exit(server, worker):
+    if ASYNC:
+        return  # the async app's after_serving hook closes its write queue and pool
+    import rest_application
+
+    # Writes still queued for group commit are committed before the worker goes
+    if rest_application.write_queue is not None:
+        rest_application.write_queue.close()
+    if rest_application.pool is not None:
+        rest_application.pool.close_all()
@@ -0,0 +1,346 @@
+import bisect
+import itertools
+import operator
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import model
+from query_builder import filter_column
+from set_up_database import STORAGE_PROFILE
+
+# Column of each table whose values get an index of ids, so ?sport_id= and ?event_id= touch only their rows
+PARENT_COLUMNS = {'Events': 'sport_id', 'Selections': 'event_id'}
+
+# Columns that hold numbers. SQLite compares a filter value such as '2' with them as the number 2; any
+# other column compares it as text.
+INTEGER_COLUMNS = {'id', 'sport_id', 'event_id'}
+REAL_COLUMNS = {'price'}
+INTEGER_VALUE = re.compile(r'[0-9]+\Z')
+REAL_VALUE = re.compile(r'[0-9]+(\.[0-9]+)?\Z')
+
+# Filter operators answered from memory; any other filter is left to SQLite
+HOT_OPERATORS = ('eq', 'in')
+
+# A local write moves the data_version baseline past whatever else was committed before it, so a write
+# by another process landing just before a local one cannot be told apart from it. Such a write is still
+# picked up by a reload once the replica is this many ttls old.
+MAX_AGE_TTLS = 10
+
+
+# A filter value as SQLite would compare it with the column, or None when that is not plain enough to
+# be sure (e.g. '1e3' or ' 7'), in which case the search is left to SQLite
+def column_value(column, value):
+    if isinstance(value, bool):
+        return None
+    if column in INTEGER_COLUMNS:
+        if isinstance(value, int):
+            return value
+        return int(value) if isinstance(value, str) and INTEGER_VALUE.match(value) else None
+    if column in REAL_COLUMNS:
+        if isinstance(value, (int, float)):
+            return float(value)
+        return float(value) if isinstance(value, str) and REAL_VALUE.match(value) else None
+    return value if isinstance(value, str) else None
+
+
+def matching(rows, index, values):
+    return (row for row in rows if row[index] in values)
+
+
+class HotTier:
+    """
+    In-process replica of the active rows of Sports, Events and Selections, for answering active=true searches.
+
+    Rows are kept as the tuples SQLite returns, in a dict by id per table, with Events also indexed by
+    sport_id and Selections by event_id, and a sorted list of ids per table for paging. The replica is
+    loaded on first use (or by load()) and kept coherent by write-through: it is a model.write_listeners
+    callback, and every committed create, update or delete, status cascades included, re-reads the
+    written rows by id from SQLite. A row that is no longer active, or no longer exists, is dropped.
+
+    search() answers a search whose filters include active=1 and otherwise only equality or __in
+    filters on columns of the table, with the same rows, row format, projection and keyset paging as
+    model.search_table (rows in id order). For any other search it returns None, and the caller reads
+    SQLite.
+
+    Writes made by other processes do not reach the listener. When ttl is set, a search more than ttl
+    seconds after the last load reloads the replica if another process has written since (PRAGMA
+    data_version, re-read after each local write so that this process's own commits do not count);
+    readers keep using the old replica until the new one is in place. A search scans a snapshot of the
+    ids taken under the lock, so concurrent searches do not wait for each other.
+
+    Parameters:
+    - database (str): Path of the SQLite database file.
+    - ttl (float): Seconds before writes from other processes are picked up, or None to never reload.
+    - pragmas (dict): PRAGMA name -> value applied to the replica's connections.
+    """
+
+    def __init__(self, database, ttl=None, pragmas=None):
+        self.database = database
+        self.ttl = ttl
+        self.pragmas = dict(STORAGE_PROFILE if pragmas is None else pragmas)
+        self._lock = threading.RLock()
+        self._reset()
+        model.write_listeners.append(self.on_write)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._conn = None
+        self._rows = None
+        self._by_parent = None
+        self._order = None
+        self._loaded_at = None
+        self._data_version = None
+        self._rebaselined = False  # whether a local write has moved the data_version baseline since the load
+        self._pending = None  # written (table, id) pairs to re-read once a reload in progress is swapped in
+        self._hits = 0
+        self._fallbacks = 0
+        self._reloads = 0
+        self._refreshed = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    # Caller holds the lock
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._reset()  # the parent's connection and replica are not ours to use after fork()
+        if self._conn is None:
+            self._conn = self._connect()
+
+    def load(self):
+        """Read every active row from SQLite, replacing the replica; runs at most once at a time."""
+        with self._lock:
+            self._check_process()
+            if self._pending is not None:
+                return
+            self._pending = set()
+            # data_version is per connection and changes when any other connection commits; the baseline
+            # is read before the snapshot, so nothing committed after it can go unnoticed
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        try:
+            conn = self._connect()
+            try:
+                loaded_at = time.monotonic()
+                rows, by_parent, order = {}, {}, {}
+                for table in model.TABLE_FIELDS:
+                    rows[table], by_parent[table] = {}, {}
+                    for row in conn.execute(f"SELECT * FROM {table} WHERE active = ?", (1,)):
+                        self._put(rows[table], by_parent[table], table, row)
+                    order[table] = sorted(rows[table])
+            finally:
+                conn.close()
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._rows, self._by_parent, self._order = rows, by_parent, order
+            self._loaded_at = loaded_at
+            self._data_version = data_version
+            self._rebaselined = False
+            self._reloads += 1
+            tables = {}
+            for table, id in pending:
+                tables.setdefault(table, []).append(id)
+            for table, ids in tables.items():
+                self._refresh(table, ids)
+
+    def stale(self):
+        """Whether the next search would load the replica first; lets a caller run load() elsewhere."""
+        with self._lock:
+            self._check_process()
+            return self._stale()
+
+    # Caller holds the lock
+    def _stale(self):
+        """Whether ttl has passed since the last load and another process has written since."""
+        if self._rows is None:
+            return True
+        if self.ttl is None:
+            return False
+        age = time.monotonic() - self._loaded_at
+        if age < self.ttl:
+            return False
+        if self._rebaselined and age >= self.ttl * MAX_AGE_TTLS:
+            return True
+        return self._conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version
+
+    def _put(self, rows, by_parent, table, row):
+        id = row[0]
+        parent_column = PARENT_COLUMNS.get(table)
+        if parent_column is not None:
+            index = model.TABLE_FIELDS[table].index(parent_column)
+            old = rows.get(id)
+            if old is not None and old[index] != row[index]:
+                self._discard(by_parent, old[index], id)
+            by_parent.setdefault(row[index], set()).add(id)
+        rows[id] = row
+
+    def _remove(self, table, id):
+        row = self._rows[table].pop(id, None)
+        parent_column = PARENT_COLUMNS.get(table)
+        if row is not None and parent_column is not None:
+            self._discard(self._by_parent[table], row[model.TABLE_FIELDS[table].index(parent_column)], id)
+
+    @staticmethod
+    def _discard(by_parent, parent_id, id):
+        ids = by_parent.get(parent_id)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del by_parent[parent_id]
+
+    # Ids in order, for paging without sorting on every search. Rows created since the load have higher
+    # ids and are appended; a reactivated row, or removed rows making up half the list, mean a re-sort.
+    def _ordered_ids(self, table):
+        rows, order = self._rows[table], self._order.get(table)
+        if order is None or len(order) > 2 * len(rows) + 64:
+            order = self._order[table] = sorted(rows)
+        return order
+
+    # Caller holds the lock. Re-reads the rows by primary key, IN_CHUNK_SIZE ids per query.
+    def _refresh(self, table, ids):
+        active_index = model.TABLE_FIELDS[table].index('active')
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for start in range(0, len(ids), model.IN_CHUNK_SIZE):
+            chunk = ids[start:start + model.IN_CHUNK_SIZE]
+            query = f"SELECT * FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})"
+            found.update((row[0], row) for row in self._conn.execute(query, chunk))
+        for id in ids:
+            row = found.get(id)
+            if row is not None and row[active_index] == 1:
+                order = self._order.get(table)
+                if id not in self._rows[table] and order is not None:
+                    if order and order[-1] >= id:
+                        self._order[table] = None
+                    else:
+                        order.append(id)
+                self._put(self._rows[table], self._by_parent[table], table, row)
+            else:
+                self._remove(table, id)
+        self._refreshed += len(ids)
+
+    def on_write(self, table, parent_id, changes):
+        """model.write_listeners callback: bring the written rows up to date."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            ids = [change['id'] for change in changes]
+            if self._pending is not None:
+                self._pending.update((table, id) for id in ids)
+            if self._rows is None:
+                return
+            deleted = {change['id'] for change in changes if change['action'] == 'deleted'}
+            for id in deleted:
+                self._remove(table, id)
+            self._refresh(table, [id for id in ids if id not in deleted])
+            if self._pending is None:
+                # The replica now has this commit, so it must not count as a change by another process
+                self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                self._rebaselined = True
+
+    def search(self, table, filters, limit=None, after_id=None, fields=None, reload=True):
+        """
+        Rows as model.search_table would return them, or None when the search must go to SQLite. With
+        reload=False a stale replica is used as it is rather than reloaded on this thread (see stale()).
+        """
+        conditions = self._conditions(table, filters)
+        if conditions is None:
+            with self._lock:
+                self._fallbacks += 1
+            return None
+
+        if reload and self.stale():
+            self.load()
+
+        table_fields = model.TABLE_FIELDS[table]
+        # Only the snapshot is taken under the lock. The scan after it reads rows by id from a dict that
+        # writes change one item at a time, and an order list that only ever grows (a re-sort or reload
+        # puts a new list in its place), so it sees each row either before or after a concurrent write.
+        with self._lock:
+            self._check_process()
+            if self._rows is None:  # another thread is still loading
+                self._fallbacks += 1
+                return None
+            rows = self._rows[table]
+            parent_column = PARENT_COLUMNS.get(table)
+            ids = None
+            if parent_column in conditions:
+                by_parent = self._by_parent[table]
+                ids = set()
+                for value in conditions.pop(parent_column):
+                    ids.update(by_parent.get(value, ()))
+            else:
+                order = self._ordered_ids(table)
+                start = bisect.bisect_right(order, after_id) if after_id is not None else 0
+                stop = len(order)
+            self._hits += 1
+
+        if ids is not None:
+            ids = sorted(id for id in ids if after_id is None or id > after_id)
+        else:
+            ids = (order[position] for position in range(start, stop))
+        matches = filter(None, map(rows.get, ids))  # ids in the order list may since have been removed
+        for column, values in conditions.items():
+            matches = matching(matches, table_fields.index(column), values)
+        result = list(itertools.islice(matches, limit))
+
+        if fields:
+            project = operator.itemgetter(*(table_fields.index(name) for name in fields))
+            if len(fields) == 1:
+                return [{fields[0]: project(row)} for row in result]
+            return [dict(zip(fields, project(row))) for row in result]
+        return result
+
+    @staticmethod
+    def _conditions(table, filters):
+        """{column: set of values} for the filters besides active=1, or None if they cannot be answered here."""
+        if filters.get('active') != 1:
+            return None
+        table_fields = model.TABLE_FIELDS[table]
+        conditions = {}
+        for key, value in filters.items():
+            if key == 'active':
+                continue
+            column, operator = filter_column(key)
+            if column not in table_fields or column == 'active' or operator not in HOT_OPERATORS:
+                return None
+            values = set()
+            for item in (value if operator == 'in' else (value,)):
+                item = column_value(column, item)
+                if item is None:
+                    return None
+                values.add(item)
+            # Two filters on one column must both hold
+            conditions[column] = conditions[column] & values if column in conditions else values
+        return conditions
+
+    def close(self):
+        """Stop following writes and drop the replica."""
+        with self._lock:
+            if self.on_write in model.write_listeners:
+                model.write_listeners.remove(self.on_write)
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._rows is not None,
+                'rows': {table: len(rows) for table, rows in self._rows.items()} if self._rows is not None else None,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'fallbacks': self._fallbacks,
+                'reloads': self._reloads,
+                'refreshed': self._refreshed,
+            }
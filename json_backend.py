@@ -0,0 +1,32 @@
+"""
+Optional faster JSON encoding for API responses.
+
+If orjson is installed and the app's FAST_JSON setting is on (the default), responses, request bodies
+and streamed rows are encoded and decoded with orjson instead of the standard library json module.
+Output is the same JSON, with the same sorted keys, only without the optional whitespace.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def use_fast_json(app):
+    """Switch app to orjson when it is available and app.config['FAST_JSON'] is set."""
+    if orjson is not None and app.config['FAST_JSON']:
+        app.json = OrjsonProvider(app)
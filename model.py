@@ -1,12 +1,199 @@
 # Sport model
-from datetime import datetime
+import contextlib
+from datetime import datetime, timedelta
+import functools
+import logging
+import sqlite3
+import threading
 import pytz
 
+from query_builder import QueryBuilder
+from set_up_database import ACTUAL_START_EPOCH, SCHEDULED_START_EPOCH
+
+logger = logging.getLogger(__name__)
+
+# Callbacks run after every committed write, as listener(table, parent_id, changes).
+# parent_id is the sport_id (Events) or event_id (Selections) the written rows belong to, or None when
+# rows of any parent may have changed. changes lists one dict per written row: 'action' ('created',
+# 'updated' or 'deleted'), 'id', and the columns the write set. rest_application uses these to keep
+# its response cache coherent and to push price changes to stream subscribers.
+# The write is already committed when they run, so a listener that raises is logged and skipped rather
+# than failing the write or the listeners after it.
+write_listeners = []
+
+# Insertable columns, in the order the create functions take them
+SPORT_COLUMNS = ('name', 'slug', 'active')
+EVENT_COLUMNS = ('name', 'slug', 'active', 'type', 'sport_id', 'status', 'scheduled_start', 'actual_start')
+SELECTION_COLUMNS = ('name', 'event_id', 'price', 'active', 'outcome')
+
+# Every column of each table in schema order: what a search can project with fields=, and the keys of
+# the objects it then returns
+TABLE_FIELDS = {
+    'Sports': ('id',) + SPORT_COLUMNS,
+    'Events': ('id',) + EVENT_COLUMNS,
+    'Selections': ('id',) + SELECTION_COLUMNS,
+}
+
+# Bumped on every committed write to the table; rest_application builds its ETags from these
+table_versions = {'Sports': 0, 'Events': 0, 'Selections': 0}
+table_versions_lock = threading.Lock()
+
+
+# Per-thread list that notify_write appends to instead of notifying, while collect_writes() is active
+_collected_writes = threading.local()
+
+
+def notify_write(table, parent_id=None, changes=()):
+    collected = getattr(_collected_writes, 'writes', None)
+    if collected is not None:
+        collected.append((table, parent_id, changes))
+        return
+    with table_versions_lock:
+        table_versions[table] += 1
+    for listener in write_listeners:
+        try:
+            listener(table, parent_id, changes)
+        except Exception:
+            logger.exception("Write listener %r failed on a write to %s", listener, table)
+
+
+# Writes that are not committed yet when the model function returns (see write_queue.py) must not be
+# announced until they are: inside this block, notify_write calls made on the current thread are only
+# collected, and the caller replays them with notify_write(*arguments) after its COMMIT.
+@contextlib.contextmanager
+def collect_writes():
+    collected = []
+    _collected_writes.writes = collected
+    try:
+        yield collected
+    finally:
+        _collected_writes.writes = None
+
+
+def row_change(action, id, columns=(), values=()):
+    change = {'action': action, 'id': id}
+    change.update(zip(columns, values))
+    return change
+
+
+class BatchInsertError(Exception):
+    """Raised when a batch insert is rejected; errors lists {'index', 'error'} for every offending row."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} row(s) rejected")
+        self.errors = errors
+
+
+# Insert all rows in one transaction, or none of them, and return the new ids. executemany stops at
+# the first bad row without saying which one it was, so on failure the rows are replayed one by one
+# (and rolled back again) purely to report every offending row.
+def insert_many(conn, query, rows):
+    rows = list(rows)
+    c = conn.cursor()
+    try:
+        c.executemany(query, rows)
+    except sqlite3.Error:
+        conn.rollback()
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                c.execute(query, row)
+            except sqlite3.Error as e:
+                errors.append({'index': index, 'error': str(e)})
+        conn.rollback()
+        raise BatchInsertError(errors)
+
+    # Rows inserted by one statement in one transaction get consecutive rowids
+    ids_cursor = conn.cursor()
+    ids_cursor.row_factory = None
+    last_id = ids_cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+    conn.commit()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+# Rows fetched per fetchmany() call when streaming search results
+STREAM_BATCH_SIZE = 500
+
+
+# Row factory returning each row as a dict keyed by fields, the columns the query selected in order.
+# Built once per projection; the per-row work is a single dict(zip()).
+@functools.lru_cache(maxsize=None)
+def keyed_rows(fields):
+    def row_factory(cursor, row):
+        return dict(zip(fields, row))
+    return row_factory
+
+
+# Search filters answered from the active child counters (SportActiveCounts, EventActiveCounts) that
+# triggers keep up to date: ?min_active_events=2 finds sports with at least 2 active events by a range
+# scan of the counter index, touching only the matching rows instead of counting every event.
+COUNT_FILTERS = {
+    'Sports': {'min_active_events': "id IN (SELECT sport_id FROM SportActiveCounts WHERE active_events >= ?)"},
+    'Events': {'min_active_selections':
+               "id IN (SELECT event_id FROM EventActiveCounts WHERE active_selections >= ?)"},
+}
+
+# Search filters on the start times as UTC epoch seconds (see to_epoch): from/to bound scheduled_start and
+# started_from/started_to bound actual_start, the lower bound inclusive and the upper one exclusive.
+# They use the indexed expressions of set_up_database, so they compare real instants and range scan.
+TIME_FILTERS = {
+    'Events': {'from': f"{SCHEDULED_START_EPOCH} >= ?", 'to': f"{SCHEDULED_START_EPOCH} < ?",
+               'started_from': f"{ACTUAL_START_EPOCH} >= ?", 'started_to': f"{ACTUAL_START_EPOCH} < ?"},
+}
+
+# Every search filter that is not a column of the table
+EXTRA_FILTERS = {table: {**COUNT_FILTERS.get(table, {}), **TIME_FILTERS.get(table, {})} for table in TABLE_FIELDS}
+
+# Compiled search SQL per query shape; hits and misses are reported under query_shapes in /stats
+QUERY_SHAPE_CACHE_SIZE = 256
+query_builder = QueryBuilder(TABLE_FIELDS, max_shapes=QUERY_SHAPE_CACHE_SIZE, extra_filters=EXTRA_FILTERS)
+
+
+# Filters (equality, or an operator suffix such as price__gte or status__in, see query_builder.FILTER_OPERATORS)
+# plus optional keyset pagination: rows with id > after_id, in id order, at most limit rows.
+# Paging by id instead of OFFSET keeps every page an index range scan, however deep the client has paged.
+# fields (a tuple of TABLE_FIELDS[table] names) selects only those columns instead of *.
+# Filters are applied in column name order whatever order the dict has, so equal searches share one SQL string.
+def search_query(table, filters, limit=None, after_id=None, fields=None):
+    return query_builder.build(table, filters, limit, after_id, fields)
+
+
+# Search results as a list. Rows are tuples, or dicts keyed by field name when fields are given.
+def search_table(conn, table, filters, limit=None, after_id=None, fields=None):
+    query, params = search_query(table, filters, limit, after_id, fields)
+    c = conn.cursor()
+    if fields:
+        c.row_factory = keyed_rows(fields)
+    c.execute(query, params)
+    return c.fetchall()
+
+
+# Yield search results in lists of up to batch_size rows, so only one batch is held in memory at a time
+def stream_search(conn, table, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    query, params = search_query(table, filters, limit, after_id, fields)
+    c = conn.cursor()
+    if fields:
+        c.row_factory = keyed_rows(fields)
+    c.execute(query, params)
+    while True:
+        rows = c.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
 
 def create_sport(conn, name, slug, active):
     c = conn.cursor()
     c.execute("INSERT INTO Sports (name, slug, active) VALUES (?, ?, ?)", (name, slug, active))
     conn.commit()
+    notify_write('Sports', changes=[row_change('created', c.lastrowid, SPORT_COLUMNS, (name, slug, active))])
+
+
+# sports: iterable of (name, slug, active) tuples
+def create_sport_many(conn, sports):
+    sports = list(sports)
+    ids = insert_many(conn, "INSERT INTO Sports (name, slug, active) VALUES (?, ?, ?)", sports)
+    notify_write('Sports', changes=[row_change('created', id, SPORT_COLUMNS, sport) for id, sport in zip(ids, sports)])
 
 
 def read_sport(conn, id):
@@ -19,52 +206,76 @@ def update_sport(conn, id, name, slug, active):
     c = conn.cursor()
     c.execute("UPDATE Sports SET name = ?, slug = ?, active = ? WHERE id = ?", (name, slug, active, id))
     conn.commit()
+    notify_write('Sports', changes=[row_change('updated', id, SPORT_COLUMNS, (name, slug, active))])
+
+
+# When all the events of a sport are inactive, the sport becomes inactive.
+# A single indexed EXISTS probe on Events(sport_id, active), however many events the sport has.
+SPORT_STATUS_CASCADE = (
+    "UPDATE Sports SET active = ? WHERE id = ? AND active != ? AND NOT EXISTS "
+    "(SELECT 1 FROM Events WHERE sport_id = ? AND active = ?)"
+)
+
+
+def sport_status_cascade_params(sport_id):
+    return False, sport_id, False, sport_id, True
 
 
-# When all the events of a sport are inactive, the sport becomes inactive
 def check_and_update_sport_status(conn, sport_id):
     c = conn.cursor()
-    c.execute("SELECT active FROM Events WHERE sport_id = ?", (sport_id,))
-    events_active_status = c.fetchall()
-
-    if not any(status[0] for status in events_active_status):
-        c.execute("UPDATE Sports SET active = ? WHERE id = ?", (False, sport_id))
+    c.execute(SPORT_STATUS_CASCADE, sport_status_cascade_params(sport_id))
+    if c.rowcount:
         conn.commit()
+        notify_write('Sports', changes=[row_change('updated', sport_id, ('active',), (False,))])
 
 
 def delete_sport(conn, id):
     c = conn.cursor()
     c.execute("DELETE FROM Sports WHERE id = ?", (id,))
     conn.commit()
+    notify_write('Sports', changes=[row_change('deleted', id)])
 
 
-def search_sports(conn, filters):
-    if filters:
-        query = "SELECT * FROM Sports WHERE "
-        query += " AND ".join([f"{key} = ?" for key in filters])
-    else:
-        query = "SELECT * FROM Sports"
-    c = conn.cursor()
-    c.execute(query, tuple(filters.values()))
-    return c.fetchall()
+def search_sports(conn, filters, limit=None, after_id=None, fields=None):
+    return search_table(conn, 'Sports', filters, limit, after_id, fields)
+
+
+def stream_sports(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    return stream_search(conn, 'Sports', filters, limit, after_id, batch_size, fields)
+
+
+# All (sports/events) with a minimum number of active (events/selections) higher than a threshold.
+# Read from the counters, so the cost grows with the number of matches, not with the number of children.
+# CROSS JOIN keeps the counter index as the outer loop; otherwise SQLite prefers scanning the parents in id order.
+SPORTS_WITH_ACTIVE_EVENTS_QUERY = """
+    SELECT s.id, s.name, c.active_events
+    FROM SportActiveCounts c
+    CROSS JOIN Sports s ON s.id = c.sport_id
+    WHERE c.active_events > ?
+    ORDER BY s.id
+"""
+EVENTS_WITH_ACTIVE_SELECTIONS_QUERY = """
+    SELECT e.id, e.name, c.active_selections
+    FROM EventActiveCounts c
+    CROSS JOIN Events e ON e.id = c.event_id
+    WHERE c.active_selections > ?
+    ORDER BY e.id
+"""
 
 
-# All (sports/events) with a minimum number of active (events/selections) higher than a threshold
 def search_sports_with_active_events_greater_than(conn, threshold):
     c = conn.cursor()
-    query = """
-        SELECT s.id, s.name, COUNT(e.id) as active_event_count 
-        FROM Sports s
-        JOIN Events e ON s.id = e.sport_id
-        WHERE e.active = True
-        GROUP BY s.id, s.name
-        HAVING COUNT(e.id) > ?
-    """
-    c.execute(query, (threshold,))
+    c.execute(SPORTS_WITH_ACTIVE_EVENTS_QUERY, (threshold,))
     sports = c.fetchall()
     return sports
 
 
+def search_events_with_active_selections_greater_than(conn, threshold):
+    c = conn.cursor()
+    c.execute(EVENTS_WITH_ACTIVE_SELECTIONS_QUERY, (threshold,))
+    return c.fetchall()
+
+
 def create_event(conn, name, slug, active, type, sport_id, status, scheduled_start, actual_start):
     c = conn.cursor()
     c.execute(
@@ -73,6 +284,49 @@ def create_event(conn, name, slug, active, type, sport_id, status, scheduled_sta
         (name, slug, active, type, sport_id, status, scheduled_start, actual_start)
     )
     conn.commit()
+    notify_write('Events', sport_id, [row_change('created', c.lastrowid, EVENT_COLUMNS,
+                                                 (name, slug, active, type, sport_id, status, scheduled_start,
+                                                  actual_start))])
+
+
+# Start times of event tuples converted from local TIME_FORMAT times in tz_str to UTC TIME_FORMAT times.
+# A string that cannot be read raises BatchInsertError naming every offending row.
+def event_starts_to_utc(events, tz_str):
+    scheduled = [event[6] for event in events]
+    actual = [event[7] for event in events if event[7] is not None]
+    try:
+        scheduled = convert_many_to_utc(scheduled, tz_str=tz_str)
+        actual = iter(convert_many_to_utc(actual, tz_str=tz_str))
+    except ValueError:
+        errors = []
+        for index, event in enumerate(events):
+            try:
+                convert_many_to_utc([start for start in event[6:8] if start is not None], tz_str=tz_str)
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        raise BatchInsertError(errors)
+    return [event[:6] + (str(scheduled_start), None if event[7] is None else str(next(actual)))
+            for event, scheduled_start in zip(events, scheduled)]
+
+
+# events: iterable of (name, slug, active, type, sport_id, status, scheduled_start, actual_start) tuples.
+# With tz_str, for bulk imports of local times, scheduled_start and actual_start are TIME_FORMAT times in
+# that timezone and are stored converted to UTC.
+def create_event_many(conn, events, tz_str=None):
+    events = list(events)
+    if tz_str is not None:
+        events = event_starts_to_utc(events, tz_str)
+    ids = insert_many(
+        conn,
+        "INSERT INTO Events (name, slug, active, type, sport_id, status, scheduled_start, actual_start) VALUES (?, ?, "
+        "?, ?, ?, ?, ?, ?)",
+        events
+    )
+    changes_by_sport = {}
+    for id, event in zip(ids, events):
+        changes_by_sport.setdefault(event[4], []).append(row_change('created', id, EVENT_COLUMNS, event))
+    for sport_id, changes in changes_by_sport.items():
+        notify_write('Events', sport_id, changes)
 
 
 def read_event(conn, id):
@@ -81,6 +335,12 @@ def read_event(conn, id):
     return c.fetchone()
 
 
+def read_sport_events(conn, sport_id):
+    c = conn.cursor()
+    c.execute('SELECT * FROM Events WHERE sport_id = ?', (sport_id,))
+    return c.fetchall()
+
+
 def update_event(conn, event_id, data):
     c = conn.cursor()
     params = (data.get('name'), data.get('active'), data.get('type'), data.get('status'),
@@ -91,37 +351,57 @@ def update_event(conn, event_id, data):
         params)
     check_and_update_sport_status(conn, data.get('sport_id'))
     conn.commit()
+    columns = ('name', 'active', 'type', 'status', 'scheduled_start', 'actual_start', 'sport_id')
+    notify_write('Events', data.get('sport_id'),
+                 [row_change('updated', event_id, columns, params[:-1] + (data.get('sport_id'),))])
+
+
+# When all the selections of a particular event are inactive, the event becomes inactive.
+# A single indexed EXISTS probe on Selections(event_id, active), however many selections the event has.
+EVENT_STATUS_CASCADE = (
+    "UPDATE Events SET active = ? WHERE id = ? AND active != ? AND NOT EXISTS "
+    "(SELECT 1 FROM Selections WHERE event_id = ? AND active = ?)"
+)
+
+
+def event_status_cascade_params(event_id):
+    return False, event_id, False, event_id, True
 
 
-# When all the selections of a particular event are inactive, the event becomes inactive
 def check_and_update_event_status(conn, event_id):
     c = conn.cursor()
-    c.execute("SELECT active FROM Selections WHERE event_id = ?", (event_id,))
-    selections_active_status = c.fetchall()
-
-    if not any(status[0] for status in selections_active_status):
-        c.execute("UPDATE Events SET active = ? WHERE id = ?", (False, event_id))
+    c.execute(EVENT_STATUS_CASCADE, event_status_cascade_params(event_id))
+    if c.rowcount:
         conn.commit()
+        notify_write('Events', changes=[row_change('updated', event_id, ('active',), (False,))])
 
 
 def delete_event(conn, id):
     c = conn.cursor()
     c.execute("DELETE FROM Events WHERE id = ?", (id,))
     conn.commit()
+    notify_write('Events', changes=[row_change('deleted', id)])
 
 
-def search_events(conn, filters):
-    if filters:
-        query = "SELECT * FROM Events WHERE "
-        query += " AND ".join([f"{key} = ?" for key in filters])
-    else:
-        query = "SELECT * FROM Events"
-    c = conn.cursor()
-    c.execute(query, tuple(filters.values()))
-    return c.fetchall()
+def search_events(conn, filters, limit=None, after_id=None, fields=None):
+    return search_table(conn, 'Events', filters, limit, after_id, fields)
 
 
-def convert_to_utc(time_str, format_str="%Y-%m-%d %H:%M:%S", tz_str='Europe/London'):
+def stream_events(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    return stream_search(conn, 'Events', filters, limit, after_id, batch_size, fields)
+
+
+# Format of start times without a UTC offset, and of the UTC times convert_many_to_utc results are stored as
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(tz_str):
+    """pytz timezone for a name such as 'Europe/London', looked up once per name."""
+    return pytz.timezone(tz_str)
+
+
+def convert_to_utc(time_str, format_str=TIME_FORMAT, tz_str='Europe/London'):
     """
     Convert a timezone-aware datetime string to a timezone-naive datetime in UTC.
 
@@ -136,20 +416,89 @@ def convert_to_utc(time_str, format_str="%Y-%m-%d %H:%M:%S", tz_str='Europe/Lond
     Returns:
     - datetime: A timezone-naive datetime object in UTC.
     """
-    local_tz = pytz.timezone(tz_str)
+    local_tz = get_timezone(tz_str)
     local_dt = datetime.strptime(time_str, format_str)
     local_dt = local_tz.localize(local_dt)
     utc_dt = local_dt.astimezone(pytz.UTC)
     return utc_dt.replace(tzinfo=None)  # Return a timezone-naive datetime
 
 
+def parse_time(time_str, format_str=TIME_FORMAT):
+    # fromisoformat is several times faster than strptime and reads the same value for a zero-padded
+    # TIME_FORMAT string; anything else goes through strptime, so the same strings are accepted
+    if format_str == TIME_FORMAT and len(time_str) == 19 and time_str[10] == ' ':
+        try:
+            return datetime.fromisoformat(time_str)
+        except ValueError:
+            pass
+    return datetime.strptime(time_str, format_str)
+
+
+def convert_many_to_utc(time_strs, format_str=TIME_FORMAT, tz_str='Europe/London'):
+    """
+    Convert a column of datetime strings in one timezone to timezone-naive datetimes in UTC.
+
+    Gives the same results as calling convert_to_utc on each string. The timezone is looked up once,
+    and the UTC offset is worked out once per distinct local day rather than per value. A day with
+    a DST transition in it falls back to localizing each of its values.
+
+    Parameters:
+    - time_strs (iterable of str): The datetime strings to convert.
+    - format_str (str): The format of the datetime strings, as for convert_to_utc.
+    - tz_str (str): The timezone of the input datetime strings, as for convert_to_utc.
+
+    Returns:
+    - list of datetime: Timezone-naive datetime objects in UTC, in input order.
+    """
+    local_tz = get_timezone(tz_str)
+    offsets = {}  # local date -> its UTC offset, or None when the offset changes during the day
+    utc_dts = []
+    for time_str in time_strs:
+        local_dt = parse_time(time_str, format_str)
+        day = local_dt.date()
+        if day in offsets:
+            offset = offsets[day]
+        else:
+            midnight = datetime.combine(day, datetime.min.time())
+            offset = local_tz.localize(midnight).utcoffset()
+            if local_tz.localize(midnight + timedelta(days=1, microseconds=-1)).utcoffset() != offset:
+                offset = None
+            offsets[day] = offset
+        if offset is None:
+            offset = local_tz.localize(local_dt).utcoffset()
+        utc_dts.append(local_dt - offset)
+    return utc_dts
+
+
+def to_epoch(time_str, tz_str='UTC'):
+    """
+    Convert an ISO 8601 datetime string to seconds since the epoch.
+
+    Parameters:
+    - time_str (str): The datetime string, e.g. '2023-07-10 20:00:00' or '2023-06-26T18:00:00Z'.
+    - tz_str (str): The timezone of a datetime string without a UTC offset, a name pytz can recognize.
+
+    Returns:
+    - int: Seconds since 1970-01-01 00:00:00 UTC.
+    """
+    dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        try:
+            dt = get_timezone(tz_str).localize(dt)
+        except pytz.UnknownTimeZoneError:
+            raise ValueError(f"Unknown timezone: {tz_str}")
+    return int(dt.timestamp())
+
+
 # Events scheduled to start in a specific timeframe for a specific timezone
+TIMEFRAME_QUERY = f"SELECT * FROM Events WHERE {SCHEDULED_START_EPOCH} BETWEEN ? AND ?"
+
+
 def search_events_in_timeframe(conn, start_time, end_time):
-    st = convert_to_utc(start_time)
-    et = convert_to_utc(end_time)
+    st = to_epoch(start_time, 'Europe/London')
+    et = to_epoch(end_time, 'Europe/London')
     c = conn.cursor()
-    query = "SELECT * FROM Events WHERE scheduled_start BETWEEN ? AND ?"
-    c.execute(query, (st, et))
+    c.execute(TIMEFRAME_QUERY, (st, et))
     events = c.fetchall()
     return events
 
@@ -162,6 +511,20 @@ def create_selection(conn, name, event_id, price, active, outcome):
         (name, event_id, price, active, outcome)
     )
     conn.commit()
+    notify_write('Selections', event_id, [row_change('created', c.lastrowid, SELECTION_COLUMNS,
+                                                     (name, event_id, price, active, outcome))])
+
+
+# selections: iterable of (name, event_id, price, active, outcome) tuples
+def create_selection_many(conn, selections):
+    selections = list(selections)
+    ids = insert_many(conn, "INSERT INTO Selections (name, event_id, price, active, outcome) VALUES (?, ?, ?, ?, ?)",
+                      selections)
+    changes_by_event = {}
+    for id, selection in zip(ids, selections):
+        changes_by_event.setdefault(selection[1], []).append(row_change('created', id, SELECTION_COLUMNS, selection))
+    for event_id, changes in changes_by_event.items():
+        notify_write('Selections', event_id, changes)
 
 
 def read_selection(conn, id):
@@ -170,6 +533,50 @@ def read_selection(conn, id):
     return c.fetchone()
 
 
+def read_event_selections(conn, event_id):
+    c = conn.cursor()
+    c.execute('SELECT * FROM Selections WHERE event_id = ?', (event_id,))
+    return c.fetchall()
+
+
+# Selections of many events as {event_id: [selection dict, ...]}, in id order, with one
+# event_id IN (...) query per IN_CHUNK_SIZE events instead of one query per event
+def read_selections_for_events(conn, event_ids):
+    event_ids = list(event_ids)
+    by_event = {}
+    for start in range(0, len(event_ids), IN_CHUNK_SIZE):
+        rows = search_selections(conn, {'event_id__in': event_ids[start:start + IN_CHUNK_SIZE]},
+                                 fields=TABLE_FIELDS['Selections'])
+        for row in rows:
+            by_event.setdefault(row['event_id'], []).append(row)
+    for selections in by_event.values():
+        selections.sort(key=lambda row: row['id'])
+    return by_event
+
+
+def attach_selections(conn, events):
+    selections = read_selections_for_events(conn, [event['id'] for event in events])
+    for event in events:
+        event['selections'] = selections.get(event['id'], [])
+    return events
+
+
+def card_fields(fields):
+    fields = fields or TABLE_FIELDS['Events']
+    return fields if 'id' in fields else ('id',) + fields
+
+
+# Event cards: events matching the search as dicts, each with its selections embedded under 'selections'.
+# Two queries for a page of up to IN_CHUNK_SIZE events, however many events it holds.
+def search_event_cards(conn, filters, limit=None, after_id=None, fields=None):
+    return attach_selections(conn, search_events(conn, filters, limit, after_id, card_fields(fields)))
+
+
+def stream_event_cards(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    for events in stream_events(conn, filters, limit, after_id, batch_size, card_fields(fields)):
+        yield attach_selections(conn, events)
+
+
 def update_selection(conn, selection_id, data):
     c = conn.cursor()
     params = (data.get('name'), data.get('price'), data.get('active'), data.get('outcome'), selection_id)
@@ -178,20 +585,76 @@ def update_selection(conn, selection_id, data):
     check_and_update_event_status(conn, data.get('event_id'))
 
     conn.commit()
+    columns = ('name', 'price', 'active', 'outcome', 'event_id')
+    notify_write('Selections', data.get('event_id'),
+                 [row_change('updated', selection_id, columns, params[:-1] + (data.get('event_id'),))])
+
+
+# Largest number of ids bound into a single IN (...) list
+IN_CHUNK_SIZE = 500
+
+
+# prices: iterable of (selection_id, price) or (selection_id, price, active) tuples.
+# All updates and the event cascade run in one transaction, with the cascade run once per affected event.
+# Returns the number of selections updated.
+def update_selection_prices(conn, prices):
+    prices = list(prices)
+    price_only = [(row[1], row[0]) for row in prices if len(row) == 2]
+    price_and_active = [(row[1], row[2], row[0]) for row in prices if len(row) == 3]
+
+    c = conn.cursor()
+    c.row_factory = None
+    updated = 0
+    try:
+        if price_only:
+            c.executemany("UPDATE Selections SET price = ? WHERE id = ?", price_only)
+            updated += c.rowcount
+        if price_and_active:
+            c.executemany("UPDATE Selections SET price = ?, active = ? WHERE id = ?", price_and_active)
+            updated += c.rowcount
+
+        selection_ids = list({row[0] for row in prices})
+        selection_events = {}
+        for start in range(0, len(selection_ids), IN_CHUNK_SIZE):
+            chunk = selection_ids[start:start + IN_CHUNK_SIZE]
+            c.execute(f"SELECT id, event_id FROM Selections WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            selection_events.update(c.fetchall())
+
+        event_ids = sorted({event_id for event_id in selection_events.values() if event_id is not None})
+        events_deactivated = []
+        for event_id in event_ids:
+            c.execute(EVENT_STATUS_CASCADE, event_status_cascade_params(event_id))
+            if c.rowcount:
+                events_deactivated.append(event_id)
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    conn.commit()
+
+    changes_by_event = {}
+    for row in prices:
+        if row[0] in selection_events:
+            event_id = selection_events[row[0]]
+            changes_by_event.setdefault(event_id, []).append(
+                row_change('updated', row[0], ('event_id', 'price', 'active'), (event_id,) + tuple(row[1:])))
+    for event_id, changes in changes_by_event.items():
+        notify_write('Selections', event_id, changes)
+    if events_deactivated:
+        notify_write('Events', changes=[row_change('updated', event_id, ('active',), (False,))
+                                        for event_id in events_deactivated])
+    return updated
 
 
 def delete_selection(conn, id):
     c = conn.cursor()
     c.execute("DELETE FROM Selections WHERE id = ?", (id,))
     conn.commit()
+    notify_write('Selections', changes=[row_change('deleted', id)])
 
 
-def search_selections(conn, filters):
-    if filters:
-        query = "SELECT * FROM Selections WHERE "
-        query += " AND ".join([f"{key} = ?" for key in filters])
-    else:
-        query = "SELECT * FROM Selections"
-    c = conn.cursor()
-    c.execute(query, tuple(filters.values()))
-    return c.fetchall()
+def search_selections(conn, filters, limit=None, after_id=None, fields=None):
+    return search_table(conn, 'Selections', filters, limit, after_id, fields)
+
+
+def stream_selections(conn, filters, limit=None, after_id=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    return stream_search(conn, 'Selections', filters, limit, after_id, batch_size, fields)
@@ -0,0 +1,217 @@
+"""
+Tree analytics over the parent-array representation of find_internal_nodes.py.
+
+A tree of n nodes is given as parents[i] = parent of node i, or -1 for a root (several roots make a
+forest). ParentArrayTree turns it, once, into flat arrays: the children of every node in CSR form (one
+offsets array, one children array), plus each node's depth and subtree size. The build is a handful of
+C-level passes (a sort by parent, and one pass per lifting level), not a Python loop per node. After that,
+internal/leaf checks, depth and subtree size are O(1) lookups and the lowest common ancestor of two nodes
+takes O(log depth) steps of binary lifting. Market hierarchies (sport -> competition -> event -> market)
+of millions of nodes fit in a few machine integers per node.
+"""
+import collections
+import itertools
+import operator
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Machine integer type of every array; 8 bytes per entry
+TYPECODE = 'q'
+
+
+def zeros(size):
+    return array(TYPECODE, bytes(size * array(TYPECODE).itemsize))
+
+
+class ParentArrayTree:
+    """
+    Array-backed tree built from a parent array, answering structural queries in O(1) or O(log depth).
+
+    Children of node v are children[offsets[v]:offsets[v + 1]], in increasing node order. Depth counts
+    edges from the node's root, and a subtree's size includes the node itself. The binary lifting table
+    for lca() has one level per bit of the tree's height, so a shallow tree of millions of nodes only
+    needs a handful of levels.
+
+    Parameters:
+    - parents (sequence of int): Parent of each node, -1 for a root. A list, array.array or NumPy array.
+
+    Raises ValueError when a parent is not a node index or -1, or when the parents form a cycle.
+    """
+
+    def __init__(self, parents):
+        if numpy is not None and isinstance(parents, numpy.ndarray):
+            parent = array(TYPECODE)
+            parent.frombytes(numpy.ascontiguousarray(parents, dtype=numpy.int64).tobytes())
+        else:
+            parent = array(TYPECODE, parents)
+        n = len(parent)
+        if n and (min(parent) < -1 or max(parent) >= n):
+            raise ValueError("Parents must be node indexes (0 to {}) or -1 for a root".format(n - 1))
+
+        # Every pass below is a C-level map, sort or count over the arrays; Python-level work is per
+        # root or per internal node only, which keeps a multi-million-node build to seconds. The sort is
+        # O(n log n) in theory but beats an O(n) counting sort written as a Python loop.
+        # CSR: the nodes sorted (stably) by parent are the roots followed by every node's children.
+        counts = collections.Counter(parent)
+        num_roots = counts.pop(-1, 0)
+        by_parent = sorted(range(n), key=parent.__getitem__)
+        roots = array(TYPECODE, by_parent[:num_roots])
+        children = array(TYPECODE, by_parent[num_roots:])
+        del by_parent
+        offsets = array(TYPECODE, [0])
+        offsets.extend(itertools.accumulate(map(counts.get, range(n), itertools.repeat(0))))
+
+        # Pointer doubling: level k of up holds each node's 2**k-th ancestor (a root stands in for the
+        # ancestors above it) and steps its distance to that ancestor, so once every jump lands on a
+        # root, steps is the depth. The levels kept are the lifting table of lca().
+        level = array(TYPECODE, parent)
+        for root in roots:
+            level[root] = root
+        up = [level]
+        steps = array(TYPECODE, map(operator.ne, level, range(n)))
+        for _ in range(n.bit_length() + 1):
+            next_level = array(TYPECODE, map(level.__getitem__, level))
+            if next_level == level:
+                break
+            steps = array(TYPECODE, map(operator.add, steps, map(steps.__getitem__, level)))
+            level = next_level
+            up.append(level)
+        # Jumps also stop moving on a cycle whose length divides 2**k, so check they ended on roots
+        if n and max(map(parent.__getitem__, level)) >= 0:
+            cycle = sum(1 for ancestor in map(parent.__getitem__, level) if ancestor >= 0)
+            raise ValueError("Parents form a cycle: {} nodes cannot reach a root".format(cycle))
+        depth = steps
+        height = max(depth) if n else 0
+
+        # Subtree sizes, deepest internal nodes first so their children are final when they are summed
+        internal = array(TYPECODE, itertools.compress(range(n), map(operator.ne, offsets[1:], offsets[:-1])))
+        size = array(TYPECODE, [1]) * n
+        for node in sorted(internal, key=depth.__getitem__, reverse=True):
+            size[node] += sum(map(size.__getitem__, children[offsets[node]:offsets[node + 1]]))
+
+        self._parent = parent
+        self._offsets = offsets
+        self._children = children
+        self._roots = roots
+        self._internal = internal
+        self._depth = depth
+        self._size = size
+        self._height = height
+        self._up = up[:max(height.bit_length(), 1)]
+
+    def __len__(self):
+        return len(self._parent)
+
+    def _check(self, node):
+        if not 0 <= node < len(self._parent):
+            raise IndexError("No node {}".format(node))
+
+    def _check_many(self, nodes):
+        nodes = nodes if isinstance(nodes, (list, array)) else list(nodes)
+        if nodes and (min(nodes) < 0 or max(nodes) >= len(self._parent)):
+            raise IndexError("Nodes must be 0 to {}".format(len(self._parent) - 1))
+        return nodes
+
+    @property
+    def roots(self):
+        return self._roots
+
+    @property
+    def height(self):
+        """Depth of the deepest node."""
+        return self._height
+
+    @property
+    def internal_count(self):
+        """Number of nodes with at least one child; equals find_internal_nodes_num(parents)."""
+        return len(self._internal)
+
+    def nbytes(self):
+        """Bytes held by the arrays, lifting table included."""
+        arrays = [self._parent, self._offsets, self._children, self._roots, self._internal, self._depth, self._size]
+        arrays += self._up
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def parent(self, node):
+        self._check(node)
+        return self._parent[node]
+
+    def children(self, node):
+        self._check(node)
+        return self._children[self._offsets[node]:self._offsets[node + 1]]
+
+    def num_children(self, node):
+        self._check(node)
+        return self._offsets[node + 1] - self._offsets[node]
+
+    def is_internal(self, node):
+        return self.num_children(node) > 0
+
+    def is_leaf(self, node):
+        return self.num_children(node) == 0
+
+    def depth(self, node):
+        self._check(node)
+        return self._depth[node]
+
+    def subtree_size(self, node):
+        self._check(node)
+        return self._size[node]
+
+    def ancestor(self, node, k):
+        """The k-th ancestor of node (node itself for k=0), or None above its root."""
+        self._check(node)
+        if k > self._depth[node]:
+            return None
+        for level, up in enumerate(self._up):
+            if k >> level & 1:
+                node = up[node]
+        return node
+
+    def lca(self, u, v):
+        """Lowest common ancestor of u and v, or None when they are in different trees of a forest."""
+        self._check(u)
+        self._check(v)
+        return self._lca(self._up, u, v)
+
+    def _lca(self, up, u, v):
+        depth = self._depth
+        if depth[u] < depth[v]:
+            u, v = v, u
+        difference = depth[u] - depth[v]
+        level = 0
+        while difference:
+            if difference & 1:
+                u = up[level][u]
+            difference >>= 1
+            level += 1
+        if u == v:
+            return u
+        for level in reversed(up):
+            if level[u] != level[v]:
+                u, v = level[u], level[v]
+        p = self._parent[u]
+        return p if p >= 0 else None
+
+    # Batch queries: one bounds check for the whole batch, then C-level lookups (map over the arrays)
+    def depths(self, nodes):
+        return list(map(self._depth.__getitem__, self._check_many(nodes)))
+
+    def subtree_sizes(self, nodes):
+        return list(map(self._size.__getitem__, self._check_many(nodes)))
+
+    def internal_flags(self, nodes):
+        """is_internal() of each node, as a list of bools."""
+        offsets = self._offsets
+        return [offsets[node + 1] != offsets[node] for node in self._check_many(nodes)]
+
+    def lcas(self, pairs):
+        """lca() of each (u, v) pair."""
+        pairs = list(pairs)
+        self._check_many([node for pair in pairs for node in pair])
+        up = self._up
+        return [self._lca(up, u, v) for u, v in pairs]
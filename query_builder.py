@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+
+# Filter key suffix -> SQL operator. 'price__gte': 2.0 means price >= 2.0; a key without a suffix is an
+# equality test. An __in filter takes a list of values.
+FILTER_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>=', 'in': 'IN'}
+MAX_IN_VALUES = 512
+
+
+# __in lists are padded to the next power of two by repeating their last value, which does not change the
+# result, so lists of 5 to 8 values share one shape instead of needing four
+def padded_size(values):
+    if isinstance(values, (str, bytes)):
+        raise ValueError("An __in filter takes a list of values")
+    count = len(values)
+    if not 0 < count <= MAX_IN_VALUES:
+        raise ValueError(f"An __in filter takes 1 to {MAX_IN_VALUES} values")
+    size = 1
+    while size < count:
+        size *= 2
+    return size
+
+
+def filter_column(key):
+    """
+    Split a filter key into (column, operator), e.g. 'price__gte' -> ('price', 'gte'). An empty suffix
+    ('price__') is returned as the operator '', which is not in FILTER_OPERATORS, so it is rejected.
+    """
+    column, separator, operator = key.partition('__')
+    return column, operator if separator else 'eq'
+
+
+class QueryBuilder:
+    """
+    Builds the parameterized SELECT behind the search functions and remembers it per query shape.
+
+    A shape is everything that decides the SQL text: the table, the set of filter keys (with the padded
+    length of any __in list), the selected fields and whether the query pages. Filters are put in sorted
+    order, so ?a=1&b=2 and ?b=2&a=1 produce the same SQL string and share a prepared statement in each
+    connection's statement cache (sqlite3's cached_statements, keyed by SQL text). A shape is compiled
+    and validated once; after that, building a query is a dict lookup plus collecting the parameters.
+
+    Parameters:
+    - table_fields (dict): Table name -> its column names, the only names filters and fields may use.
+    - max_shapes (int): Compiled shapes kept, least recently used dropped first.
+    - extra_filters (dict): Table name -> {filter key: SQL condition with one ? for the filter's value},
+      for filters that are not a column of the table, e.g. a lookup in another table.
+    """
+
+    def __init__(self, table_fields, max_shapes=256, extra_filters=None):
+        self.table_fields = {table: frozenset(fields) for table, fields in table_fields.items()}
+        self.extra_filters = extra_filters or {}
+        self.max_shapes = max_shapes
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def build(self, table, filters, limit=None, after_id=None, fields=None):
+        """Return (query, params) for the filters (see FILTER_OPERATORS), optional keyset paging and projection."""
+        keys = tuple(sorted(filters))
+        in_sizes = tuple(padded_size(filters[key]) if key.endswith('__in') else 0 for key in keys)
+        shape = (table, keys, in_sizes, fields, after_id is not None, limit is not None)
+        with self._lock:
+            query = self._shapes.get(shape)
+            if query is not None:
+                self._shapes.move_to_end(shape)
+                self._hits += 1
+        if query is None:
+            query = self._compile(*shape)
+            with self._lock:
+                self._misses += 1
+                self._shapes[shape] = query
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+
+        params = []
+        for key, in_size in zip(keys, in_sizes):
+            if in_size:
+                values = list(filters[key])
+                params.extend(values + values[-1:] * (in_size - len(values)))
+            else:
+                params.append(filters[key])
+        if after_id is not None:
+            params.append(after_id)
+        if limit is not None:
+            params.append(limit)
+        return query, tuple(params)
+
+    def _compile(self, table, keys, in_sizes, fields, paged_after, limited):
+        valid = self.table_fields[table]
+        extra = self.extra_filters.get(table, {})
+        filters = [filter_column(key) for key in keys]
+        unknown = [key for key, (column, operator) in zip(keys, filters)
+                   if key not in extra and (column not in valid or operator not in FILTER_OPERATORS)]
+        unknown += [name for name in fields or () if name not in valid]
+        if unknown or fields == ():
+            raise ValueError("Invalid columns for {}: {}".format(table, ", ".join(unknown)))
+
+        conditions = []
+        for key, (column, operator), in_size in zip(keys, filters, in_sizes):
+            if key in extra:
+                conditions.append(extra[key])
+            elif operator == 'in':
+                conditions.append(f"{column} IN ({', '.join('?' * in_size)})")
+            else:
+                conditions.append(f"{column} {FILTER_OPERATORS[operator]} ?")
+        if paged_after:
+            conditions.append("id > ?")
+
+        query = f"SELECT {', '.join(fields) if fields else '*'} FROM {table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if limited or paged_after:
+            query += " ORDER BY id"
+        if limited:
+            query += " LIMIT ?"
+        return query
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'shapes': len(self._shapes),
+                'max_shapes': self.max_shapes,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    In-process LRU cache with a TTL for the results of read routes.
+
+    Every entry is tagged with the table it was read from and, for nested routes such as
+    /events/<id>/selections, the parent id it was filtered on. invalidate(table, parent_id) then
+    drops only the entries a write can have changed: the entries for that parent plus the
+    table-wide search entries. A parent_id of None drops every entry for the table.
+
+    Writes made by other processes do not reach invalidate(), so the TTL bounds how stale an
+    entry can get when the database is shared between several workers.
+
+    Parameters:
+    - max_entries (int): Entries kept before the least recently used one is evicted.
+    - ttl (float): Seconds an entry is served before it is reloaded.
+    """
+
+    def __init__(self, max_entries=1024, ttl=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, tag, value)
+        self._tags = {}  # (table, parent_id) -> set of keys
+        self._generations = {}  # table -> number of invalidations seen
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def generation(self, table):
+        """Token to take before loading a value; set() ignores the value if the table was invalidated since."""
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def set(self, key, value, table, parent_id=None, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(table, 0):
+                return
+            if key in self._entries:
+                self._remove(key)
+            tag = (table, parent_id)
+            self._entries[key] = (time.monotonic() + self.ttl, tag, value)
+            self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate(self, table, parent_id=None):
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            if parent_id is None:
+                tags = [tag for tag in self._tags if tag[0] == table]
+            else:
+                tags = [(table, parent_id), (table, None)]
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    del self._entries[key]
+                    self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        tag = self._entries.pop(key)[1]
+        keys = self._tags[tag]
+        keys.discard(key)
+        if not keys:
+            del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
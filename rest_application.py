@@ -1,38 +1,285 @@
-from flask import Flask, abort, jsonify, request
+from flask import Blueprint, Flask, Response, abort, current_app, g, jsonify, request, stream_with_context
 from datetime import datetime
 
-import sqlite3
+import json
+import threading
+import time
+import uuid
 from flask import Flask, request, jsonify
 import datetime
 import model
+import pytz
+from connection_pool import ConnectionPool
+from event_stream import Broadcaster
+from json_backend import use_fast_json
+from query_builder import FILTER_OPERATORS, filter_column
+from response_cache import ResponseCache
+from set_up_database import STORAGE_PROFILE, initialize_database
+from hot_tier import HotTier
+from write_queue import WriteQueue
 
 DATABASE = 'sportsbook.db'
+POOL_SIZE = 8
+# Prepared statements kept per connection; at least model.QUERY_SHAPE_CACHE_SIZE so every cached shape fits
+STATEMENT_CACHE_SIZE = 256
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 5.0
+# Longest time a worker can keep answering 304 for data another worker process has since changed
+ETAG_TTL = RESPONSE_CACHE_TTL
+STREAM_HISTORY = 1024
+STREAM_HEARTBEAT = 15.0
+# Group commit (WRITE_QUEUE_ENABLED): how long the writer waits to gather a batch, and its largest batch
+WRITE_QUEUE_DELAY = 0.002
+WRITE_QUEUE_MAX_BATCH = 256
+# Hot tier (HOT_TIER_ENABLED): longest time it can miss writes made by another worker process
+HOT_TIER_TTL = RESPONSE_CACHE_TTL
+
+# Connection pool of this process, sized from the app's config by create_app()
+pool = None
+# Writer thread the write routes go through when the app's WRITE_QUEUE_ENABLED is set, otherwise None
+write_queue = None
+# Replica of the active rows answering active=true searches when the app's HOT_TIER_ENABLED is set, otherwise None
+hot_tier = None
+
+# Databases whose schema this process has checked and migrated (see ensure_schema)
+schema_checked = set()
+schema_lock = threading.Lock()
+
+# Results of the read routes, invalidated by every write made through model.py
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Selection and event changes pushed to /events/<id>/stream subscribers, one channel per event
+broadcaster = Broadcaster(history=STREAM_HISTORY)
+
+
+# Cached results built from more than one table; a write to any of them drops every entry
+DEPENDENT_CACHE_TABLES = {
+    'Sports': ('SportsByActiveEvents',),
+    'Events': ('EventCards', 'SportsByActiveEvents', 'EventsByActiveSelections'),
+    'Selections': ('EventCards', 'EventsByActiveSelections'),
+}
+
+
+def invalidate_response_cache(table, parent_id, changes):
+    response_cache.invalidate(table, parent_id)
+    for dependent in DEPENDENT_CACHE_TABLES.get(table, ()):
+        response_cache.invalidate(dependent)
+
+
+def publish_event_changes(table, parent_id, changes):
+    for change in changes:
+        if table == 'Selections':
+            event_id = change.get('event_id')
+        elif table == 'Events':
+            event_id = change['id']
+        else:
+            return
+        # Encoded once here, whatever the number of subscribers
+        if broadcaster.has_subscribers(event_id):
+            broadcaster.publish(event_id, f"event: {table[:-1].lower()}\ndata: {json.dumps(change)}\n\n")
+
+
+model.write_listeners.append(invalidate_response_cache)
+model.write_listeners.append(publish_event_changes)
 
 
+# One pooled connection per request, kept on the app context and handed back to the pool on teardown
 def get_db():
-    conn = sqlite3.connect(DATABASE)
-    return conn
+    if 'db' not in g or g.db.closed:
+        g.db = pool.acquire()
+    return g.db
+
+
+# Writes run on the request's pooled connection, or, with the write queue on, are group-committed by its
+# writer thread; either way they return once the write is committed
+def run_write(write, *args):
+    """Run write(conn, *args), a model.py write function, and return its result."""
+    if write_queue is not None:
+        return write_queue.call(write, *args)
+    conn = get_db()
+    result = write(conn, *args)
+    conn.close()
+    return result
+
+
+api = Blueprint('api', __name__)
+
+
+# Startup check: create or migrate the schema (set_up_database.initialize_database) before the first
+# request is served, whatever server runs the app. It runs on the first request rather than in
+# create_app(), so importing this module, which builds the module-level app, touches no database.
+# Under gunicorn the master has already done it (gunicorn.conf.py) and this finds nothing to apply.
+def ensure_schema():
+    database = current_app.config['DATABASE']
+    if database in schema_checked or not current_app.config['SCHEMA_CHECK_ENABLED']:
+        return
+    with schema_lock:
+        if database not in schema_checked:
+            initialize_database(database)
+            schema_checked.add(database)
+
+
+def release_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+# Conditional GET. The ETag of a read route is built from the version counters model.py bumps on every
+# write to the tables the route reads, so an unchanged If-None-Match is answered with 304 before any
+# database work. A random per-process prefix keeps tags from colliding across restarts and workers,
+# and the ETAG_TTL time bucket bounds staleness from writes made in other processes.
+ETAG_PREFIX = uuid.uuid4().hex[:12]
+ROUTE_TABLES = {
+    'api.get_sports': ('Sports',),
+    'api.get_sport_events': ('Events',),
+    'api.get_events': ('Events',),
+    'api.get_event_selections': ('Selections',),
+    'api.get_selections': ('Selections',),
+}
+# Extra tables read by ?include= and by the active count filters
+INCLUDE_TABLES = {'selections': ('Selections',)}
+COUNT_FILTER_TABLES = {'min_active_events': ('Events',), 'min_active_selections': ('Selections',)}
+
+
+def current_etag(tables):
+    versions = '.'.join(str(model.table_versions[table]) for table in tables)
+    return f"{ETAG_PREFIX}-{versions}-{int(time.time() // ETAG_TTL)}"
+
+
+@api.before_request
+def answer_not_modified():
+    tables = ROUTE_TABLES.get(request.endpoint)
+    if request.method != 'GET' or tables is None:
+        return None
+    tables += INCLUDE_TABLES.get(request.args.get('include'), ())
+    for key in COUNT_FILTER_TABLES.keys() & request.args.keys():
+        tables += COUNT_FILTER_TABLES[key]
+
+    # Taken before the route reads anything, so a write racing the read can only make the tag too old
+    g.etag = current_etag(tables)
+    if request.if_none_match.contains(g.etag):
+        response = Response(status=304)
+        response.set_etag(g.etag)
+        return response
+    return None
+
+
+@api.after_request
+def add_etag(response):
+    etag = g.get('etag')
+    if etag is not None and response.status_code == 200:
+        response.set_etag(etag)
+    return response
+
+
+@api.route('/stats', methods=['GET'])
+def get_stats():
+    return {'pool': pool.stats(), 'response_cache': response_cache.stats(), 'streams': broadcaster.stats(),
+            'query_shapes': model.query_builder.stats(),
+            'write_queue': write_queue.stats() if write_queue is not None else None,
+            'hot_tier': hot_tier.stats() if hot_tier is not None else None}, 200
+
+
+# Validation of a single create body; each returns an error message, or None if the body is valid
+def validate_sport(data):
+    if not isinstance(data, dict):
+        return 'Expected a JSON object'
+    if 'name' not in data or 'slug' not in data or 'active' not in data:
+        return 'Missing required parameter in the JSON body'
+    if not isinstance(data['name'], str) or not isinstance(data['slug'], str) or not isinstance(data['active'], bool):
+        return 'Invalid value type for parameter in the JSON body'
+    return None
+
+
+# Define required event parameters and their types
+EVENT_PARAMS = {
+    'name': str,
+    'slug': str,
+    'active': bool,
+    'type': str,
+    'sport_id': int,
+    'status': str,
+    'scheduled_start': str,
+    'actual_start': str
+}
+
+
+def validate_event(data):
+    if not isinstance(data, dict):
+        return 'Expected a JSON object'
+    for param, ptype in EVENT_PARAMS.items():
+        if param not in data:
+            return f"Missing required parameter {param} in the JSON body"
+
+        if not isinstance(data[param], ptype):
+            return f"Invalid value type for parameter {param} in the JSON body"
+    return None
+
+
+def validate_selection(data):
+    if not isinstance(data, dict):
+        return 'Expected a JSON object'
+    if 'name' not in data or 'event_id' not in data or 'price' not in data or 'active' not in data or 'outcome' not in data:
+        return 'Missing required parameter in the JSON body'
+
+    if not isinstance(data['name'], str) or not isinstance(data['event_id'], int) or not isinstance(data['price'],
+                                                                                                    float) \
+            or not isinstance(data['active'], bool) or not isinstance(data['outcome'], str):
+        return 'Invalid value type for parameter in the JSON body'
+    return None
+
+
+# A JSON array posted to a create route is validated row by row up front, then inserted in one transaction
+def create_many(rows, validate, create_many_rows, columns, *args):
+    if not rows:
+        abort(400, 'Expected at least one row in the JSON array')
+
+    errors = []
+    for index, row in enumerate(rows):
+        error = validate(row)
+        if error:
+            errors.append({'index': index, 'error': error})
+    if errors:
+        return {'status': 'failure', 'errors': errors}, 400
 
+    try:
+        run_write(create_many_rows, [tuple(row[column] for column in columns) for row in rows], *args)
+    except model.BatchInsertError as e:
+        return {'status': 'failure', 'errors': e.errors}, 400
+    except Exception as e:
+        abort(500, str(e))
 
-app = Flask(__name__)
+    return {'status': 'success', 'created': len(rows)}, 201
+
+
+# A bulk event import (a JSON array) can give its start times as local times in ?tz=, e.g. Europe/London,
+# in the form 2023-07-10 20:00:00; they are stored converted to UTC
+def import_timezone(args):
+    """Return the tz of a bulk import's query string, or None. Raises ValueError for an unknown timezone."""
+    tz = args.get('tz')
+    if tz is not None:
+        try:
+            model.get_timezone(tz)
+        except pytz.UnknownTimeZoneError:
+            raise ValueError(f'Unknown timezone: {tz}')
+    return tz
 
 
 # Creating
-@app.route('/sports', methods=['POST'])
+@api.route('/sports', methods=['POST'])
 def create_sport():
     data = request.json
+    if isinstance(data, list):
+        return create_many(data, validate_sport, model.create_sport_many, ('name', 'slug', 'active'))
 
     # Validate inputs
-    if 'name' not in data or 'slug' not in data or 'active' not in data:
-        abort(400, 'Missing required parameter in the JSON body')
-
-    if not isinstance(data['name'], str) or not isinstance(data['slug'], str) or not isinstance(data['active'], bool):
-        abort(400, 'Invalid value type for parameter in the JSON body')
+    error = validate_sport(data)
+    if error:
+        abort(400, error)
 
     try:
-        conn = get_db()
-        model.create_sport(conn, data['name'], data['slug'], data['active'])
-        conn.close()
+        run_write(model.create_sport, data['name'], data['slug'], data['active'])
     except Exception as e:
         print(e)
         abort(500, str(e))
@@ -40,59 +287,46 @@ def create_sport():
     return {'status': 'success'}, 201
 
 
-@app.route('/events', methods=['POST'])
+@api.route('/events', methods=['POST'])
 def create_event():
     data = request.json
-
-    # Define required parameters and their types
-    required_params = {
-        'name': str,
-        'slug': str,
-        'active': bool,
-        'type': str,
-        'sport_id': int,
-        'status': str,
-        'scheduled_start': str,
-        'actual_start': str
-    }
+    if isinstance(data, list):
+        try:
+            tz = import_timezone(request.args)
+        except ValueError as e:
+            abort(400, str(e))
+        return create_many(data, validate_event, model.create_event_many, tuple(EVENT_PARAMS), tz)
 
     # Validate inputs
-    for param, ptype in required_params.items():
-        if param not in data:
-            abort(400, f"Missing required parameter {param} in the JSON body")
-
-        if not isinstance(data[param], ptype):
-            abort(400, f"Invalid value type for parameter {param} in the JSON body")
+    error = validate_event(data)
+    if error:
+        abort(400, error)
 
     try:
-        conn = get_db()
-        model.create_event(conn, data['name'], data['slug'], data['active'], data['type'], data['sport_id'],
-                           data['status'], data['scheduled_start'], data['actual_start'])
-        conn.close()
+        run_write(model.create_event, data['name'], data['slug'], data['active'], data['type'], data['sport_id'],
+                  data['status'], data['scheduled_start'], data['actual_start'])
     except Exception as e:
         abort(500, str(e))
 
     return {'status': 'success'}, 201
 
 
-@app.route('/selections', methods=['POST'])
+@api.route('/selections', methods=['POST'])
 def create_selection():
     data = request.json
+    if isinstance(data, list):
+        return create_many(data, validate_selection, model.create_selection_many,
+                           ('name', 'event_id', 'price', 'active', 'outcome'))
 
     # Validate inputs
-    if 'name' not in data or 'event_id' not in data or 'price' not in data or 'active' not in data or 'outcome' not in data:
-        abort(400, 'Missing required parameter in the JSON body')
-
-    if not isinstance(data['name'], str) or not isinstance(data['event_id'], int) or not isinstance(data['price'],
-                                                                                                    float) \
-            or not isinstance(data['active'], bool) or not isinstance(data['outcome'], str):
-        abort(400, 'Invalid value type for parameter in the JSON body')
+    error = validate_selection(data)
+    if error:
+        abort(400, error)
 
     # Handle exceptions
     try:
-        conn = get_db()
-        model.create_selection(conn, data['name'], data['event_id'], data['price'], data['active'], data['outcome'])
-        conn.close()
+        run_write(model.create_selection, data['name'], data['event_id'], data['price'], data['active'],
+                  data['outcome'])
     except Exception as e:
         abort(500, str(e))
 
@@ -100,7 +334,7 @@ def create_selection():
 
 
 # Updating
-@app.route('/sports/<int:sport_id>', methods=['PUT'])
+@api.route('/sports/<int:sport_id>', methods=['PUT'])
 def update_sport(sport_id):
     data = request.json
 
@@ -111,16 +345,14 @@ def update_sport(sport_id):
         abort(400, description="Invalid data types. 'name' and 'slug' should be strings. 'active' should be a boolean.")
 
     try:
-        conn = get_db()
-        model.update_sport(conn, sport_id, data['name'], data['slug'], data['active'])
-        conn.close()
+        run_write(model.update_sport, sport_id, data['name'], data['slug'], data['active'])
     except Exception as e:
         return {'status': 'failure', 'message': str(e)}, 500
 
     return {'status': 'success'}, 200
 
 
-@app.route('/events/<int:event_id>', methods=['PUT'])
+@api.route('/events/<int:event_id>', methods=['PUT'])
 def update_event(event_id):
     data = request.get_json()
 
@@ -141,16 +373,14 @@ def update_event(event_id):
                           "format).")
 
     try:
-        conn = get_db()
-        model.update_event(conn, event_id, data)
-        conn.close()
+        run_write(model.update_event, event_id, data)
     except Exception as e:
         return {'status': 'failure', 'message': str(e)}, 500
 
     return {'message': 'Event updated successfully'}, 200
 
 
-@app.route('/selections/<int:selection_id>', methods=['PUT'])
+@api.route('/selections/<int:selection_id>', methods=['PUT'])
 def update_selection(selection_id):
     data = request.get_json()
 
@@ -172,21 +402,238 @@ def update_selection(selection_id):
         abort(400, description="Invalid data type. 'outcome' should be a string.")
 
     try:
-        conn = get_db()
-        model.update_selection(conn, selection_id, data)
-        conn.close()
+        run_write(model.update_selection, selection_id, data)
     except Exception as e:
         return {'status': 'failure', 'message': str(e)}, 500
 
     return {'message': 'Selection updated successfully'}, 200
 
 
+# Each price update is [selection_id, price] or [selection_id, price, active]
+def validate_price_update(row):
+    if not isinstance(row, list) or len(row) not in (2, 3):
+        return 'Expected [selection_id, price] or [selection_id, price, active]'
+    if not isinstance(row[0], int) or isinstance(row[0], bool):
+        return "Invalid data type. 'selection_id' should be an integer."
+    if not isinstance(row[1], (int, float)) or isinstance(row[1], bool):
+        return "Invalid data type. 'price' should be a numeric value."
+    if len(row) == 3 and not isinstance(row[2], bool):
+        return "Invalid data type. 'active' should be a boolean."
+    return None
+
+
+@api.route('/selections/prices', methods=['PATCH'])
+def update_selection_prices():
+    data = request.get_json()
+
+    # Validate input
+    if not isinstance(data, list) or not data:
+        abort(400, description="Invalid data. Expected a non-empty list of [selection_id, price(, active)].")
+
+    errors = []
+    for index, row in enumerate(data):
+        error = validate_price_update(row)
+        if error:
+            errors.append({'index': index, 'error': error})
+    if errors:
+        return {'status': 'failure', 'errors': errors}, 400
+
+    try:
+        updated = run_write(model.update_selection_prices, [tuple(row) for row in data])
+    except Exception as e:
+        return {'status': 'failure', 'message': str(e)}, 500
+
+    return {'message': 'Prices updated successfully', 'updated': updated}, 200
+
+
+# Paging and streaming for the search routes.
+# ?limit=N&after_id=ID returns the next N rows after ID (in id order) plus the cursor for the following page.
+# ?stream=ndjson or ?stream=json streams every matching row in batches instead of building one response.
+STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+
+def parse_paging(filters):
+    """Remove the paging arguments from filters and return (page, stream), page being the model kwargs."""
+    page = {}
+    for name in ('limit', 'after_id'):
+        if name in filters:
+            value = filters.pop(name)
+            # isdecimal(), not isdigit(): int() rejects digits such as '²' that isdigit() accepts
+            if not value.isdecimal():
+                raise ValueError(f'Invalid {name} value, must be a non-negative integer.')
+            page[name] = int(value)
+    if page.get('limit') == 0:
+        raise ValueError('Invalid limit value, must be at least 1.')
+
+    stream = filters.pop('stream', None)
+    if stream is not None and stream not in STREAM_FORMATS:
+        raise ValueError('Invalid stream value, must be one of: {}'.format(", ".join(STREAM_FORMATS)))
+    return page, stream
+
+
+# /events and /selections filters may end in an operator suffix (query_builder.FILTER_OPERATORS), e.g.
+# ?price__gte=1.5&price__lt=3.0 or ?status__in=Pending,Started. The column must still be whitelisted.
+def valid_filter(key, valid_filters):
+    column, operator = filter_column(key)
+    return column in valid_filters and operator in FILTER_OPERATORS
+
+
+# active filters take true or false, also with an operator: active__ne=true, or active__in=true,false
+# with each value converted. Raises ValueError for any other value.
+def parse_active_filters(filters):
+    for key, value in filters.items():
+        column, operator = filter_column(key)
+        if column != 'active':
+            continue
+        values = []
+        for item in value.split(',') if operator == 'in' else (value,):
+            if item.lower() not in ('true', 'false'):
+                raise ValueError('Invalid active value, must be true or false.')
+            values.append(1 if item.lower() == 'true' else 0)
+        filters[key] = tuple(values) if operator == 'in' else values[0]
+
+
+# __in values are comma separated
+def split_list_filters(filters):
+    for key, value in filters.items():
+        if key.endswith('__in') and isinstance(value, str):
+            filters[key] = tuple(value.split(','))
+
+
+# ?min_active_events=N (sports) and ?min_active_selections=N (events) keep rows with at least N active
+# children. They are answered from the counters behind model.COUNT_FILTERS.
+def parse_count_filters(filters, table):
+    """Convert the count filters in filters to int in place and return whether there were any."""
+    counted = False
+    for key in model.COUNT_FILTERS[table]:
+        if key in filters:
+            value = filters[key]
+            if not value.isdecimal():
+                raise ValueError(f'Invalid {key} value, must be a non-negative integer.')
+            filters[key] = int(value)
+            counted = True
+    return counted
+
+
+# ?from=&to= select events by scheduled_start and ?started_from=&started_to= by actual_start, the upper
+# bound exclusive: ?from=2023-07-10T18:00&to=2023-07-10T20:00 is the two hours from 18:00. Times are ISO 8601;
+# one without a UTC offset is read in ?tz= (a timezone name such as Europe/London, UTC by default).
+def parse_time_filters(filters):
+    """Remove tz from filters and convert the time filters to UTC epoch seconds in place."""
+    tz = filters.pop('tz', 'UTC')
+    for key in model.TIME_FILTERS['Events']:
+        if key in filters:
+            try:
+                filters[key] = model.to_epoch(filters[key], tz)
+            except ValueError as e:
+                raise ValueError(f'Invalid {key} value: {e}')
+
+
+# ?fields=id,name,price returns each row as an object with just those keys, and only those columns are
+# read. ?fields=* returns objects with every column. Without fields, rows stay positional arrays.
+def parse_fields(filters, table, page):
+    """Remove fields from filters and return the model kwargs for the projection."""
+    value = filters.pop('fields', None)
+    if value is None:
+        return {}
+    valid_fields = model.TABLE_FIELDS[table]
+    if value == '*':
+        fields = valid_fields
+    else:
+        fields = tuple(dict.fromkeys(name.strip() for name in value.split(',')))
+        invalid_fields = [name for name in fields if name not in valid_fields]
+        if invalid_fields:
+            raise ValueError('Invalid fields: {}. Valid fields are {}'.format(", ".join(invalid_fields),
+                                                                              ", ".join(valid_fields)))
+    # The cursor for the next page is the last row's id
+    if page and 'id' not in fields:
+        fields = ('id',) + fields
+    return {'fields': fields}
+
+
+def row_id(row):
+    return row['id'] if isinstance(row, dict) else row[0]
+
+
+def paged_response(key, rows, page):
+    next_after_id = row_id(rows[-1]) if rows and 'limit' in page and len(rows) == page['limit'] else None
+    return jsonify({key: rows, 'next_after_id': next_after_id}), 200
+
+
+def streamed_response(key, stream_search, filters, page, stream, projection):
+    dumps = current_app.json.dumps
+
+    def generate():
+        conn = get_db()
+        try:
+            if stream == 'json':
+                yield '{"%s": [' % key
+            separator = ''
+            for rows in stream_search(conn, filters, **page, **projection):
+                if stream == 'ndjson':
+                    yield ''.join(dumps(row) + '\n' for row in rows)
+                else:
+                    yield separator + ','.join(dumps(row) for row in rows)
+                    separator = ','
+            if stream == 'json':
+                yield ']}'
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream])
+
+
+CACHE_MISS = object()
+
+
+def cache_key_part(value):
+    return tuple(sorted(value.items())) if isinstance(value, dict) else value
+
+
+# active=true searches with plain filters are answered from the hot tier's memory; None means read SQLite
+def hot_search(table, filters, page, projection):
+    if hot_tier is None:
+        return None
+    return hot_tier.search(table, filters, **page, **projection)
+
+
+def cached_read(table, parent_id, read, *args, **kwargs):
+    """
+    Run read(conn, *args, **kwargs) on a pooled connection, going through the response cache.
+
+    The cache key is the route plus the normalized arguments, so differently ordered query strings
+    share an entry. table and parent_id say which writes invalidate the result.
+    """
+    def load():
+        conn = get_db()
+        rows = read(conn, *args, **kwargs)
+        conn.close()
+        return rows
+
+    if not current_app.config['RESPONSE_CACHE_ENABLED']:
+        return load()
+
+    key = (request.path, read.__name__, tuple(cache_key_part(arg) for arg in args), cache_key_part(kwargs))
+    rows = response_cache.get(key, CACHE_MISS)
+    if rows is CACHE_MISS:
+        generation = response_cache.generation(table)
+        rows = load()
+        response_cache.set(key, rows, table, parent_id, generation)
+    return rows
+
+
 # Searching
-@app.route('/sports', methods=['GET'])
+@api.route('/sports', methods=['GET'])
 def get_sports():
     # Validate input
-    valid_filters = {'name', 'active'}  # define valid filters
+    valid_filters = {'name', 'active', 'min_active_events'}  # define valid filters
     filters = request.args.to_dict()
+    try:
+        page, stream = parse_paging(filters)
+        projection = parse_fields(filters, 'Sports', page)
+        counted = parse_count_filters(filters, 'Sports')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     if 'active' in filters:
         if filters['active'].lower() == "true":
@@ -201,24 +648,26 @@ def get_sports():
         invalid_filters = set(filters.keys()) - valid_filters
         abort(400, description="Invalid filters: {}".format(", ".join(invalid_filters)))
 
+    if stream:
+        return streamed_response('sports', model.stream_sports, filters, page, stream, projection)
+
     try:
-        conn = get_db()
-        sports = model.search_sports(conn, filters)
-        conn.close()
+        table = 'SportsByActiveEvents' if counted else 'Sports'
+        sports = hot_search('Sports', filters, page, projection)
+        if sports is None:
+            sports = cached_read(table, None, model.search_sports, filters, **page, **projection)
     except Exception as e:
         return {'status': 'failure', 'message': str(e)}, 500
 
+    if page:
+        return paged_response('sports', sports, page)
     return {'sports': sports}, 200
 
 
-@app.route('/sports/<int:sport_id>/events', methods=['GET'])
+@api.route('/sports/<int:sport_id>/events', methods=['GET'])
 def get_sport_events(sport_id):
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('SELECT * FROM Events WHERE sport_id = ?', (sport_id,))
-        events = c.fetchall()
-        conn.close()
+        events = cached_read('Events', sport_id, model.read_sport_events, sport_id)
         if events:
             return jsonify({'events': events}), 200
         else:
@@ -227,26 +676,40 @@ def get_sport_events(sport_id):
         return jsonify({'error': str(e)}), 400
 
 
-@app.route('/events', methods=['GET'])
+@api.route('/events', methods=['GET'])
 def get_events():
     valid_event_filters = ['name', 'type', 'status', 'scheduled_start', 'actual_start', 'active', 'sport_id']
 
     try:
         filters = request.args.to_dict()
-        if 'active' in filters:
-            if filters['active'].lower() == "true":
-                filters['active'] = 1
-            elif filters['active'].lower() == "false":
-                filters['active'] = 0
-            else:
-                return jsonify({'error': 'Invalid active value, must be true or false.'}), 400
+        page, stream = parse_paging(filters)
+        projection = parse_fields(filters, 'Events', page)
+        include = filters.pop('include', None)
+        if include not in (None, 'selections'):
+            return jsonify({'error': 'Invalid include value, must be selections.'}), 400
+        parse_active_filters(filters)
+        counted = parse_count_filters(filters, 'Events')
+        parse_time_filters(filters)
         for key in filters.keys():
-            if key not in valid_event_filters:
+            if key not in model.EXTRA_FILTERS['Events'] and not valid_filter(key, valid_event_filters):
                 return {'error': f'Invalid filter: {key}'}, 400
+        split_list_filters(filters)
 
-        conn = get_db()
-        events = model.search_events(conn, filters)
-        conn.close()
+        if include:
+            # Event cards: each event with its selections embedded, read in two queries instead of N+1
+            table, search, stream_search = 'EventCards', model.search_event_cards, model.stream_event_cards
+        else:
+            table = 'EventsByActiveSelections' if counted else 'Events'
+            search, stream_search = model.search_events, model.stream_events
+
+        if stream:
+            return streamed_response('events', stream_search, filters, page, stream, projection)
+
+        events = None if include else hot_search('Events', filters, page, projection)
+        if events is None:
+            events = cached_read(table, None, search, filters, **page, **projection)
+        if page:
+            return paged_response('events', events, page)
         if events:
             return jsonify({'events': events}), 200
         else:
@@ -255,14 +718,10 @@ def get_events():
         return jsonify({'error': str(e)}), 400
 
 
-@app.route('/events/<int:event_id>/selections', methods=['GET'])
+@api.route('/events/<int:event_id>/selections', methods=['GET'])
 def get_event_selections(event_id):
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('SELECT * FROM Selections WHERE event_id = ?', (event_id,))
-        selections = c.fetchall()
-        conn.close()
+        selections = cached_read('Selections', event_id, model.read_event_selections, event_id)
         if selections:
             return jsonify({'selections': selections}), 200
         else:
@@ -271,28 +730,31 @@ def get_event_selections(event_id):
         return jsonify({'error': str(e)}), 400
 
 
-@app.route('/selections', methods=['GET'])
+@api.route('/selections', methods=['GET'])
 def get_selections():
     try:
         filters = request.args.to_dict()
-        if 'active' in filters:
-            if filters['active'].lower() == "true":
-                filters['active'] = 1
-            elif filters['active'].lower() == "false":
-                filters['active'] = 0
-            else:
-                return jsonify({'error': 'Invalid active value, must be true or false.'}), 400
+        page, stream = parse_paging(filters)
+        projection = parse_fields(filters, 'Selections', page)
+        parse_active_filters(filters)
 
         # Validate filters before using them
         valid_filters = ["name", "event_id", "price", "active", "outcome"]
         for filter_name in filters.keys():
-            if filter_name not in valid_filters:
+            if not valid_filter(filter_name, valid_filters):
                 return jsonify({'error': f'Invalid filter: {filter_name}. Valid filters are {valid_filters}'}), 400
+        split_list_filters(filters)
 
-        conn = get_db()
-        selections = model.search_selections(conn, filters)
-        conn.close()
+        if stream:
+            return streamed_response('selections', model.stream_selections, filters, page, stream, projection)
+
+        selections = hot_search('Selections', filters, page, projection)
+        if selections is None:
+            selections = cached_read('Selections', None, model.search_selections, filters, **page,
+                                         **projection)
 
+        if page:
+            return paged_response('selections', selections, page)
         if selections:
             return jsonify({'selections': selections}), 200
         else:
@@ -302,5 +764,78 @@ def get_selections():
         return jsonify({'error': str(e)}), 400
 
 
+# Server-Sent Events: 'selection' and 'event' messages carry the changed columns of a row of this event.
+# 'reset' means the client fell behind and should reload /events/<id>/selections.
+@api.route('/events/<int:event_id>/stream', methods=['GET'])
+def stream_event(event_id):
+    subscription = broadcaster.subscribe(event_id)
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                messages = subscription.wait(timeout=STREAM_HEARTBEAT)
+                if messages is None:
+                    # The server is shutting down
+                    return
+                if not messages:
+                    yield ': heartbeat\n\n'
+                else:
+                    yield ''.join('event: reset\ndata: {}\n\n' if message is Broadcaster.RESET else message
+                                  for message in messages)
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def create_app(config=None):
+    """
+    Build the application.
+
+    Settings are the module defaults, overridden by SPORTSBOOK_* environment variables (for example
+    SPORTSBOOK_DATABASE or SPORTSBOOK_POOL_SIZE), then by config. No database connection is opened
+    here, so a pre-fork server can build the app once in its master process: every worker opens its
+    own pooled connections, and with WRITE_QUEUE_ENABLED starts its own writer thread, on first use.
+    With HOT_TIER_ENABLED, each worker loads its own hot tier on its first active=true search, or
+    at startup under gunicorn (see gunicorn.conf.py). The schema is brought up to date before the
+    first request is served (ensure_schema), unless SCHEMA_CHECK_ENABLED is off.
+    """
+    global pool, write_queue, hot_tier
+    app = Flask(__name__)
+    app.config.update(DATABASE=DATABASE, POOL_SIZE=POOL_SIZE, STATEMENT_CACHE_SIZE=STATEMENT_CACHE_SIZE,
+                      RESPONSE_CACHE_ENABLED=True, FAST_JSON=True, WRITE_QUEUE_ENABLED=False,
+                      WRITE_QUEUE_DELAY=WRITE_QUEUE_DELAY, WRITE_QUEUE_MAX_BATCH=WRITE_QUEUE_MAX_BATCH,
+                      HOT_TIER_ENABLED=False, HOT_TIER_TTL=HOT_TIER_TTL, SCHEMA_CHECK_ENABLED=True)
+    app.config.from_prefixed_env('SPORTSBOOK')
+    if config:
+        app.config.update(config)
+    use_fast_json(app)
+
+    if pool is not None:
+        pool.close_all()
+    pool = ConnectionPool(app.config['DATABASE'], max_size=app.config['POOL_SIZE'], pragmas=STORAGE_PROFILE,
+                         cached_statements=app.config['STATEMENT_CACHE_SIZE'])
+    if write_queue is not None:
+        write_queue.close()
+    write_queue = None
+    if app.config['WRITE_QUEUE_ENABLED']:
+        write_queue = WriteQueue(app.config['DATABASE'], max_delay=app.config['WRITE_QUEUE_DELAY'],
+                                 max_batch=app.config['WRITE_QUEUE_MAX_BATCH'])
+    if hot_tier is not None:
+        hot_tier.close()
+    hot_tier = None
+    if app.config['HOT_TIER_ENABLED']:
+        hot_tier = HotTier(app.config['DATABASE'], ttl=app.config['HOT_TIER_TTL'], pragmas=STORAGE_PROFILE)
+    app.register_blueprint(api)
+    app.before_request(ensure_schema)
+    app.teardown_appcontext(release_db)
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,55 +1,234 @@
+import collections
 import sqlite3
+import sys
+import time
 
+DATABASE = 'sportsbook.db'
 
-def create_database_and_tables():
-    conn = sqlite3.connect('sportsbook.db')  # This creates the database file if it doesn't exist
-    c = conn.cursor()
+# PRAGMAs applied when the database is created and every time a connection is opened.
+# busy_timeout goes first so the switch to WAL waits for other connections instead of failing.
+STORAGE_PROFILE = {
+    'busy_timeout': 5000,  # ms to wait on a locked database before raising
+    'journal_mode': 'WAL',  # readers no longer block on the writer (persisted in the file)
+    'synchronous': 'NORMAL',  # fsync at checkpoints only; safe from corruption in WAL mode
+    'mmap_size': 268435456,  # 256 MB of the file read through the page cache instead of read()
+    'cache_size': -65536,  # 64 MB page cache per connection (negative = KiB)
+    'temp_store': 'MEMORY',  # sorts and temp indexes stay in memory
+}
 
-    # Create Sports table
-    c.execute('''
-        CREATE TABLE Sports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            slug TEXT NOT NULL UNIQUE,
-            active BOOLEAN NOT NULL
-        )
-    ''')
-
-    # Create Events table
-    c.execute('''
-        CREATE TABLE Events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            slug TEXT NOT NULL UNIQUE,
-            active BOOLEAN NOT NULL,
-            type TEXT NOT NULL CHECK(type IN ('preplay', 'inplay')),
-            sport_id INTEGER,
-            status TEXT NOT NULL CHECK(status IN ('Pending', 'Started', 'Ended', 'Cancelled')),
-            scheduled_start TEXT NOT NULL,
-            actual_start TEXT,
-            FOREIGN KEY(sport_id) REFERENCES Sports(id)
-        )
-    ''')
-
-    # Create Selections table
-    c.execute('''
-        CREATE TABLE Selections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            event_id INTEGER,
-            price REAL NOT NULL,
-            active BOOLEAN NOT NULL,
-            outcome TEXT NOT NULL CHECK(outcome IN ('Unsettled', 'Void', 'Lose', 'Win')),
-            FOREIGN KEY(event_id) REFERENCES Events(id)
-        )
-    ''')
 
-    conn.commit()
-    conn.close()
+def apply_storage_profile(conn, profile=None):
+    if profile is None:
+        profile = STORAGE_PROFILE
+    for name, value in profile.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+# Start times as seconds since the epoch in UTC. The start columns hold ISO 8601 text in mixed forms
+# ('2023-07-10 20:00:00', '2023-06-26T18:00:00Z', '2023-07-06T02:00:00+02:00') that do not sort correctly
+# as text; strftime() reads them all (a time without an offset is UTC). Migration 3 indexes these
+# expressions, so SQLite computes the value on every write and a query using the same expression text
+# gets an index range scan.
+SCHEDULED_START_EPOCH = "CAST(strftime('%s', scheduled_start) AS INTEGER)"
+ACTUAL_START_EPOCH = "CAST(strftime('%s', actual_start) AS INTEGER)"
+
+
+# The base tables. IF NOT EXISTS makes creating them a no-op on an existing database; every later change
+# to the schema is a migration below.
+TABLES = [
+    '''CREATE TABLE IF NOT EXISTS Sports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        slug TEXT NOT NULL UNIQUE,
+        active BOOLEAN NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS Events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        slug TEXT NOT NULL UNIQUE,
+        active BOOLEAN NOT NULL,
+        type TEXT NOT NULL CHECK(type IN ('preplay', 'inplay')),
+        sport_id INTEGER,
+        status TEXT NOT NULL CHECK(status IN ('Pending', 'Started', 'Ended', 'Cancelled')),
+        scheduled_start TEXT NOT NULL,
+        actual_start TEXT,
+        FOREIGN KEY(sport_id) REFERENCES Sports(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS Selections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        event_id INTEGER,
+        price REAL NOT NULL,
+        active BOOLEAN NOT NULL,
+        outcome TEXT NOT NULL CHECK(outcome IN ('Unsettled', 'Void', 'Lose', 'Win')),
+        FOREIGN KEY(event_id) REFERENCES Events(id)
+    )''',
+]
+
+# A schema migration. Its statements run in one transaction together with the version bump, unless it is
+# online: then every statement must be idempotent (CREATE INDEX IF NOT EXISTS, ...) and runs in its own
+# transaction, so writers on a live database wait for one index build at a time instead of the whole step,
+# and a step interrupted halfway picks up where it stopped. A statement may also be a function of the
+# connection, for changes SQL has no idempotent form of (see add_column).
+Migration = collections.namedtuple('Migration', 'description statements online', defaults=(False,))
+
+
+# Migration statement adding a column unless the table has it already (ALTER TABLE has no IF NOT EXISTS).
+# definition is the column definition of ALTER TABLE ... ADD COLUMN, e.g. 'liability REAL NOT NULL DEFAULT 0'.
+def add_column(table, definition):
+    column = definition.split()[0]
+
+    def add(conn):
+        if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+    return add
+
+
+# Schema migrations on top of TABLES, applied in order. PRAGMA user_version records how many have run,
+# so migrate() only applies the steps a database has not seen yet. Append new steps; never edit or
+# reorder the ones a database may already have applied.
+MIGRATIONS = [
+    Migration('secondary indexes for foreign keys and filterable columns', [
+        "CREATE INDEX IF NOT EXISTS idx_events_sport_id_active ON Events (sport_id, active)",
+        "CREATE INDEX IF NOT EXISTS idx_selections_event_id_active ON Selections (event_id, active)",
+        "CREATE INDEX IF NOT EXISTS idx_events_scheduled_start ON Events (scheduled_start)",
+        "CREATE INDEX IF NOT EXISTS idx_events_type_status ON Events (type, status)",
+    ], online=True),
+    # Active child counts per sport and per event, kept up to date by triggers on every write path
+    # (both model layers, bulk inserts, the status cascades) and backfilled from the existing rows.
+    # Indexed by count, so "at least N active children" is a range scan over the matching parents only.
+    # Not online: the backfill and the triggers must start from the same snapshot.
+    Migration('active child counters', [
+        "CREATE TABLE IF NOT EXISTS SportActiveCounts (sport_id INTEGER PRIMARY KEY, "
+        "active_events INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS EventActiveCounts (event_id INTEGER PRIMARY KEY, "
+        "active_selections INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR REPLACE INTO SportActiveCounts (sport_id, active_events) "
+        "SELECT id, (SELECT COUNT(*) FROM Events WHERE sport_id = Sports.id AND active) FROM Sports",
+        "INSERT OR REPLACE INTO EventActiveCounts (event_id, active_selections) "
+        "SELECT id, (SELECT COUNT(*) FROM Selections WHERE event_id = Events.id AND active) FROM Events",
+        "CREATE INDEX IF NOT EXISTS idx_sport_active_counts ON SportActiveCounts (active_events)",
+        "CREATE INDEX IF NOT EXISTS idx_event_active_counts ON EventActiveCounts (active_selections)",
+        '''CREATE TRIGGER IF NOT EXISTS sports_active_counts_insert AFTER INSERT ON Sports BEGIN
+            INSERT OR IGNORE INTO SportActiveCounts (sport_id) VALUES (NEW.id);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS sports_active_counts_delete AFTER DELETE ON Sports BEGIN
+            DELETE FROM SportActiveCounts WHERE sport_id = OLD.id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS events_active_counts_insert AFTER INSERT ON Events BEGIN
+            INSERT OR IGNORE INTO EventActiveCounts (event_id) VALUES (NEW.id);
+            UPDATE SportActiveCounts SET active_events = active_events + 1 WHERE sport_id = NEW.sport_id AND NEW.active;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS events_active_counts_update AFTER UPDATE OF active, sport_id ON Events
+        WHEN (OLD.active != 0) != (NEW.active != 0) OR OLD.sport_id IS NOT NEW.sport_id BEGIN
+            UPDATE SportActiveCounts SET active_events = active_events - 1 WHERE sport_id = OLD.sport_id AND OLD.active;
+            UPDATE SportActiveCounts SET active_events = active_events + 1 WHERE sport_id = NEW.sport_id AND NEW.active;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS events_active_counts_delete AFTER DELETE ON Events BEGIN
+            DELETE FROM EventActiveCounts WHERE event_id = OLD.id;
+            UPDATE SportActiveCounts SET active_events = active_events - 1 WHERE sport_id = OLD.sport_id AND OLD.active;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS selections_active_counts_insert AFTER INSERT ON Selections WHEN NEW.active BEGIN
+            UPDATE EventActiveCounts SET active_selections = active_selections + 1 WHERE event_id = NEW.event_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS selections_active_counts_update AFTER UPDATE OF active, event_id ON Selections
+        WHEN (OLD.active != 0) != (NEW.active != 0) OR OLD.event_id IS NOT NEW.event_id BEGIN
+            UPDATE EventActiveCounts SET active_selections = active_selections - 1
+            WHERE event_id = OLD.event_id AND OLD.active;
+            UPDATE EventActiveCounts SET active_selections = active_selections + 1
+            WHERE event_id = NEW.event_id AND NEW.active;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS selections_active_counts_delete AFTER DELETE ON Selections WHEN OLD.active BEGIN
+            UPDATE EventActiveCounts SET active_selections = active_selections - 1 WHERE event_id = OLD.event_id;
+        END''',
+    ]),
+    # Start times normalized to UTC epoch seconds, indexed; building the index fills it for existing rows
+    Migration('indexed UTC start times', [
+        f"CREATE INDEX IF NOT EXISTS idx_events_scheduled_start_epoch ON Events ({SCHEDULED_START_EPOCH})",
+        f"CREATE INDEX IF NOT EXISTS idx_events_actual_start_epoch ON Events ({ACTUAL_START_EPOCH})",
+    ], online=True),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Run statements in one write transaction and, if version is given, record it as the schema version.
+# BEGIN IMMEDIATE takes the write lock before the version is read, so when two processes start up
+# against the same database, the second sees the first one's migration and skips it (returns False).
+def run_transaction(conn, statements, version=None):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if version is not None and schema_version(conn) >= version:
+            conn.rollback()
+            return False
+        for statement in statements:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(statement)
+        if version is not None:
+            conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return True
+
+
+def migrate(conn, report=None):
+    """
+    Apply pending MIGRATIONS and return the resulting schema version. report, if given, is called as
+    report(number, migration, seconds) after each migration this call applied.
+
+    Raises RuntimeError if the database was migrated by newer code than this, with steps it does not know.
+    """
+    version = schema_version(conn)
+    if version > len(MIGRATIONS):
+        raise RuntimeError(f"Database schema version {version} is newer than the {len(MIGRATIONS)} "
+                           f"migrations known here; upgrade the application before starting it")
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        start = time.perf_counter()
+        if migration.online:
+            for statement in migration.statements:
+                run_transaction(conn, [statement])
+            applied = run_transaction(conn, [], number)
+        else:
+            applied = run_transaction(conn, migration.statements, number)
+        if applied and report is not None:
+            report(number, migration, time.perf_counter() - start)
+    return schema_version(conn)
+
+
+def create_database_and_tables(database=DATABASE, profile=None, report=None):
+    """
+    Create the tables that do not exist yet and apply pending migrations, and return the schema version.
+    Safe to run on an existing database, which it brings up to date without touching its rows.
+    """
+    conn = sqlite3.connect(database)  # This creates the database file if it doesn't exist
+    try:
+        apply_storage_profile(conn, profile)
+        run_transaction(conn, TABLES)
+        return migrate(conn, report)
+    finally:
+        conn.close()
+
+
+def initialize_database(database=DATABASE):
+    """
+    Startup check: create or update the schema and apply the storage profile. Opens and closes its own
+    connection, so it can run in a server's master process before workers are forked.
+    """
+    return create_database_and_tables(database)
+
+
+def print_migration(number, migration, seconds):
+    print(f"migration {number} ({migration.description}): {seconds:.3f} s")
 
 
-def populate_database_with_sample_data():
-    conn = sqlite3.connect('sportsbook.db')
+def populate_database_with_sample_data(database=DATABASE):
+    conn = sqlite3.connect(database)
     c = conn.cursor()
 
     # Insert sample data into Sports table
@@ -88,6 +267,21 @@ def populate_database_with_sample_data():
 
 
 if __name__ == "__main__":
-    create_database_and_tables()
-    populate_database_with_sample_data()
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        # Bring a database up to date without recreating it, timing each migration applied:
+        # python set_up_database.py migrate [database]
+        path = sys.argv[2] if len(sys.argv) > 2 else DATABASE
+        connection = sqlite3.connect(path)
+        print(f"{path} is at schema version {schema_version(connection)} of {len(MIGRATIONS)}")
+        connection.close()
+        start = time.perf_counter()
+        version = create_database_and_tables(path, report=print_migration)
+        print(f"{path} is at schema version {version} ({time.perf_counter() - start:.3f} s)")
+    else:
+        create_database_and_tables()
+        connection = sqlite3.connect(DATABASE)
+        empty = connection.execute("SELECT COUNT(*) FROM Sports").fetchone()[0] == 0
+        connection.close()
+        if empty:
+            populate_database_with_sample_data()
 
@@ -0,0 +1,409 @@
+import asyncio
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import async_rest_application
+import rest_application
+import set_up_database
+from set_up_database import create_database_and_tables
+
+
+class ApiContract:
+    """
+    End-to-end checks run against a real database through both the sync (Flask) and the async (Quart)
+    application, so the two variants cannot drift apart. Subclasses provide close_pool() and call().
+    """
+
+    module = None
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'test.db')
+        create_database_and_tables(path)
+        rest_application.response_cache.clear()
+        self.pool = self.module.pool
+        self.app = self.module.create_app({'DATABASE': path, 'POOL_SIZE': 2})
+        self.client = self.app.test_client()
+
+    async def asyncTearDown(self):
+        await self.close_pool()
+        self.module.pool = self.pool
+        rest_application.response_cache.clear()
+        shutil.rmtree(self.directory)
+
+    async def create_event_with_selections(self):
+        self.assertEqual((await self.call('POST', '/sports', {'name': 'Football', 'slug': 'football',
+                                                              'active': True}))[0], 201)
+        event = {'name': 'Final', 'slug': 'final', 'active': True, 'type': 'preplay', 'sport_id': 1,
+                 'status': 'Pending', 'scheduled_start': '2023-07-10 20:00:00', 'actual_start': '2023-07-10 20:00:00'}
+        self.assertEqual((await self.call('POST', '/events', event))[0], 201)
+        selections = [{'name': name, 'event_id': 1, 'price': 2.5, 'active': True, 'outcome': 'Unsettled'}
+                      for name in ('Home', 'Draw', 'Away')]
+        status, body, headers = await self.call('POST', '/selections', selections)
+        self.assertEqual((status, body), (201, {'status': 'success', 'created': 3}))
+
+    async def test_create_and_search(self):
+        await self.create_event_with_selections()
+
+        status, body, headers = await self.call('GET', '/sports?active=true')
+        self.assertEqual((status, body), (200, {'sports': [[1, 'Football', 'football', 1]]}))
+        status, body, headers = await self.call('GET', '/events/1/selections')
+        self.assertEqual([row[1] for row in body['selections']], ['Home', 'Draw', 'Away'])
+        status, body, headers = await self.call('GET', '/sports/1/events')
+        self.assertEqual(body['events'][0][1], 'Final')
+        status, body, headers = await self.call('GET', '/selections?event_id=1&name=Draw')
+        self.assertEqual(body['selections'][0][0], 2)
+
+    async def test_invalid_requests(self):
+        status, body, headers = await self.call('GET', '/events?colour=red')
+        self.assertEqual((status, body), (400, {'error': 'Invalid filter: colour'}))
+        status, body, headers = await self.call('POST', '/sports', [{'name': 'Tennis', 'slug': 'tennis',
+                                                                      'active': True}, {'name': 'Golf'}])
+        self.assertEqual(status, 400)
+        self.assertEqual(body['errors'][0]['index'], 1)
+        status, body, headers = await self.call('PATCH', '/selections/prices', [[1, 'high']])
+        self.assertEqual(status, 400)
+        status, body, headers = await self.call('GET', '/selections?price__=2.5')
+        self.assertEqual(status, 400)
+        status, body, headers = await self.call('GET', '/events?active__in=yes')
+        self.assertEqual((status, body), (400, {'error': 'Invalid active value, must be true or false.'}))
+        for path in ('/sports', '/events', '/selections'):
+            for query in ('limit=0', 'limit=%C2%B2', 'after_id=-1'):
+                status, body, headers = await self.call('GET', f'{path}?{query}', raw=True)
+                self.assertEqual(status, 400, (path, query))
+
+    async def test_active_list_filter(self):
+        await self.create_event_with_selections()
+        status, body, headers = await self.call('GET', '/events?active__in=true&fields=id')
+        self.assertEqual((status, body), (200, {'events': [{'id': 1}]}))
+        status, body, headers = await self.call('GET', '/selections?active__in=false,TRUE&fields=id')
+        self.assertEqual(body['selections'], [{'id': 1}, {'id': 2}, {'id': 3}])
+        status, body, headers = await self.call('GET', '/events?active__in=false')
+        self.assertEqual(status, 404)
+
+    async def test_cascade_and_cached_reads_see_writes(self):
+        await self.create_event_with_selections()
+        status, body, headers = await self.call('GET', '/events?active=true')
+        self.assertEqual(len(body['events']), 1)
+
+        status, body, headers = await self.call('PUT', '/selections/1', {'name': 'Home', 'event_id': 1, 'price': 3.0,
+                                                                         'active': False, 'outcome': 'Lose'})
+        self.assertEqual(status, 200)
+        status, body, headers = await self.call('PATCH', '/selections/prices', [[2, 4.0, False], [3, 5.0, False]])
+        self.assertEqual(body, {'message': 'Prices updated successfully', 'updated': 2})
+
+        status, body, headers = await self.call('GET', '/events?active=true')
+        self.assertEqual(status, 404)
+        status, body, headers = await self.call('GET', '/events/1/selections')
+        self.assertEqual([(row[3], row[4]) for row in body['selections']], [(3.0, 0), (4.0, 0), (5.0, 0)])
+
+    async def test_paging_and_streaming(self):
+        await self.create_event_with_selections()
+
+        status, body, headers = await self.call('GET', '/selections?limit=2')
+        self.assertEqual([row[0] for row in body['selections']], [1, 2])
+        status, body, headers = await self.call('GET', f"/selections?limit=2&after_id={body['next_after_id']}")
+        self.assertEqual(([row[0] for row in body['selections']], body['next_after_id']), ([3], None))
+
+        status, text, headers = await self.call('GET', '/selections?stream=ndjson', raw=True)
+        self.assertEqual([json.loads(line)[0] for line in text.splitlines()], [1, 2, 3])
+        status, body, headers = await self.call('GET', '/events?stream=json')
+        self.assertEqual([row[0] for row in body['events']], [1])
+
+    async def test_fields_projection(self):
+        await self.create_event_with_selections()
+
+        status, body, headers = await self.call('GET', '/selections?event_id=1&fields=name,price')
+        self.assertEqual(body['selections'], [{'name': 'Home', 'price': 2.5}, {'name': 'Draw', 'price': 2.5},
+                                              {'name': 'Away', 'price': 2.5}])
+        status, body, headers = await self.call('GET', '/sports?fields=*')
+        self.assertEqual(body['sports'], [{'id': 1, 'name': 'Football', 'slug': 'football', 'active': 1}])
+        # Paging needs the id for its cursor, so it is always included
+        status, body, headers = await self.call('GET', '/events?fields=name&limit=1')
+        self.assertEqual(body, {'events': [{'id': 1, 'name': 'Final'}], 'next_after_id': 1})
+        status, text, headers = await self.call('GET', '/selections?fields=id&stream=ndjson', raw=True)
+        self.assertEqual([json.loads(line) for line in text.splitlines()], [{'id': 1}, {'id': 2}, {'id': 3}])
+
+        status, body, headers = await self.call('GET', '/selections?fields=id,colour')
+        self.assertEqual(status, 400)
+        self.assertIn('Invalid fields: colour', body['error'])
+
+    async def test_operator_filters(self):
+        await self.create_event_with_selections()
+        await self.call('PATCH', '/selections/prices', [[1, 1.5], [2, 3.0], [3, 4.5]])
+
+        status, body, headers = await self.call('GET', '/selections?price__gte=1.5&price__lt=4&fields=id')
+        self.assertEqual(body['selections'], [{'id': 1}, {'id': 2}])
+        status, body, headers = await self.call('GET', '/selections?name__in=Home,Away&fields=name')
+        self.assertEqual(body['selections'], [{'name': 'Home'}, {'name': 'Away'}])
+        status, body, headers = await self.call('GET', '/events?status__in=Pending,Started'
+                                                       '&scheduled_start__lt=2023-07-11&fields=id')
+        self.assertEqual(body['events'], [{'id': 1}])
+
+        status, body, headers = await self.call('GET', '/events?status__like=Pend')
+        self.assertEqual((status, body), (400, {'error': 'Invalid filter: status__like'}))
+        status, body, headers = await self.call('GET', '/selections?colour__in=red')
+        self.assertEqual(status, 400)
+
+    async def test_reordered_filters_share_a_query_shape(self):
+        await self.create_event_with_selections()
+        await self.call('GET', '/selections?event_id=1&name=Home')
+        status, before, headers = await self.call('GET', '/stats')
+
+        await self.call('GET', '/selections?name=Draw&event_id=1')
+        status, after, headers = await self.call('GET', '/stats')
+        self.assertEqual(after['query_shapes']['hits'] - before['query_shapes']['hits'], 1)
+        self.assertEqual(after['pool']['cached_statements'], self.module.STATEMENT_CACHE_SIZE)
+
+    async def test_event_cards_embed_selections(self):
+        await self.create_event_with_selections()
+
+        status, body, headers = await self.call('GET', '/events?include=selections&fields=id,name')
+        self.assertEqual(status, 200)
+        card = body['events'][0]
+        self.assertEqual((card['id'], card['name']), (1, 'Final'))
+        self.assertEqual([(row['name'], row['price']) for row in card['selections']],
+                         [('Home', 2.5), ('Draw', 2.5), ('Away', 2.5)])
+        status, text, headers = await self.call('GET', '/events?include=selections&stream=ndjson', raw=True)
+        self.assertEqual([len(json.loads(line)['selections']) for line in text.splitlines()], [3])
+        status, body, headers = await self.call('GET', '/events?include=selections&limit=1')
+        self.assertEqual((len(body['events']), body['next_after_id']), (1, 1))
+
+        # A cached card must not outlive a write to one of its selections, nor share the plain /events entry
+        etag = headers['ETag']
+        await self.call('PATCH', '/selections/prices', [[1, 9.0]])
+        status, body, headers = await self.call('GET', '/events?include=selections&limit=1',
+                                                headers={'If-None-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertEqual(body['events'][0]['selections'][0]['price'], 9.0)
+        status, body, headers = await self.call('GET', '/events?limit=1')
+        self.assertEqual(body['events'][0][0], 1)
+
+        status, body, headers = await self.call('GET', '/events?include=markets')
+        self.assertEqual((status, body), (400, {'error': 'Invalid include value, must be selections.'}))
+
+    async def test_active_count_filters(self):
+        await self.create_event_with_selections()
+
+        status, body, headers = await self.call('GET', '/sports?min_active_events=1')
+        self.assertEqual((status, body), (200, {'sports': [[1, 'Football', 'football', 1]]}))
+        status, body, headers = await self.call('GET', '/events?min_active_selections=3&fields=id')
+        self.assertEqual(body['events'], [{'id': 1}])
+        etag = headers['ETag']
+
+        # Switching off a selection changes the count, the cached result and the ETag
+        await self.call('PATCH', '/selections/prices', [[1, 2.5, False]])
+        status, body, headers = await self.call('GET', '/events?min_active_selections=3&fields=id',
+                                                headers={'If-None-Match': etag})
+        self.assertEqual(status, 404)
+        status, body, headers = await self.call('GET', '/events?min_active_selections=2&fields=id')
+        self.assertEqual(body['events'], [{'id': 1}])
+
+        for path in ('/sports?min_active_events=-1', '/events?min_active_selections=many',
+                     '/events?min_active_selections__gt=1'):
+            status, body, headers = await self.call('GET', path)
+            self.assertEqual(status, 400, path)
+
+    async def test_time_window(self):
+        await self.create_event_with_selections()
+        event = {'name': 'Replay', 'slug': 'replay', 'active': True, 'type': 'preplay', 'sport_id': 1,
+                 'status': 'Pending', 'scheduled_start': '2023-07-10T21:30:00Z', 'actual_start': '2023-07-10T21:30:00Z'}
+        await self.call('POST', '/events', event)
+
+        # Two hours from 21:00 in London (BST, UTC+1) is 20:00-22:00 UTC
+        status, body, headers = await self.call('GET', '/events?from=2023-07-10T21:00:00&to=2023-07-10T23:00:00'
+                                                       '&tz=Europe/London&fields=id')
+        self.assertEqual(sorted(row['id'] for row in body['events']), [1, 2])
+        status, body, headers = await self.call('GET', '/events?from=2023-07-10T20:30:00Z&fields=id')
+        self.assertEqual(body['events'], [{'id': 2}])
+
+        for path in ('/events?from=soon', '/events?from=2023-07-10T20:00:00&tz=Mars/Olympus'):
+            status, body, headers = await self.call('GET', path)
+            self.assertEqual(status, 400, path)
+            self.assertIn('Invalid from value', body['error'])
+
+    async def test_bulk_import_in_timezone(self):
+        await self.call('POST', '/sports', {'name': 'Football', 'slug': 'football', 'active': True})
+        events = [{'name': f'Event {number}', 'slug': f'event-{number}', 'active': True, 'type': 'preplay',
+                   'sport_id': 1, 'status': 'Pending', 'scheduled_start': start, 'actual_start': start}
+                  for number, start in enumerate(('2023-07-10 20:00:00', '2023-12-10 20:00:00'))]
+        status, body, headers = await self.call('POST', '/events?tz=Europe/London', events)
+        self.assertEqual(status, 201)
+        status, body, headers = await self.call('GET', '/events?fields=scheduled_start,actual_start')
+        self.assertEqual(body['events'],
+                         [{'scheduled_start': '2023-07-10 19:00:00', 'actual_start': '2023-07-10 19:00:00'},
+                          {'scheduled_start': '2023-12-10 20:00:00', 'actual_start': '2023-12-10 20:00:00'}])
+
+        status, text, headers = await self.call('POST', '/events?tz=Mars/Olympus', events, raw=True)
+        self.assertEqual(status, 400)
+        self.assertIn('Unknown timezone: Mars/Olympus', text)
+        events = [dict(events[0], slug='late', scheduled_start='2023-07-10T20:00:00Z')]
+        status, body, headers = await self.call('POST', '/events?tz=Europe/London', events)
+        self.assertEqual((status, body['errors'][0]['index']), (400, 0))
+
+    async def test_conditional_get(self):
+        await self.create_event_with_selections()
+        status, body, headers = await self.call('GET', '/events/1/selections')
+        etag = headers['ETag']
+
+        status, body, headers = await self.call('GET', '/events/1/selections', headers={'If-None-Match': etag})
+        self.assertEqual(status, 304)
+        await self.call('PATCH', '/selections/prices', [[1, 9.0]])
+        status, body, headers = await self.call('GET', '/events/1/selections', headers={'If-None-Match': etag})
+        self.assertEqual(status, 200)
+
+    async def test_writes_through_write_queue(self):
+        self.app = self.module.create_app({'DATABASE': self.app.config['DATABASE'], 'POOL_SIZE': 2,
+                                           'WRITE_QUEUE_ENABLED': True})
+        self.client = self.app.test_client()
+        try:
+            await self.create_event_with_selections()
+            status, body, headers = await self.call('PATCH', '/selections/prices', [[1, 3.0, False], [2, 4.0, False],
+                                                                                    [3, 5.0, False]])
+            self.assertEqual(body['updated'], 3)
+            status, body, headers = await self.call('GET', '/events?active=true')
+            self.assertEqual(status, 404)
+            status, text, headers = await self.call('POST', '/sports', {'name': 'Football', 'slug': 'football',
+                                                                       'active': True}, raw=True)
+            self.assertEqual(status, 500)
+            self.assertIn('UNIQUE constraint failed', text)
+
+            status, body, headers = await self.call('GET', '/stats')
+            self.assertEqual(body['write_queue']['writes'], 5)
+            self.assertEqual(body['write_queue']['failed'], 1)
+        finally:
+            self.module.write_queue.close()
+            self.module.write_queue = None
+
+    async def test_active_searches_from_hot_tier(self):
+        self.app = self.module.create_app({'DATABASE': self.app.config['DATABASE'], 'POOL_SIZE': 2,
+                                           'HOT_TIER_ENABLED': True})
+        self.client = self.app.test_client()
+        loads = []
+        load = self.module.hot_tier.load
+        self.module.hot_tier.load = lambda: (loads.append(threading.get_ident()), load())[1]
+        try:
+            await self.create_event_with_selections()
+            status, body, headers = await self.call('GET', '/selections?active=true&event_id=1&fields=id,price')
+            self.assertEqual(body['selections'], [{'id': 1, 'price': 2.5}, {'id': 2, 'price': 2.5},
+                                                  {'id': 3, 'price': 2.5}])
+            await self.call('PATCH', '/selections/prices', [[2, 4.0, False]])
+            status, body, headers = await self.call('GET', '/selections?active=true&limit=1&after_id=1')
+            self.assertEqual(body, {'selections': [[3, 'Away', 1, 2.5, 1, 'Unsettled']], 'next_after_id': 3})
+            status, body, headers = await self.call('GET', '/events?active=true&sport_id=1')
+            self.assertEqual(body['events'][0][:2], [1, 'Final'])
+            status, body, headers = await self.call('GET', '/sports?active=true&min_active_events=2')
+            self.assertEqual(status, 200)
+
+            status, body, headers = await self.call('GET', '/stats')
+            self.assertEqual(body['hot_tier']['hits'], 3)
+            self.assertEqual(body['hot_tier']['fallbacks'], 1)
+            self.assertEqual(len(loads), 1)
+            if self.module is async_rest_application:
+                # Loading reads every active row, so it must not block the event loop
+                self.assertNotEqual(loads[0], threading.get_ident())
+        finally:
+            self.module.hot_tier.close()
+            self.module.hot_tier = None
+
+    async def test_schema_is_migrated_on_startup(self):
+        # A database with only the base tables, as set up before any migration existed
+        path = os.path.join(self.directory, 'old.db')
+        conn = sqlite3.connect(path)
+        for statement in set_up_database.TABLES:
+            conn.execute(statement)
+        conn.close()
+        self.app = self.module.create_app({'DATABASE': path, 'POOL_SIZE': 2})
+        self.client = self.app.test_client()
+        await self.start()
+
+        await self.create_event_with_selections()
+        status, body, headers = await self.call('GET', '/sports?min_active_events=1')
+        self.assertEqual((status, body['sports'][0][:2]), (200, [1, 'Football']))
+        status, body, headers = await self.call('GET', '/events?min_active_selections=1')
+        self.assertEqual((status, body['events'][0][:2]), (200, [1, 'Final']))
+        conn = sqlite3.connect(path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(set_up_database.MIGRATIONS))
+        conn.close()
+
+    async def test_create_app_closes_the_pool_it_replaces(self):
+        await self.create_event_with_selections()
+        replaced = self.module.pool
+        self.assertGreater(replaced.stats()['open'], 0)
+        self.app = self.module.create_app({'DATABASE': self.app.config['DATABASE'], 'POOL_SIZE': 2})
+        self.client = self.app.test_client()
+        # The async app closes it in a task on the running loop
+        for _ in range(100):
+            if not replaced.stats()['open']:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(replaced.stats()['open'], 0)
+        self.assertEqual((await self.call('GET', '/sports'))[0], 200)
+
+    async def test_connections_return_to_pool(self):
+        await self.create_event_with_selections()
+        for path in ('/sports', '/events/1/selections', '/selections?stream=ndjson'):
+            await self.call('GET', path, raw=True)
+        status, body, headers = await self.call('GET', '/stats')
+        self.assertEqual(body['pool']['max_size'], 2)
+        self.assertEqual(body['pool']['in_use'], 0)
+
+
+class TestSyncApi(ApiContract, unittest.IsolatedAsyncioTestCase):
+    module = rest_application
+
+    async def start(self):
+        pass  # Flask has no startup hook; ensure_schema runs before the first request
+
+    async def close_pool(self):
+        self.module.pool.close_all()
+
+    async def call(self, method, path, data=None, headers=None, raw=False):
+        response = self.client.open(path, method=method, json=data, headers=headers)
+        text = response.get_data(as_text=True)
+        return response.status_code, text if raw or not text else json.loads(text), response.headers
+
+
+class TestAsyncApi(ApiContract, unittest.IsolatedAsyncioTestCase):
+    module = async_rest_application
+
+    async def start(self):
+        await self.app.startup()  # the before_serving functions; a test client does not run them
+
+    async def close_pool(self):
+        # Tests that start the app do not shut it down, which would close the shared broadcaster
+        self.module.restore_signal_handlers()
+        await self.module.pool.close_all()
+
+    async def test_signal_ends_streams(self):
+        signals = []
+        handle_exit = signal.signal(signal.SIGTERM, lambda signum, frame: signals.append(signum))
+        try:
+            await self.start()
+            subscription = rest_application.broadcaster.subscribe(1)
+            waiting = asyncio.create_task(subscription.wait_async(timeout=5))
+            await asyncio.sleep(0)
+            signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+            # The stream ends at once instead of waiting for its next message, and the server still exits
+            self.assertIsNone(await asyncio.wait_for(waiting, timeout=1))
+            self.assertEqual(signals, [signal.SIGTERM])
+            subscription.close()
+        finally:
+            rest_application.broadcaster.closed = False
+            self.module.restore_signal_handlers()
+            signal.signal(signal.SIGTERM, handle_exit)
+
+    async def call(self, method, path, data=None, headers=None, raw=False):
+        response = await self.client.open(path, method=method, json=data, headers=headers)
+        text = await response.get_data(as_text=True)
+        return response.status_code, text if raw or not text else json.loads(text), response.headers
+
+
+if __name__ == '__main__':
+    unittest.main()
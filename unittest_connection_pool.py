@@ -0,0 +1,211 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from async_connection_pool import AsyncConnectionPool
+from connection_pool import ConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.pool = ConnectionPool(self.path, max_size=2, timeout=0.5, pragmas={'cache_size': -4000})
+
+    def tearDown(self):
+        self.pool.close_all()
+        os.remove(self.path)
+
+    def test_connection_is_reused(self):
+        conn = self.pool.acquire()
+        raw = conn._conn
+        conn.close()
+        conn = self.pool.acquire()
+        self.assertIs(conn._conn, raw)
+        conn.close()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 1)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_pragmas_applied_once_per_connection(self):
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -4000)
+        conn.execute("PRAGMA cache_size = -2000")
+        conn.close()
+
+        # A reused connection keeps whatever state it had, so PRAGMAs were not re-run on checkout
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -2000)
+        conn.close()
+
+    def test_close_is_idempotent_and_blocks_further_use(self):
+        conn = self.pool.acquire()
+        conn.close()
+        conn.close()
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.cursor()
+
+    def test_uncommitted_work_is_rolled_back_on_release(self):
+        conn = self.pool.acquire()
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+        conn.close()
+
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+        conn.close()
+
+    def test_broken_connection_is_replaced(self):
+        conn = self.pool.acquire()
+        raw = conn._conn
+        conn.close()
+        raw.close()
+
+        conn = self.pool.acquire()
+        self.assertIsNot(conn._conn, raw)
+        self.assertEqual(conn.execute("SELECT 1").fetchone()[0], 1)
+        conn.close()
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+    def test_pool_is_bounded(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        released = []
+
+        def release_later():
+            released.append(True)
+            first.close()
+
+        timer = threading.Timer(0.05, release_later)
+        timer.start()
+        third = self.pool.acquire()
+        timer.join()
+
+        self.assertTrue(released)
+        self.assertEqual(self.pool.stats()['open'], 2)
+        self.assertEqual(self.pool.stats()['waits'], 1)
+        second.close()
+        third.close()
+
+    def test_discarded_connection_frees_a_slot_for_waiters(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+
+        def break_and_release():
+            # A connection that cannot be rolled back on release is discarded instead of returned
+            first._conn.close()
+            first.close()
+
+        timer = threading.Timer(0.05, break_and_release)
+        timer.start()
+        third = self.pool.acquire()
+        timer.join()
+
+        self.assertEqual(third.execute("SELECT 1").fetchone()[0], 1)
+        stats = self.pool.stats()
+        self.assertEqual((stats['open'], stats['created'], stats['discarded']), (2, 3, 1))
+        second.close()
+        third.close()
+
+    def test_acquire_times_out_when_exhausted(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        with self.assertRaises(queue.Empty):
+            self.pool.acquire()
+        first.close()
+        second.close()
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_pool_starts_over_after_fork(self):
+        conn = self.pool.acquire()
+        conn.close()
+
+        # Pretend the pool was inherited by a child process
+        self.pool._pid = -1
+        conn = self.pool.acquire()
+        self.assertEqual(self.pool.stats()['created'], 1)
+        self.assertEqual(self.pool.stats()['reused'], 0)
+        conn.close()
+
+
+class TestAsyncConnectionPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.pool = AsyncConnectionPool(self.path, max_size=2, timeout=0.5, pragmas={'cache_size': -4000})
+
+    async def asyncTearDown(self):
+        await self.pool.close_all()
+        os.remove(self.path)
+
+    async def test_connection_is_reused_and_rolled_back(self):
+        conn = await self.pool.acquire()
+        raw = conn._conn
+        self.assertEqual(await (await conn.execute("PRAGMA cache_size")).fetchone(), (-4000,))
+        await conn.execute("CREATE TABLE t (x INTEGER)")
+        await conn.commit()
+        await conn.execute("INSERT INTO t VALUES (1)")
+        await conn.close()
+        await conn.close()
+
+        conn = await self.pool.acquire()
+        self.assertIs(conn._conn, raw)
+        self.assertEqual(await (await conn.execute("SELECT COUNT(*) FROM t")).fetchone(), (0,))
+        await conn.close()
+        self.assertEqual((self.pool.stats()['created'], self.pool.stats()['reused']), (1, 1))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.cursor()
+
+    async def test_waiters_are_handed_released_connections(self):
+        first = await self.pool.acquire()
+        second = await self.pool.acquire()
+        waiting = [asyncio.ensure_future(self.pool.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        await first.close()
+        await second.close()
+        third, fourth = await asyncio.gather(*waiting)
+
+        self.assertEqual(self.pool.stats()['open'], 2)
+        self.assertEqual(self.pool.stats()['waits'], 2)
+        await third.close()
+        await fourth.close()
+        self.assertEqual(self.pool.stats()['idle'], 2)
+
+    async def test_discarded_connection_frees_a_slot_for_waiters(self):
+        first = await self.pool.acquire()
+        second = await self.pool.acquire()
+        waiting = asyncio.ensure_future(self.pool.acquire())
+        await asyncio.sleep(0)
+        # A connection that cannot be rolled back on release is discarded instead of returned
+        await first._conn.close()
+        await first.close()
+        third = await waiting
+
+        self.assertEqual(await (await third.execute("SELECT 1")).fetchone(), (1,))
+        stats = self.pool.stats()
+        self.assertEqual((stats['open'], stats['created'], stats['discarded']), (2, 3, 1))
+        await second.close()
+        await third.close()
+
+    async def test_acquire_times_out_when_exhausted(self):
+        first = await self.pool.acquire()
+        second = await self.pool.acquire()
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.pool.acquire()
+        await first.close()
+        await second.close()
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import unittest
+
+from event_stream import Broadcaster
+
+
+class TestBroadcaster(unittest.TestCase):
+    def setUp(self):
+        self.broadcaster = Broadcaster(history=3)
+
+    def test_every_subscriber_gets_every_message(self):
+        first = self.broadcaster.subscribe(1)
+        second = self.broadcaster.subscribe(1)
+        other = self.broadcaster.subscribe(2)
+
+        self.broadcaster.publish(1, 'a')
+        self.broadcaster.publish(1, 'b')
+
+        self.assertEqual(first.wait(0), ['a', 'b'])
+        self.assertEqual(second.wait(0), ['a', 'b'])
+        self.assertEqual(first.wait(0), [])
+        self.assertEqual(other.wait(0), [])
+
+    def test_messages_before_subscribing_are_not_replayed(self):
+        early = self.broadcaster.subscribe(1)
+        self.broadcaster.publish(1, 'a')
+        late = self.broadcaster.subscribe(1)
+        self.broadcaster.publish(1, 'b')
+        self.assertEqual(early.wait(0), ['a', 'b'])
+        self.assertEqual(late.wait(0), ['b'])
+
+    def test_subscriber_that_falls_behind_is_reset(self):
+        subscription = self.broadcaster.subscribe(1)
+        for message in 'abcd':
+            self.broadcaster.publish(1, message)
+        self.assertEqual(subscription.wait(0), [Broadcaster.RESET])
+        self.broadcaster.publish(1, 'e')
+        self.assertEqual(subscription.wait(0), ['e'])
+
+    def test_wait_blocks_until_published(self):
+        subscription = self.broadcaster.subscribe(1)
+        timer = threading.Timer(0.05, self.broadcaster.publish, (1, 'a'))
+        timer.start()
+        self.assertEqual(subscription.wait(5), ['a'])
+        timer.join()
+
+    def test_channel_removed_with_last_subscriber(self):
+        first = self.broadcaster.subscribe(1)
+        second = self.broadcaster.subscribe(1)
+        first.close()
+        first.close()
+        self.assertTrue(self.broadcaster.has_subscribers(1))
+        second.close()
+        self.assertFalse(self.broadcaster.has_subscribers(1))
+        self.broadcaster.publish(1, 'nobody listening')
+        self.assertEqual(self.broadcaster.stats(), {'channels': 0, 'subscribers': 0, 'published': 0})
+
+    def test_close_releases_waiting_subscribers(self):
+        subscription = self.broadcaster.subscribe(1)
+        timer = threading.Timer(0.05, self.broadcaster.close)
+        timer.start()
+        self.assertIsNone(subscription.wait(5))
+        timer.join()
+
+
+class TestBroadcasterAsync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.broadcaster = Broadcaster(history=3)
+
+    async def test_wait_async_returns_published_messages(self):
+        first = self.broadcaster.subscribe(1)
+        second = self.broadcaster.subscribe(1)
+        waiting = [asyncio.ensure_future(first.wait_async(5)), asyncio.ensure_future(second.wait_async(5))]
+        await asyncio.sleep(0)
+        self.broadcaster.publish(1, 'a')
+        self.assertEqual(await asyncio.gather(*waiting), [['a'], ['a']])
+        self.assertEqual(await first.wait_async(0), [])
+
+    async def test_wait_async_from_another_thread(self):
+        subscription = self.broadcaster.subscribe(1)
+        timer = threading.Timer(0.05, self.broadcaster.publish, (1, 'a'))
+        timer.start()
+        self.assertEqual(await subscription.wait_async(5), ['a'])
+        timer.join()
+
+    async def test_close_releases_async_subscribers(self):
+        subscription = self.broadcaster.subscribe(1)
+        waiting = asyncio.ensure_future(subscription.wait_async(5))
+        await asyncio.sleep(0)
+        self.broadcaster.close()
+        self.assertIsNone(await waiting)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import model
+from hot_tier import MAX_AGE_TTLS, HotTier
+from set_up_database import create_database_and_tables
+
+
+class TestHotTier(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.db')
+        create_database_and_tables(self.path)
+        self.conn = sqlite3.connect(self.path)
+        model.create_sport_many(self.conn, [('Football', 'football', True), ('Tennis', 'tennis', True),
+                                            ('Golf', 'golf', False)])
+        model.create_event_many(self.conn, [
+            (f'Event {i}', f'event-{i}', i % 3 != 0, 'preplay' if i % 2 else 'inplay', i % 2 + 1, 'Pending',
+             '2023-07-10 20:00:00', None) for i in range(12)])
+        model.create_selection_many(self.conn, [
+            (f'Selection {i}', i // 3 + 1, 1.5 + i % 4, i % 5 != 0, 'Unsettled') for i in range(36)])
+        self.tier = HotTier(self.path)
+
+    def tearDown(self):
+        self.tier.close()
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def assertSameAsSQLite(self, table, filters, **kwargs):
+        rows = self.tier.search(table, filters, **kwargs)
+        self.assertIsNotNone(rows, filters)
+        expected = model.search_table(self.conn, table, filters, **kwargs)
+        if 'limit' not in kwargs and 'after_id' not in kwargs:
+            expected = sorted(expected, key=lambda row: row['id'] if isinstance(row, dict) else row[0])
+        self.assertEqual(rows, expected, (table, filters, kwargs))
+
+    def test_searches_match_sqlite(self):
+        searches = [
+            ('Sports', {'active': 1}, {}),
+            ('Sports', {'active': 1, 'name': 'Tennis'}, {}),
+            ('Events', {'active': 1}, {}),
+            ('Events', {'active': 1, 'sport_id': '2'}, {}),
+            ('Events', {'active': 1, 'sport_id': '2', 'type': 'preplay'}, {'fields': ('id', 'name')}),
+            ('Events', {'active': 1, 'sport_id__in': ('1', '2'), 'status': 'Pending'}, {'limit': 3, 'after_id': 4}),
+            ('Events', {'active': 1, 'type': 'nothing'}, {}),
+            ('Selections', {'active': 1}, {'limit': 5}),
+            ('Selections', {'active': 1, 'event_id': '4'}, {}),
+            ('Selections', {'active': 1, 'event_id__in': ('2', '3', '99')}, {'fields': ('price', 'id')}),
+            ('Selections', {'active': 1, 'price': '2.5'}, {'after_id': 10}),
+            ('Selections', {'active': 1, 'price': '3', 'name__in': ('Selection 6', 'Selection 7')}, {}),
+            ('Selections', {'active': 1}, {'limit': 0}),
+        ]
+        for table, filters, kwargs in searches:
+            with self.subTest(table=table, filters=filters, kwargs=kwargs):
+                self.assertSameAsSQLite(table, filters, **kwargs)
+        self.assertEqual(self.tier.stats()['rows'], {'Sports': 2, 'Events': 8, 'Selections': 28})
+
+    def test_other_searches_are_left_to_sqlite(self):
+        for table, filters in (('Sports', {}), ('Sports', {'active': 0}), ('Sports', {'active': '1'}),
+                               ('Selections', {'active': 1, 'price__gte': '2'}),
+                               ('Selections', {'active': 1, 'price': '2e0'}),
+                               ('Events', {'active': 1, 'sport_id': ' 1'}),
+                               ('Events', {'active': 1, 'from': 1688000000}),
+                               ('Events', {'active': 1, 'min_active_selections': 2})):
+            self.assertIsNone(self.tier.search(table, filters), filters)
+        self.assertEqual(self.tier.stats()['fallbacks'], 8)
+        self.assertFalse(self.tier.stats()['loaded'])
+
+    def test_writes_are_followed(self):
+        self.tier.load()
+
+        model.create_event(self.conn, 'New', 'new', True, 'preplay', 1, 'Pending', '2023-07-11 20:00:00', None)
+        model.create_selection(self.conn, 'Late', 13, 4.0, True, 'Unsettled')
+        model.update_selection(self.conn, 2, {'name': 'Renamed', 'event_id': 1, 'price': 9.0, 'active': True,
+                                              'outcome': 'Unsettled'})
+        # Event 2's selections all go inactive, so the cascade deactivates event 2 as well
+        model.update_selection_prices(self.conn, [(4, 2.0, False), (5, 2.0, False), (6, 2.0, False)])
+        model.update_sport(self.conn, 3, 'Golf', 'golf', True)
+        model.delete_selection(self.conn, 8)
+
+        for table, filters in (('Sports', {'active': 1}), ('Events', {'active': 1}),
+                               ('Events', {'active': 1, 'sport_id': '1'}), ('Selections', {'active': 1}),
+                               ('Selections', {'active': 1, 'event_id': '1'})):
+            self.assertSameAsSQLite(table, filters)
+        self.assertEqual(self.tier.search('Selections', {'active': 1, 'event_id': '13'})[0][1], 'Late')
+
+        # A selection coming back to life lands between the ids already held and is still paged in order
+        model.update_selection_prices(self.conn, [(1, 3.0, True)])
+        self.assertSameAsSQLite('Selections', {'active': 1}, limit=4)
+        self.assertSameAsSQLite('Selections', {'active': 1}, after_id=2, limit=4)
+        self.assertEqual(self.tier.stats()['reloads'], 1)
+
+    def test_writes_from_other_processes_wait_for_ttl(self):
+        self.tier.load()
+        other = sqlite3.connect(self.path)
+        other.execute("UPDATE Sports SET active = 0 WHERE id = 1")  # not through model.py: nobody is notified
+        other.commit()
+        other.close()
+        self.assertEqual(len(self.tier.search('Sports', {'active': 1})), 2)
+
+        self.tier.ttl = 0
+        self.assertEqual(self.tier.search('Sports', {'active': 1}), [(2, 'Tennis', 'tennis', 1)])
+        self.assertEqual(self.tier.stats()['reloads'], 2)
+        # Nothing changed since, so there is nothing to reload
+        self.tier.search('Sports', {'active': 1})
+        self.assertEqual(self.tier.stats()['reloads'], 2)
+
+    def test_own_writes_do_not_force_reloads(self):
+        self.tier.ttl = 0.05
+        self.tier.load()
+        time.sleep(0.06)
+        for price in (2.0, 2.5, 3.0, 3.5, 4.0):
+            model.update_selection_prices(self.conn, [(2, price, True)])
+            self.assertSameAsSQLite('Selections', {'active': 1, 'event_id': '1'})
+        self.assertFalse(self.tier.stale())
+        self.assertEqual(self.tier.stats()['reloads'], 1)
+
+        # Past MAX_AGE_TTLS the replica is reloaded anyway, in case another process wrote just before us
+        time.sleep(0.05 * MAX_AGE_TTLS)
+        self.assertTrue(self.tier.stale())
+        self.tier.search('Sports', {'active': 1}, reload=False)
+        self.assertEqual(self.tier.stats()['reloads'], 1)
+        self.tier.search('Sports', {'active': 1})
+        self.assertEqual(self.tier.stats()['reloads'], 2)
+
+    def test_close_stops_following_writes(self):
+        self.tier.close()
+        self.assertNotIn(self.tier.on_write, model.write_listeners)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+import tempfile
 import unittest
 import sqlite3
 import model
+import set_up_database
 
 
 def dict_factory(cursor, row):
@@ -216,5 +221,499 @@ class TestSelectionsModel(unittest.TestCase):
         self.assertEqual(selections[1]['name'], 'Raptors Win')
 
 
+class TestBatchInserts(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.row_factory = dict_factory
+        self.conn.execute('''
+            CREATE TABLE Sports(
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                slug TEXT NOT NULL UNIQUE,
+                active BOOLEAN NOT NULL
+            )
+        ''')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_create_sport_many(self):
+        writes = []
+        model.write_listeners.append(lambda table, parent_id, changes: writes.append(changes))
+        try:
+            model.create_sport_many(self.conn, [('Football', 'football', 1), ('Tennis', 'tennis', 0)])
+        finally:
+            model.write_listeners.pop()
+
+        self.assertEqual(writes, [[{'action': 'created', 'id': 1, 'name': 'Football', 'slug': 'football', 'active': 1},
+                                   {'action': 'created', 'id': 2, 'name': 'Tennis', 'slug': 'tennis', 'active': 0}]])
+        self.assertEqual(model.read_sport(self.conn, 2)['slug'], 'tennis')
+        self.assertEqual(len(model.search_sports(self.conn, {})), 2)
+
+    def test_create_sport_many_is_all_or_nothing(self):
+        sports = [('Football', 'football', 1), ('Tennis', 'tennis', 0), ('Soccer', 'football', 1), ('Golf', None, 1)]
+        with self.assertRaises(model.BatchInsertError) as raised:
+            model.create_sport_many(self.conn, sports)
+
+        self.assertEqual([error['index'] for error in raised.exception.errors], [2, 3])
+        self.assertIn('UNIQUE', raised.exception.errors[0]['error'])
+        self.assertEqual(model.search_sports(self.conn, {}), [])
+
+
+class TestPagination(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('''
+            CREATE TABLE Sports(
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                slug TEXT NOT NULL UNIQUE,
+                active BOOLEAN NOT NULL
+            )
+        ''')
+        model.create_sport_many(self.conn, [(f'Sport {i}', f'sport-{i}', i % 2) for i in range(1, 11)])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_search_query_without_paging_is_unchanged(self):
+        self.assertEqual(model.search_query('Sports', {'active': 1}), ("SELECT * FROM Sports WHERE active = ?", (1,)))
+        self.assertEqual(model.search_query('Sports', {}), ("SELECT * FROM Sports", ()))
+
+    def test_keyset_pages(self):
+        first = model.search_sports(self.conn, {'active': 1}, limit=3)
+        self.assertEqual([row[0] for row in first], [1, 3, 5])
+        second = model.search_sports(self.conn, {'active': 1}, limit=3, after_id=first[-1][0])
+        self.assertEqual([row[0] for row in second], [7, 9])
+        self.assertEqual(model.search_sports(self.conn, {}, after_id=9), [(10, 'Sport 10', 'sport-10', 0)])
+
+    def test_stream_in_batches(self):
+        batches = list(model.stream_sports(self.conn, {}, batch_size=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        self.assertEqual([row for batch in batches for row in batch], model.search_sports(self.conn, {}))
+
+    def test_fields_select_only_those_columns_as_objects(self):
+        self.assertEqual(model.search_query('Sports', {'active': 1}, fields=('id', 'name')),
+                         ("SELECT id, name FROM Sports WHERE active = ?", (1,)))
+        self.assertEqual(model.search_sports(self.conn, {'active': 0}, limit=2, fields=('id', 'slug')),
+                         [{'id': 2, 'slug': 'sport-2'}, {'id': 4, 'slug': 'sport-4'}])
+        batches = list(model.stream_sports(self.conn, {}, batch_size=4, fields=model.TABLE_FIELDS['Sports']))
+        self.assertEqual(batches[-1][-1], {'id': 10, 'name': 'Sport 10', 'slug': 'sport-10', 'active': 0})
+        # The connection's own row factory is left alone
+        self.assertEqual(model.search_sports(self.conn, {}, after_id=9), [(10, 'Sport 10', 'sport-10', 0)])
+
+        with self.assertRaises(ValueError):
+            model.search_query('Sports', {}, fields=('id', 'name; DROP TABLE Sports'))
+
+
+class TestStatusCascade(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database = os.path.join(self.directory, 'sportsbook.db')
+        set_up_database.create_database_and_tables(database)
+        self.conn = sqlite3.connect(database)
+        model.create_sport(self.conn, 'Football', 'football', True)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def expected_active(parent_active, children_active):
+        # The original rule: the parent is switched off when none of its children is active
+        return parent_active and any(children_active)
+
+    def test_event_cascade_matches_rule(self):
+        cases = [(parent, children) for parent in (True, False)
+                 for children in ((), (True,), (False,), (True, False), (False, False), (False, True, False))]
+        for number, (parent_active, children_active) in enumerate(cases, start=1):
+            with self.subTest(parent_active=parent_active, children_active=children_active):
+                model.create_event(self.conn, f'Event {number}', f'event-{number}', parent_active, 'preplay', 1,
+                                   'Pending', '2023-07-10 20:00:00', None)
+                for active in children_active:
+                    model.create_selection(self.conn, 'Selection', number, 2.0, active, 'Unsettled')
+
+                model.check_and_update_event_status(self.conn, number)
+
+                self.assertEqual(bool(model.read_event(self.conn, number)[3]),
+                                 self.expected_active(parent_active, children_active))
+
+    def test_sport_cascade_matches_rule(self):
+        cases = [(), (True,), (False,), (False, True), (False, False)]
+        for number, children_active in enumerate(cases, start=2):
+            with self.subTest(children_active=children_active):
+                model.create_sport(self.conn, f'Sport {number}', f'sport-{number}', True)
+                for index, active in enumerate(children_active):
+                    model.create_event(self.conn, 'Event', f'sport-{number}-event-{index}', active, 'preplay', number,
+                                       'Pending', '2023-07-10 20:00:00', None)
+
+                model.check_and_update_sport_status(self.conn, number)
+
+                self.assertEqual(bool(model.read_sport(self.conn, number)[3]),
+                                 self.expected_active(True, children_active))
+
+    def test_update_selection_cascades_to_event(self):
+        model.create_event(self.conn, 'Event', 'event', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', None)
+        model.create_selection(self.conn, 'Home', 1, 2.0, True, 'Unsettled')
+        model.create_selection(self.conn, 'Away', 1, 2.0, True, 'Unsettled')
+
+        data = {'name': 'Home', 'event_id': 1, 'price': 2.0, 'active': False, 'outcome': 'Unsettled'}
+        model.update_selection(self.conn, 1, data)
+        self.assertTrue(model.read_event(self.conn, 1)[3])
+
+        data['name'] = 'Away'
+        model.update_selection(self.conn, 2, data)
+        self.assertFalse(model.read_event(self.conn, 1)[3])
+
+    def test_update_selection_prices(self):
+        for number in (1, 2):
+            model.create_event(self.conn, f'Event {number}', f'event-{number}', True, 'preplay', 1, 'Pending',
+                               '2023-07-10 20:00:00', None)
+        model.create_selection_many(self.conn, [('Home', 1, 2.0, True, 'Unsettled'),
+                                                ('Away', 1, 2.0, True, 'Unsettled'),
+                                                ('Home', 2, 2.0, True, 'Unsettled')])
+
+        statements = []
+        writes = []
+        self.conn.set_trace_callback(statements.append)
+        model.write_listeners.append(lambda table, parent_id, changes: writes.append((table, parent_id, changes)))
+        try:
+            updated = model.update_selection_prices(self.conn, [(1, 1.5, False), (2, 2.5, False), (3, 4.0),
+                                                                (99, 1.1)])
+        finally:
+            self.conn.set_trace_callback(None)
+            model.write_listeners.pop()
+
+        self.assertEqual(updated, 3)
+        self.assertEqual([row[3] for row in model.search_selections(self.conn, {})], [1.5, 2.5, 4.0])
+        self.assertFalse(model.read_event(self.conn, 1)[3])
+        self.assertTrue(model.read_event(self.conn, 2)[3])
+        # One cascade statement per affected event and a single commit for the whole batch. The trace repeats
+        # a statement for every statement its triggers run, hence the set.
+        self.assertEqual(len({statement for statement in statements if statement.startswith('UPDATE Events')}), 2)
+        self.assertEqual(statements.count('COMMIT'), 1)
+        # Listeners hear about each changed row, grouped by event, and about the cascaded event
+        self.assertEqual(writes, [
+            ('Selections', 1, [{'action': 'updated', 'id': 1, 'event_id': 1, 'price': 1.5, 'active': False},
+                               {'action': 'updated', 'id': 2, 'event_id': 1, 'price': 2.5, 'active': False}]),
+            ('Selections', 2, [{'action': 'updated', 'id': 3, 'event_id': 2, 'price': 4.0}]),
+            ('Events', None, [{'action': 'updated', 'id': 1, 'active': False}]),
+        ])
+
+
+class TestActiveCounts(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'sportsbook.db')
+        set_up_database.create_database_and_tables(self.database)
+        self.conn = sqlite3.connect(self.database)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def counters(self):
+        return (self.conn.execute("SELECT * FROM SportActiveCounts ORDER BY sport_id").fetchall(),
+                self.conn.execute("SELECT * FROM EventActiveCounts ORDER BY event_id").fetchall())
+
+    def recounted(self):
+        return (self.conn.execute("SELECT id, (SELECT COUNT(*) FROM Events WHERE sport_id = Sports.id AND active) "
+                                  "FROM Sports ORDER BY id").fetchall(),
+                self.conn.execute("SELECT id, (SELECT COUNT(*) FROM Selections WHERE event_id = Events.id AND active) "
+                                  "FROM Events ORDER BY id").fetchall())
+
+    def test_counters_follow_every_write(self):
+        selection = {'name': 'Home', 'event_id': 1, 'price': 2.0, 'active': False, 'outcome': 'Unsettled'}
+        event = {'name': 'Final', 'active': False, 'type': 'preplay', 'sport_id': 1, 'status': 'Pending',
+                 'scheduled_start': '2023-07-10 20:00:00', 'actual_start': None}
+        writes = [
+            lambda: model.create_sport_many(self.conn, [('Football', 'football', True), ('Tennis', 'tennis', True)]),
+            lambda: model.create_event_many(self.conn, [(f'Event {i}', f'event-{i}', True, 'preplay', 1 + i % 2,
+                                                         'Pending', '2023-07-10 20:00:00', None) for i in range(4)]),
+            lambda: model.create_selection_many(self.conn, [('Home', 1 + i % 3, 2.0, True, 'Unsettled')
+                                                            for i in range(9)]),
+            lambda: model.create_selection(self.conn, 'Draw', 4, 3.0, False, 'Unsettled'),
+            lambda: model.update_selection_prices(self.conn, [(1, 1.5, False), (4, 1.5, False), (7, 1.5, False)]),
+            lambda: model.update_selection(self.conn, 2, selection),
+            lambda: model.update_event(self.conn, 3, event),
+            lambda: model.delete_selection(self.conn, 3),
+            lambda: model.delete_event(self.conn, 2),
+            lambda: model.delete_sport(self.conn, 2),
+        ]
+        for number, write in enumerate(writes):
+            with self.subTest(write=number):
+                write()
+                self.assertEqual(self.counters(), self.recounted())
+
+    def test_count_filters(self):
+        model.create_sport_many(self.conn, [('Football', 'football', True), ('Tennis', 'tennis', True)])
+        model.create_event_many(self.conn, [('Final', 'final', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00',
+                                             None),
+                                            ('Semi', 'semi', True, 'preplay', 1, 'Pending', '2023-07-09 20:00:00',
+                                             None)])
+        model.create_selection_many(self.conn, [('Home', 1, 2.0, True, 'Unsettled'),
+                                                ('Away', 1, 2.0, True, 'Unsettled'),
+                                                ('Home', 2, 2.0, False, 'Unsettled')])
+
+        self.assertEqual([row[0] for row in model.search_sports(self.conn, {'min_active_events': 2})], [1])
+        self.assertEqual([row[0] for row in model.search_sports(self.conn, {'min_active_events': 0})], [1, 2])
+        self.assertEqual(model.search_events(self.conn, {'min_active_selections': 1, 'sport_id': 1},
+                                             fields=('id', 'name')), [{'id': 1, 'name': 'Final'}])
+        self.assertEqual(model.search_sports_with_active_events_greater_than(self.conn, 1), [(1, 'Football', 2)])
+        self.assertEqual(model.search_events_with_active_selections_greater_than(self.conn, 0), [(1, 'Final', 2)])
+
+    def test_migration_backfills_counters(self):
+        set_up_database.populate_database_with_sample_data(self.database)
+        expected = self.counters()
+        self.conn.execute("DROP TABLE SportActiveCounts")
+        self.conn.execute("DROP TABLE EventActiveCounts")
+        self.conn.execute("PRAGMA user_version = 1")
+
+        set_up_database.migrate(self.conn)
+        self.assertEqual(self.counters(), expected)
+        self.assertEqual(expected, self.recounted())
+
+
+class TestStartTimes(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        database = os.path.join(self.directory, 'sportsbook.db')
+        set_up_database.create_database_and_tables(database)
+        self.conn = sqlite3.connect(database)
+        model.create_sport(self.conn, 'Football', 'football', True)
+        # The same kinds of text the API has accepted: naive UTC, Z suffix, fractional seconds, an offset
+        starts = ['2023-07-10 20:00:00', '2023-07-10T19:00:00Z', '2023-07-10T21:30:00.000Z',
+                  '2023-07-10T23:00:00+02:00', '2023-07-11 09:00:00']
+        model.create_event_many(self.conn, [(f'Event {i}', f'event-{i}', True, 'preplay', 1, 'Pending', start, start)
+                                            for i, start in enumerate(starts, start=1)])
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def ids(self, filters):
+        return sorted(row[0] for row in model.search_events(self.conn, filters))
+
+    def test_to_epoch(self):
+        self.assertEqual(model.to_epoch('2023-07-10 20:00:00'), 1689019200)
+        self.assertEqual(model.to_epoch('2023-07-10T20:00:00Z'), 1689019200)
+        self.assertEqual(model.to_epoch('2023-07-10T22:00:00+02:00', 'America/New_York'), 1689019200)
+        self.assertEqual(model.to_epoch('2023-07-10 21:00:00', 'Europe/London'), 1689019200)
+        for time_str, tz_str in (('tomorrow', 'UTC'), ('2023-07-10 20:00:00', 'Mars/Olympus')):
+            with self.assertRaises(ValueError):
+                model.to_epoch(time_str, tz_str)
+
+    def test_time_filters_compare_instants(self):
+        # As text, '2023-07-10T19:00:00Z' sorts after '2023-07-10 20:00:00'; as instants it comes first
+        self.assertEqual(self.ids({'from': model.to_epoch('2023-07-10 19:00:00'),
+                                   'to': model.to_epoch('2023-07-10 21:00:00')}), [1, 2])
+        self.assertEqual(self.ids({'from': model.to_epoch('2023-07-10 21:00:00'),
+                                   'to': model.to_epoch('2023-07-10 22:00:00')}), [3, 4])
+        self.assertEqual(self.ids({'started_from': model.to_epoch('2023-07-11 00:00:00')}), [5])
+        # Naive bounds are London time: 20:00-21:00 BST is 19:00-20:00 UTC, inclusive at both ends
+        self.assertEqual(sorted(row[0] for row in model.search_events_in_timeframe(
+            self.conn, '2023-07-10 20:00:00', '2023-07-10 21:00:00')), [1, 2])
+
+
+class TestTimeConversion(unittest.TestCase):
+    def test_convert_many_matches_convert_to_utc(self):
+        # Every 10 minutes through days with DST changes (Lord Howe moves by 30 minutes), plus a year in 5 hour steps
+        days = ['2023-03-26', '2023-10-29', '2023-03-12', '2023-11-05', '2023-04-02', '2023-10-01']
+        times = [f"{day} {minute // 60:02}:{minute % 60:02}:30" for day in days for minute in range(0, 1440, 10)]
+        times += [str(datetime(2023, 1, 1) + timedelta(hours=hour)) for hour in range(0, 365 * 24, 5)]
+        times += ['2023-7-1 9:05:00']  # strptime accepts fields without zero padding
+        for tz_str in ('Europe/London', 'America/New_York', 'Australia/Lord_Howe', 'Asia/Kolkata', 'UTC'):
+            with self.subTest(tz_str=tz_str):
+                self.assertEqual(model.convert_many_to_utc(times, tz_str=tz_str),
+                                 [model.convert_to_utc(time_str, tz_str=tz_str) for time_str in times])
+
+        self.assertEqual(model.convert_many_to_utc(['10/07/2023 20:00'], '%d/%m/%Y %H:%M'),
+                         [datetime(2023, 7, 10, 19, 0)])
+        self.assertIs(model.get_timezone('Europe/London'), model.get_timezone('Europe/London'))
+        with self.assertRaises(ValueError):
+            model.convert_many_to_utc(['2023-07-10 20:00:00', '2023-07-10T20:00:00Z'])
+
+    def test_create_event_many_in_timezone(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE TABLE Events (id INTEGER PRIMARY KEY, name TEXT, slug TEXT, active BOOLEAN, type TEXT, "
+                     "sport_id INTEGER, status TEXT, scheduled_start TEXT, actual_start TEXT)")
+        events = [('Final', 'final', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', None),
+                  ('Semi', 'semi', True, 'inplay', 1, 'Started', '2023-01-10 20:00:00', '2023-01-10 20:05:00')]
+        model.create_event_many(conn, events, tz_str='Europe/London')
+        self.assertEqual([row[7:] for row in model.search_events(conn, {})],
+                         [('2023-07-10 19:00:00', None), ('2023-01-10 20:00:00', '2023-01-10 20:05:00')])
+
+        events = [('A', 'a', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', None),
+                  ('B', 'b', True, 'preplay', 1, 'Pending', '2023-07-10T20:00:00Z', None),
+                  ('C', 'c', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', 'soon')]
+        with self.assertRaises(model.BatchInsertError) as raised:
+            model.create_event_many(conn, events, tz_str='Europe/London')
+        self.assertEqual([error['index'] for error in raised.exception.errors], [1, 2])
+        self.assertEqual(len(model.search_events(conn, {})), 2)
+        conn.close()
+
+
+class TestQueryPlans(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        database = os.path.join(cls.directory, 'sportsbook.db')
+        set_up_database.create_database_and_tables(database)
+        set_up_database.populate_database_with_sample_data(database)
+        cls.conn = sqlite3.connect(database)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        shutil.rmtree(cls.directory)
+
+    def assert_no_scans(self, name, call):
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            self.conn.set_trace_callback(None)
+        self.assertTrue(statements)
+        for statement in statements:
+            if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            plan = self.conn.execute("EXPLAIN QUERY PLAN " + statement).fetchall()
+            scans = [row[3] for row in plan if row[3].startswith('SCAN')]
+            self.assertEqual(scans, [], f"{name} scans a table: {statement}")
+
+    def test_model_queries_use_indexes(self):
+        update_event = {'name': 'NBA Finals', 'active': True, 'type': 'inplay', 'sport_id': 2, 'status': 'Started',
+                        'scheduled_start': '2023-06-01 19:30:00', 'actual_start': '2023-06-01 19:35:00'}
+        update_selection = {'name': 'Lakers Win', 'event_id': 2, 'price': 1.6, 'active': True,
+                            'outcome': 'Unsettled'}
+        calls = {
+            'read_sport': lambda: model.read_sport(self.conn, 1),
+            'read_event': lambda: model.read_event(self.conn, 1),
+            'read_selection': lambda: model.read_selection(self.conn, 1),
+            'read_sport_events': lambda: model.read_sport_events(self.conn, 1),
+            'read_event_selections': lambda: model.read_event_selections(self.conn, 1),
+            'read_selections_for_events': lambda: model.read_selections_for_events(self.conn, [1, 2]),
+            'search_events by sport_id': lambda: model.search_events(self.conn, {'sport_id': 1}),
+            'search_events by sport_id and active': lambda: model.search_events(self.conn,
+                                                                                {'sport_id': 1, 'active': 1}),
+            'search_events by type and status': lambda: model.search_events(self.conn,
+                                                                            {'type': 'inplay', 'status': 'Started'}),
+            'search_events_in_timeframe': lambda: model.search_events_in_timeframe(
+                self.conn, '2023-06-01 00:00:00', '2023-07-01 00:00:00'),
+            'search_selections by event_id': lambda: model.search_selections(self.conn, {'event_id': 1}),
+            'search_selections by event_id and active': lambda: model.search_selections(
+                self.conn, {'event_id': 1, 'active': 1}),
+            'search_selections by event_id__in': lambda: model.search_selections(self.conn, {'event_id__in': [1, 2]}),
+            'search_events by from and to': lambda: model.search_events(
+                self.conn, {'from': 1685577600, 'to': 1688169600}),
+            'search_events by started_from': lambda: model.search_events(self.conn, {'started_from': 1685577600}),
+            'search_events by scheduled_start range': lambda: model.search_events(
+                self.conn, {'scheduled_start__gte': '2023-06-01 00:00:00', 'scheduled_start__lt': '2023-07-01'}),
+            'search_events by sport_id and status__in': lambda: model.search_events(
+                self.conn, {'sport_id': 1, 'status__in': ['Pending', 'Started']}),
+            'search_event_cards by sport_id': lambda: model.search_event_cards(self.conn, {'sport_id': 1}),
+            'check_and_update_sport_status': lambda: model.check_and_update_sport_status(self.conn, 1),
+            'check_and_update_event_status': lambda: model.check_and_update_event_status(self.conn, 1),
+            'update_event': lambda: model.update_event(self.conn, 2, update_event),
+            'update_selection': lambda: model.update_selection(self.conn, 4, update_selection),
+            'update_selection_prices': lambda: model.update_selection_prices(self.conn, [(4, 1.6), (1, 1.9, True)]),
+            'search_sports_with_active_events_greater_than':
+                lambda: model.search_sports_with_active_events_greater_than(self.conn, 0),
+            'search_events_with_active_selections_greater_than':
+                lambda: model.search_events_with_active_selections_greater_than(self.conn, 1),
+            'search_sports by min_active_events': lambda: model.search_sports(self.conn, {'min_active_events': 1}),
+            'search_events by min_active_selections': lambda: model.search_events(
+                self.conn, {'min_active_selections': 2}, limit=10, after_id=0),
+        }
+        for name, call in calls.items():
+            with self.subTest(name):
+                self.assert_no_scans(name, call)
+
+    def test_migrations_are_recorded_and_idempotent(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        self.assertEqual(version, len(set_up_database.MIGRATIONS))
+        self.assertEqual(set_up_database.migrate(self.conn), version)
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'sportsbook.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def schema(self):
+        conn = sqlite3.connect(self.database)
+        try:
+            return sorted(conn.execute("SELECT type, name FROM sqlite_master"))
+        finally:
+            conn.close()
+
+    def test_setup_is_idempotent(self):
+        applied = []
+        version = set_up_database.create_database_and_tables(
+            self.database, report=lambda number, migration, seconds: applied.append(number))
+        self.assertEqual(version, len(set_up_database.MIGRATIONS))
+        self.assertEqual(applied, list(range(1, version + 1)))
+        set_up_database.populate_database_with_sample_data(self.database)
+        schema = self.schema()
+
+        # Running the setup again, e.g. on every server start, changes nothing and applies nothing
+        self.assertEqual(set_up_database.create_database_and_tables(
+            self.database, report=lambda number, migration, seconds: applied.append(number)), version)
+        self.assertEqual(set_up_database.initialize_database(self.database), version)
+        self.assertEqual(applied, list(range(1, version + 1)))
+        self.assertEqual(self.schema(), schema)
+        conn = sqlite3.connect(self.database)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM Selections").fetchone()[0], 5)
+        conn.close()
+
+    def test_interrupted_online_migration_resumes(self):
+        set_up_database.create_database_and_tables(self.database)
+        schema = self.schema()
+        conn = sqlite3.connect(self.database)
+        # As if the process died after the first index of migration 3 was built
+        conn.execute("DROP INDEX idx_events_actual_start_epoch")
+        conn.execute("PRAGMA user_version = 2")
+        self.assertEqual(set_up_database.migrate(conn), len(set_up_database.MIGRATIONS))
+        conn.close()
+        self.assertEqual(self.schema(), schema)
+
+    def test_newer_schema_is_refused(self):
+        set_up_database.create_database_and_tables(self.database)
+        conn = sqlite3.connect(self.database)
+        conn.execute(f"PRAGMA user_version = {len(set_up_database.MIGRATIONS) + 1}")
+        with self.assertRaises(RuntimeError):
+            set_up_database.migrate(conn)
+        conn.close()
+
+    def test_failed_migration_is_rolled_back(self):
+        set_up_database.create_database_and_tables(self.database)
+        conn = sqlite3.connect(self.database)
+        migrations = set_up_database.MIGRATIONS
+        set_up_database.MIGRATIONS = migrations + [set_up_database.Migration('broken', [
+            "CREATE INDEX idx_sports_name ON Sports (name)", "CREATE INDEX idx_sports_name ON Sports (name)"])]
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                set_up_database.migrate(conn)
+        finally:
+            set_up_database.MIGRATIONS = migrations
+        self.assertEqual(set_up_database.schema_version(conn), len(migrations))
+        self.assertIsNone(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_sports_name'").fetchone())
+        conn.close()
+
+    def test_add_column_is_idempotent(self):
+        set_up_database.create_database_and_tables(self.database)
+        conn = sqlite3.connect(self.database)
+        add = set_up_database.add_column('Selections', 'liability REAL NOT NULL DEFAULT 0')
+        add(conn)
+        add(conn)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(Selections)")]
+        self.assertEqual(columns.count('liability'), 1)
+        conn.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,110 @@
+import random
+import unittest
+from array import array
+
+from find_internal_nodes import find_internal_nodes_num
+from parent_array_tree import ParentArrayTree, numpy
+
+
+def ancestors(parents, node):
+    path = [node]
+    while parents[path[-1]] >= 0:
+        path.append(parents[path[-1]])
+    return path
+
+
+def naive_lca(parents, u, v):
+    u_ancestors = set(ancestors(parents, u))
+    return next((node for node in ancestors(parents, v) if node in u_ancestors), None)
+
+
+def random_forest(size, roots, rng):
+    # Parents are shuffled so they do not always come before their children
+    labels = list(range(size))
+    rng.shuffle(labels)
+    parents = [-1] * size
+    for position in range(roots, size):
+        parents[labels[position]] = labels[rng.randrange(position)]
+    return parents
+
+
+class TestParentArrayTree(unittest.TestCase):
+    def test_small_tree(self):
+        #        4
+        #      / | \
+        #     0  1  5
+        #        |  | \
+        #        2  3  6
+        tree = ParentArrayTree([4, 4, 1, 5, -1, 4, 5])
+        self.assertEqual(len(tree), 7)
+        self.assertEqual(list(tree.roots), [4])
+        self.assertEqual(list(tree.children(4)), [0, 1, 5])
+        self.assertEqual(list(tree.children(5)), [3, 6])
+        self.assertEqual(tree.parent(2), 1)
+        self.assertEqual([tree.is_internal(node) for node in range(7)], [False, True, False, False, True, True, False])
+        self.assertTrue(tree.is_leaf(6))
+        self.assertEqual([tree.depth(node) for node in range(7)], [1, 1, 2, 2, 0, 1, 2])
+        self.assertEqual([tree.subtree_size(node) for node in range(7)], [1, 2, 1, 1, 7, 3, 1])
+        self.assertEqual(tree.height, 2)
+        self.assertEqual(tree.internal_count, 3)
+        self.assertEqual(tree.lca(3, 6), 5)
+        self.assertEqual(tree.lca(2, 6), 4)
+        self.assertEqual(tree.lca(5, 3), 5)
+        self.assertEqual(tree.lca(0, 0), 0)
+        self.assertEqual([tree.ancestor(3, k) for k in range(4)], [3, 5, 4, None])
+
+    def test_forest_and_empty_tree(self):
+        tree = ParentArrayTree([-1, 0, -1, 2, 2])
+        self.assertEqual(list(tree.roots), [0, 2])
+        self.assertIsNone(tree.lca(1, 3))
+        self.assertIsNone(tree.lca(0, 2))
+        self.assertEqual(tree.lca(3, 4), 2)
+
+        tree = ParentArrayTree([])
+        self.assertEqual((len(tree), tree.height, tree.internal_count), (0, 0, 0))
+        self.assertEqual(tree.depths([]), [])
+
+    def test_invalid_parents(self):
+        for parents in ([0, 5], [-2, 0], [1, 0], [-1, 2, 3, 1]):
+            with self.assertRaises(ValueError, msg=parents):
+                ParentArrayTree(parents)
+        tree = ParentArrayTree([-1, 0])
+        for query in (lambda: tree.depth(2), lambda: tree.lca(-1, 0), lambda: tree.subtree_sizes([0, 2])):
+            with self.assertRaises(IndexError):
+                query()
+
+    def test_matches_naive_walks(self):
+        rng = random.Random(7)
+        for size, roots in ((1, 1), (50, 1), (300, 3), (1000, 1)):
+            parents = random_forest(size, roots, rng)
+            tree = ParentArrayTree(array('i', parents))
+            self.assertEqual(tree.internal_count, find_internal_nodes_num(parents))
+            sizes = [0] * size
+            for node in range(size):
+                self.assertEqual(tree.depth(node), len(ancestors(parents, node)) - 1)
+                for ancestor in ancestors(parents, node):
+                    sizes[ancestor] += 1
+            self.assertEqual(tree.subtree_sizes(range(size)), sizes)
+
+            pairs = [(rng.randrange(size), rng.randrange(size)) for _ in range(200)]
+            self.assertEqual(tree.lcas(pairs), [naive_lca(parents, u, v) for u, v in pairs])
+            nodes = [rng.randrange(size) for _ in range(100)]
+            self.assertEqual(tree.depths(nodes), [tree.depth(node) for node in nodes])
+            self.assertEqual(tree.internal_flags(nodes), [tree.is_internal(node) for node in nodes])
+
+    def test_path_needs_every_level(self):
+        # A single chain: depth 999, so lifting takes 10 levels
+        tree = ParentArrayTree([-1] + list(range(999)))
+        self.assertEqual(tree.lca(999, 500), 500)
+        self.assertEqual(tree.ancestor(999, 999), 0)
+        self.assertEqual(tree.subtree_size(0), 1000)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy_input(self):
+        parents = [4, 4, 1, 5, -1, 4, 5]
+        tree = ParentArrayTree(numpy.array(parents, dtype=numpy.int32))
+        self.assertEqual(tree.subtree_sizes(range(7)), ParentArrayTree(parents).subtree_sizes(range(7)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+from query_builder import QueryBuilder, padded_size
+
+TABLE_FIELDS = {'Selections': ('id', 'name', 'event_id', 'price', 'active', 'outcome')}
+
+
+class TestQueryBuilder(unittest.TestCase):
+    def setUp(self):
+        self.builder = QueryBuilder(TABLE_FIELDS, max_shapes=2)
+
+    def test_filter_order_does_not_change_the_sql(self):
+        first = self.builder.build('Selections', {'outcome': 'Win', 'event_id': 3, 'active': 1})
+        second = self.builder.build('Selections', {'active': 1, 'event_id': 3, 'outcome': 'Win'})
+
+        self.assertEqual(first, ("SELECT * FROM Selections WHERE active = ? AND event_id = ? AND outcome = ?",
+                                 (1, 3, 'Win')))
+        self.assertEqual(second, first)
+        self.assertEqual(self.builder.stats(), {'shapes': 1, 'max_shapes': 2, 'hits': 1, 'misses': 1})
+
+    def test_values_do_not_change_the_shape(self):
+        query, params = self.builder.build('Selections', {'event_id': 3}, limit=10, after_id=20, fields=('price',))
+        self.assertEqual(query, "SELECT price FROM Selections WHERE event_id = ? AND id > ? ORDER BY id LIMIT ?")
+        self.assertEqual(params, (3, 20, 10))
+
+        self.assertEqual(self.builder.build('Selections', {'event_id': 4}, limit=5, after_id=0, fields=('price',)),
+                         (query, (4, 0, 5)))
+        self.assertEqual(self.builder.stats()['hits'], 1)
+
+    def test_least_recently_used_shape_is_dropped(self):
+        self.builder.build('Selections', {'active': 1})
+        self.builder.build('Selections', {'name': 'Home'})
+        self.builder.build('Selections', {'active': 0})
+        self.builder.build('Selections', {'price': 2.0})
+        self.builder.build('Selections', {'name': 'Away'})
+
+        self.assertEqual(self.builder.stats(), {'shapes': 2, 'max_shapes': 2, 'hits': 1, 'misses': 4})
+
+    def test_operator_suffixes(self):
+        query, params = self.builder.build('Selections', {'price__lt': 3.0, 'price__gte': 1.5, 'outcome__ne': 'Void'})
+        self.assertEqual(query, "SELECT * FROM Selections WHERE outcome != ? AND price >= ? AND price < ?")
+        self.assertEqual(params, ('Void', 1.5, 3.0))
+
+    def test_in_lists_share_shapes_by_padded_length(self):
+        query, params = self.builder.build('Selections', {'outcome__in': ['Win', 'Lose', 'Void'], 'active': 1})
+        self.assertEqual(query, "SELECT * FROM Selections WHERE active = ? AND outcome IN (?, ?, ?, ?)")
+        self.assertEqual(params, (1, 'Win', 'Lose', 'Void', 'Void'))
+
+        self.assertEqual(self.builder.build('Selections', {'outcome__in': ('Win', 'Lose', 'Void', 'Unsettled'),
+                                                           'active': 0})[0], query)
+        self.assertEqual(self.builder.stats()['shapes'], 1)
+        self.assertEqual([padded_size(range(count)) for count in (1, 2, 3, 5, 9, 512)], [1, 2, 4, 8, 16, 512])
+        for values in ([], 'Win', range(513)):
+            with self.assertRaises(ValueError):
+                padded_size(values)
+
+    def test_unknown_columns_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.builder.build('Selections', {'active = 1 OR 1': 1})
+        with self.assertRaises(ValueError):
+            self.builder.build('Selections', {}, fields=('id', 'colour'))
+        with self.assertRaises(ValueError):
+            self.builder.build('Selections', {'price__approx': 2.0})
+        with self.assertRaises(ValueError):
+            self.builder.build('Selections', {'price__': 2.0})  # an empty suffix is not an equality test
+        self.assertEqual(self.builder.stats()['shapes'], 0)
+
+    def test_extra_filters(self):
+        builder = QueryBuilder(TABLE_FIELDS, extra_filters={
+            'Selections': {'min_bets': "id IN (SELECT selection_id FROM BetCounts WHERE bets >= ?)"}})
+        query, params = builder.build('Selections', {'min_bets': 5, 'active': 1}, limit=10)
+        self.assertEqual(query, "SELECT * FROM Selections WHERE active = ? AND "
+                                "id IN (SELECT selection_id FROM BetCounts WHERE bets >= ?) ORDER BY id LIMIT ?")
+        self.assertEqual(params, (1, 5, 10))
+        with self.assertRaises(ValueError):
+            self.builder.build('Selections', {'min_bets': 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
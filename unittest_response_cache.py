@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import patch
+
+from response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=3, ttl=60)
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', [1], 'Events')
+        self.assertEqual(self.cache.get('a'), [1])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for key in 'abc':
+            self.cache.set(key, key, 'Events')
+        self.cache.get('a')
+        self.cache.set('d', 'd', 'Events')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        with patch('response_cache.time.monotonic', return_value=100.0):
+            self.cache.set('a', 1, 'Events')
+        with patch('response_cache.time.monotonic', return_value=161.0):
+            self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_invalidate_parent_keeps_other_parents(self):
+        self.cache.set('selections of 1', 1, 'Selections', 1)
+        self.cache.set('selections of 2', 2, 'Selections', 2)
+        self.cache.set('all selections', 3, 'Selections')
+
+        self.cache.invalidate('Selections', 1)
+
+        self.assertIsNone(self.cache.get('selections of 1'))
+        self.assertIsNone(self.cache.get('all selections'))
+        self.assertEqual(self.cache.get('selections of 2'), 2)
+
+    def test_invalidate_table(self):
+        self.cache.set('selections of 1', 1, 'Selections', 1)
+        self.cache.set('events', 2, 'Events')
+        self.cache.invalidate('Selections')
+        self.assertIsNone(self.cache.get('selections of 1'))
+        self.assertEqual(self.cache.get('events'), 2)
+
+    def test_value_loaded_before_an_invalidation_is_not_stored(self):
+        generation = self.cache.generation('Events')
+        self.cache.invalidate('Events', 1)
+        self.cache.set('events', 'stale', 'Events', generation=generation)
+        self.assertIsNone(self.cache.get('events'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import model
+from set_up_database import create_database_and_tables
+from write_queue import WriteQueue
+
+
+class TestWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.db')
+        create_database_and_tables(self.path)
+        self.queue = WriteQueue(self.path, max_delay=0.05)
+        self.queue.call(model.create_sport, 'Football', 'football', True)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def read(self, query, params=()):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return rows
+
+    def test_concurrent_writes_share_a_commit(self):
+        barrier = threading.Barrier(20)
+
+        def write(number):
+            barrier.wait()
+            self.queue.call(model.create_sport, f'Sport {number}', f'sport-{number}', True)
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.read("SELECT COUNT(*) FROM Sports"), [(21,)])
+        stats = self.queue.stats()
+        self.assertEqual(stats['writes'], 21)
+        self.assertLess(stats['batches'], 21)
+        self.assertGreater(stats['largest_batch'], 1)
+
+    def test_failed_write_rolls_back_alone(self):
+        futures = [self.queue.submit(model.create_sport, 'Tennis', 'tennis', True),
+                   self.queue.submit(model.create_sport, 'Football again', 'football', True),
+                   self.queue.submit(model.create_sport_many, [('Golf', 'golf', True), ('Golf again', 'golf', True)]),
+                   self.queue.submit(model.create_sport, 'Golf', 'golf', True)]
+
+        self.assertIsNone(futures[0].result())
+        self.assertIsInstance(futures[1].exception(), sqlite3.IntegrityError)
+        # The batch insert's own rollbacks undo only its savepoint: its first row is gone, Tennis is not
+        self.assertEqual(futures[2].exception().errors[0]['index'], 1)
+        self.assertIsNone(futures[3].result())
+        self.assertEqual(self.read("SELECT slug FROM Sports ORDER BY id"), [('football',), ('tennis',), ('golf',)])
+        self.assertEqual(self.queue.stats()['failed'], 2)
+
+    def test_cascades_run_inside_the_batch(self):
+        self.queue.call(model.create_event, 'Final', 'final', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00',
+                        None)
+        self.queue.call(model.create_selection_many, [('Home', 1, 2.0, True, 'Unsettled'),
+                                                      ('Away', 1, 3.0, True, 'Unsettled')])
+
+        updated = self.queue.call(model.update_selection_prices, [(1, 2.5, False), (2, 3.5, False)])
+        self.assertEqual(updated, 2)
+        self.assertEqual(self.read("SELECT active FROM Events"), [(0,)])
+
+    def test_listeners_run_after_commit(self):
+        seen = []
+
+        def listener(table, parent_id, changes):
+            seen.append((table, self.read("SELECT COUNT(*) FROM Sports")[0][0]))
+
+        model.write_listeners.append(listener)
+        try:
+            self.queue.call(model.create_sport, 'Tennis', 'tennis', True)
+        finally:
+            model.write_listeners.remove(listener)
+        self.assertEqual(seen, [('Sports', 2)])
+
+    def test_failing_listener_does_not_stop_the_writer(self):
+        seen = []
+
+        def failing(table, parent_id, changes):
+            raise ValueError('listener bug')
+
+        model.write_listeners.extend([failing, lambda *arguments: seen.append(arguments[0])])
+        try:
+            with self.assertLogs('model', 'ERROR'):
+                self.queue.call(model.create_sport, 'Tennis', 'tennis', True)
+            with self.assertLogs('model', 'ERROR'):
+                self.queue.submit(model.create_sport, 'Golf', 'golf', True).result(timeout=5)
+        finally:
+            del model.write_listeners[-2:]
+        self.assertEqual(seen, ['Sports', 'Sports'])
+        self.assertEqual(self.read("SELECT COUNT(*) FROM Sports"), [(3,)])
+
+    def test_unexpected_error_resolves_futures(self):
+        def write(conn):
+            model.create_sport(conn, 'Tennis', 'tennis', True)
+            # A notification that cannot be replayed makes the replay after COMMIT raise TypeError
+            model._collected_writes.writes.append(())
+            return 'written'
+
+        with self.assertLogs('write_queue', 'ERROR'):
+            # The write is committed, so its Future still gets its result
+            self.assertEqual(self.queue.call(write), 'written')
+        # The writer thread survived and keeps committing
+        self.queue.call(model.create_sport, 'Golf', 'golf', True)
+        self.assertEqual(self.read("SELECT COUNT(*) FROM Sports"), [(3,)])
+
+    def test_call_raises_when_the_writer_thread_dies(self):
+        self.queue.close()
+        self.queue = WriteQueue(self.path, max_delay=0.05)
+        self.queue._run = lambda: None  # a writer thread that ends without taking any write
+        with mock.patch('write_queue.WRITER_CHECK_INTERVAL', 0.05):
+            with self.assertRaises(RuntimeError):
+                self.queue.call(model.create_sport, 'Tennis', 'tennis', True)
+        del self.queue._run
+        # The next write starts a new writer thread, which also commits the write left in the queue
+        self.queue.call(model.create_sport, 'Golf', 'golf', True)
+        self.assertEqual(self.read("SELECT slug FROM Sports ORDER BY id"), [('football',), ('tennis',), ('golf',)])
+
+    def test_close_commits_queued_writes(self):
+        futures = [self.queue.submit(model.create_sport, f'Sport {number}', f'sport-{number}', True)
+                   for number in range(10)]
+        self.queue.close()
+
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(self.read("SELECT COUNT(*) FROM Sports"), [(11,)])
+        with self.assertRaises(RuntimeError):
+            self.queue.submit(model.create_sport, 'Golf', 'golf', True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from flask import Flask, jsonify, abort, request, json
 from unittest.mock import patch, Mock
+import json_backend
 import rest_application
 import sqlite3
 import model
@@ -10,6 +11,10 @@ from unittest.mock import patch, MagicMock
 class Tests(unittest.TestCase):
     def setUp(self):
         self.app = rest_application.app
+        # These tests swap the database out from under the model layer, so the response cache is bypassed
+        self.app.config['RESPONSE_CACHE_ENABLED'] = False
+        # The database is mocked too, so there is no schema to check
+        self.app.config['SCHEMA_CHECK_ENABLED'] = False
         self.client = self.app.test_client()
 
     @patch('rest_application.get_db')
@@ -370,6 +375,256 @@ class Tests(unittest.TestCase):
             response = client.get('/selections?invalid_filter=value')
             self.assertEqual(response.status_code, 400)
 
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.create_selection_many', autospec=True)
+    def test_create_selections_batch(self, mock_create_selection_many, mock_get_db):
+        mock_db_conn = MagicMock()
+        mock_get_db.return_value = mock_db_conn
+
+        data = [
+            {'name': 'Lakers Win', 'event_id': 1, 'price': 1.5, 'active': True, 'outcome': 'Unsettled'},
+            {'name': 'Heat Win', 'event_id': 1, 'price': 2.5, 'active': True, 'outcome': 'Unsettled'},
+        ]
+        response = self.client.post('/selections', json=data)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json(), {'status': 'success', 'created': 2})
+        mock_create_selection_many.assert_called_once_with(
+            mock_db_conn, [('Lakers Win', 1, 1.5, True, 'Unsettled'), ('Heat Win', 1, 2.5, True, 'Unsettled')])
+        mock_db_conn.close.assert_called_once()
+
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.create_sport_many', autospec=True)
+    def test_create_sports_batch_reports_row_errors(self, mock_create_sport_many, mock_get_db):
+        # Invalid rows are rejected before anything reaches the database
+        data = [{'name': 'Football', 'slug': 'football', 'active': True}, {'name': 'Tennis', 'active': True}, 'x']
+        response = self.client.post('/sports', json=data)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json(), {'status': 'failure', 'errors': [
+            {'index': 1, 'error': 'Missing required parameter in the JSON body'},
+            {'index': 2, 'error': 'Expected a JSON object'}]})
+        mock_get_db.assert_not_called()
+        mock_create_sport_many.assert_not_called()
+
+        # Rows rejected by the database are reported the same way
+        mock_create_sport_many.side_effect = model.BatchInsertError(
+            [{'index': 0, 'error': 'UNIQUE constraint failed: Sports.slug'}])
+        response = self.client.post('/sports', json=data[:1])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['errors'][0]['index'], 0)
+
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.update_selection_prices', autospec=True)
+    def test_update_selection_prices(self, mock_update_selection_prices, mock_get_db):
+        mock_db_conn = MagicMock()
+        mock_get_db.return_value = mock_db_conn
+        mock_update_selection_prices.return_value = 2
+
+        response = self.client.patch('/selections/prices', json=[[1, 1.9], [2, 3, False]])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'message': 'Prices updated successfully', 'updated': 2})
+        mock_update_selection_prices.assert_called_once_with(mock_db_conn, [(1, 1.9), (2, 3, False)])
+        mock_db_conn.close.assert_called_once()
+
+        # Malformed entries are reported by index and nothing is written
+        mock_update_selection_prices.reset_mock()
+        response = self.client.patch('/selections/prices', json=[[1, 1.9], [True, 2.0], [3, 2.0, 'yes'], [4]])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.get_json()['errors']], [1, 2, 3])
+        mock_update_selection_prices.assert_not_called()
+
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.search_events', autospec=True)
+    def test_get_events_paged(self, mock_search_events, mock_get_db):
+        mock_db_conn = MagicMock()
+        mock_get_db.return_value = mock_db_conn
+        mock_search_events.return_value = [[3, 'Event 3'], [4, 'Event 4']]
+
+        response = self.client.get('/events?active=true&limit=2&after_id=2')
+
+        mock_search_events.assert_called_once_with(mock_db_conn, {'active': 1}, limit=2, after_id=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'events': [[3, 'Event 3'], [4, 'Event 4']], 'next_after_id': 4})
+
+        # A short page is the last one, and an empty page is not an error
+        mock_search_events.return_value = []
+        response = self.client.get('/events?limit=2&after_id=4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'events': [], 'next_after_id': None})
+
+        response = self.client.get('/events?limit=-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json(), {'error': 'Invalid limit value, must be a non-negative integer.'})
+
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.stream_selections', autospec=True)
+    def test_get_selections_streamed(self, mock_stream_selections, mock_get_db):
+        mock_db_conn = MagicMock()
+        mock_get_db.return_value = mock_db_conn
+        mock_stream_selections.side_effect = lambda conn, filters, **page: iter([[[1, 'Home']], [[2, 'Away']]])
+
+        response = self.client.get('/selections?event_id=1&stream=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).split('\n')
+        self.assertEqual([json.loads(line) for line in lines[:-1]], [[1, 'Home'], [2, 'Away']])
+        self.assertEqual(lines[-1], '')
+        mock_stream_selections.assert_called_once_with(mock_db_conn, {'event_id': '1'})
+        mock_db_conn.close.assert_called_once()
+
+        response = self.client.get('/selections?stream=json')
+        self.assertEqual(response.get_json(), {'selections': [[1, 'Home'], [2, 'Away']]})
+
+        response = self.client.get('/sports?stream=xml')
+        self.assertEqual(response.status_code, 400)
+
+    @patch('rest_application.time.time', return_value=1000.0)
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.search_events', autospec=True)
+    def test_get_events_not_modified(self, mock_search_events, mock_get_db, mock_time):
+        mock_get_db.return_value = MagicMock()
+        mock_search_events.return_value = [[1, 'Event']]
+
+        response = self.client.get('/events?active=true')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+
+        # Nothing written since: answered without touching the database
+        mock_get_db.reset_mock()
+        response = self.client.get('/events?active=true', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        mock_get_db.assert_not_called()
+
+        # A write to another table leaves the tag alone, a write to Events changes it
+        model.create_selection(MagicMock(), 'Home', 1, 2.0, True, 'Unsettled')
+        response = self.client.get('/events?active=true', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        model.create_event(MagicMock(), 'Final', 'final', True, 'preplay', 1, 'Pending', '2023-07-10 20:00:00', None)
+        response = self.client.get('/events?active=true', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        mock_get_db.assert_called_once()
+
+    @patch('rest_application.STREAM_HEARTBEAT', 0.01)
+    def test_stream_event(self):
+        response = self.client.get('/events/7/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = (chunk.decode() for chunk in response.response)
+        self.assertEqual(next(chunks), 'retry: 3000\n\n')
+        self.assertEqual(next(chunks), ': heartbeat\n\n')
+
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.rowcount = 0  # the event keeps an active selection
+        model.update_selection(mock_conn, 3, {'name': 'Home', 'event_id': 7, 'price': 2.5, 'active': True,
+                                              'outcome': 'Unsettled'})
+        model.update_selection(mock_conn, 4, {'name': 'Away', 'event_id': 8, 'price': 1.5, 'active': True,
+                                              'outcome': 'Unsettled'})
+        chunk = next(chunks)
+        self.assertTrue(chunk.startswith('event: selection\ndata: '))
+        self.assertEqual(json.loads(chunk.split('data: ')[1]),
+                         {'action': 'updated', 'id': 3, 'name': 'Home', 'price': 2.5, 'active': True,
+                          'outcome': 'Unsettled', 'event_id': 7})
+        self.assertEqual(next(chunks), ': heartbeat\n\n')
+
+        response.close()
+        self.assertFalse(rest_application.broadcaster.has_subscribers(7))
+
+    def test_get_stats(self):
+        response = self.client.get('/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pool', response.get_json())
+        self.assertEqual(response.get_json()['pool']['max_size'], rest_application.POOL_SIZE)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.app = rest_application.app
+        self.app.config['RESPONSE_CACHE_ENABLED'] = True
+        self.app.config['SCHEMA_CHECK_ENABLED'] = False  # the database is mocked
+        rest_application.response_cache.clear()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        rest_application.response_cache.clear()
+
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.read_event_selections', autospec=True)
+    def test_event_selections_cached_until_written(self, mock_read_event_selections, mock_get_db):
+        mock_db_conn = MagicMock()
+        mock_get_db.return_value = mock_db_conn
+        mock_read_event_selections.return_value = [[1, 'Home', 1]]
+
+        self.client.get('/events/1/selections')
+        self.client.get('/events/2/selections')
+        response = self.client.get('/events/1/selections')
+
+        self.assertEqual(response.get_json(), {'selections': [[1, 'Home', 1]]})
+        self.assertEqual(mock_read_event_selections.call_count, 2)
+
+        # A write to event 1 only drops event 1's entry
+        model.update_selection(MagicMock(), 1, {'name': 'Home', 'event_id': 1, 'price': 2.0, 'active': True,
+                                                'outcome': 'Unsettled'})
+        self.client.get('/events/1/selections')
+        self.client.get('/events/2/selections')
+        self.assertEqual(mock_read_event_selections.call_count, 3)
+
+    @patch('rest_application.get_db', autospec=True)
+    @patch('rest_application.model.search_events', autospec=True)
+    def test_search_cache_key_ignores_argument_order(self, mock_search_events, mock_get_db):
+        mock_get_db.return_value = MagicMock()
+        mock_search_events.return_value = [[1, 'Event']]
+        before = rest_application.response_cache.stats()
+
+        self.client.get('/events?active=true&type=inplay')
+        self.client.get('/events?type=inplay&active=true')
+        self.assertEqual(mock_search_events.call_count, 1)
+
+        # The event cascade changes Events rows, so it invalidates the event searches
+        mock_conn = MagicMock()
+        mock_conn.cursor.return_value.rowcount = 1
+        model.check_and_update_event_status(mock_conn, 1)
+        self.client.get('/events?type=inplay&active=true')
+        self.assertEqual(mock_search_events.call_count, 2)
+
+        stats = self.client.get('/stats').get_json()['response_cache']
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses']), (1, 2))
+
+
+class TestCreateApp(unittest.TestCase):
+    def setUp(self):
+        self.pool = rest_application.pool
+
+    def tearDown(self):
+        rest_application.pool.close_all()
+        rest_application.pool = self.pool
+
+    def test_settings_come_from_environment_then_config(self):
+        with patch.dict('os.environ', {'SPORTSBOOK_POOL_SIZE': '3', 'SPORTSBOOK_DATABASE': 'from_env.db'}):
+            app = rest_application.create_app({'DATABASE': 'from_config.db'})
+
+        self.assertEqual(app.config['POOL_SIZE'], 3)
+        self.assertEqual(app.config['DATABASE'], 'from_config.db')
+        self.assertEqual(rest_application.pool.stats()['max_size'], 3)
+        self.assertEqual(rest_application.pool.stats()['open'], 0)
+        self.assertEqual(rest_application.pool.stats()['cached_statements'], rest_application.STATEMENT_CACHE_SIZE)
+        self.assertIn('api.get_sports', app.view_functions)
+
+    def test_json_backend_can_be_switched_off(self):
+        app = rest_application.create_app({'FAST_JSON': False})
+        self.assertNotIsInstance(app.json, json_backend.OrjsonProvider)
+        rest_application.pool.close_all()
+
+        app = rest_application.create_app()
+        if json_backend.orjson is not None:
+            self.assertIsInstance(app.json, json_backend.OrjsonProvider)
+        self.assertEqual(app.json.loads(app.json.dumps({'b': [1, 2.5], 'a': None})), {'b': [1, 2.5], 'a': None})
+
 
 if __name__ == '__main__':
     unittest.main()
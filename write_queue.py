@@ -0,0 +1,226 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import Future
+
+import model
+from set_up_database import STORAGE_PROFILE
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the checks call() makes that the writer thread is still alive while it waits
+WRITER_CHECK_INTERVAL = 1.0
+
+# A batch is committed once for all its writes, so it can afford a full fsync: an acknowledged write is on disk
+WRITER_PROFILE = dict(STORAGE_PROFILE, synchronous='FULL')
+
+
+class BatchConnection:
+    """
+    Proxy around the writer's connection, handed to each write in a batch.
+
+    commit() does nothing, since the batch commits once at the end, and rollback() undoes only the
+    current write by rolling back to its savepoint. Everything else is forwarded, so model.py write
+    functions, including their status cascades, run on it unchanged.
+    """
+
+    def __init__(self, conn):
+        object.__setattr__(self, '_conn', conn)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._conn.execute("ROLLBACK TO write")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+
+class WriteQueue:
+    """
+    Write-behind queue that group-commits writes from many threads on one writer thread.
+
+    submit(write, *args) queues write(conn, *args), where write is a model.py create, update or
+    delete function, and returns a Future. The writer thread takes the writes that arrive within
+    max_delay seconds of the first one (at most max_batch of them), runs each in its own savepoint of
+    one transaction and commits once. Only then are the writes' notify_write calls replayed and their
+    Futures resolved with the return value. A write that raises has its savepoint rolled back and its
+    Future gets the exception; the rest of the batch still commits. A resolved Future therefore means
+    the write is committed, and with WRITER_PROFILE's synchronous=FULL, that it is on disk.
+
+    The writer thread starts on the first submit(), and a queue inherited through fork() starts a new
+    one in the child process. Every Future of a batch is resolved even if something unexpected fails
+    while it is committed; should the writer thread still die, the next submit() starts a new one and
+    call() raises RuntimeError instead of waiting for a write nobody will run.
+
+    Parameters:
+    - database (str): Path of the SQLite database file.
+    - max_delay (float): Seconds to wait for more writes after the first write of a batch arrives.
+    - max_batch (int): Most writes committed in one transaction.
+    - pragmas (dict): PRAGMA name -> value applied to the writer's connection.
+    """
+
+    def __init__(self, database, max_delay=0.002, max_batch=256, pragmas=None):
+        self.database = database
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.pragmas = dict(WRITER_PROFILE if pragmas is None else pragmas)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._pid = os.getpid()
+        self._batches = 0
+        self._writes = 0
+        self._failed = 0
+        self._largest_batch = 0
+
+    def submit(self, write, *args, **kwargs):
+        """Queue write(conn, *args, **kwargs) and return a Future that resolves once it is committed."""
+        future = Future()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._closed:
+                raise RuntimeError('Write queue is closed')
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+            self._queue.put((future, write, args, kwargs))
+        return future
+
+    def call(self, write, *args, **kwargs):
+        """Run write through the queue and return its result once committed, or raise its exception."""
+        future = self.submit(write, *args, **kwargs)
+        thread = self._thread
+        while True:
+            try:
+                return future.result(timeout=WRITER_CHECK_INTERVAL)
+            except futures.TimeoutError:
+                if not thread.is_alive() and not future.done():
+                    raise RuntimeError('Write queue writer thread died before committing the write')
+
+    def close(self):
+        """Commit the writes already queued, then stop the writer thread."""
+        with self._lock:
+            if self._closed or self._pid != os.getpid():
+                return
+            self._closed = True
+            thread = self._thread
+            self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, isolation_level=None)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                try:
+                    self._commit(conn, batch)
+                except Exception as e:
+                    # Not an SQLite error of the batch (those are handled in _commit): keep the writer alive
+                    logger.exception("Write queue failed to commit a batch of %d writes", len(batch))
+                    for future, write, args, kwargs in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            conn.close()
+
+    def _next_batch(self):
+        """Block for the first write, then gather more until max_delay passes; None once close() was called."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _commit(self, conn, batch):
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        batch_conn = BatchConnection(conn)
+        outcomes = []  # (future, result, exception, collected notifications) per write
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, write, args, kwargs in batch:
+                conn.execute("SAVEPOINT write")
+                with model.collect_writes() as notifications:
+                    try:
+                        result = write(batch_conn, *args, **kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write")
+                        conn.execute("RELEASE write")
+                        outcomes.append((future, None, e, ()))
+                        continue
+                conn.execute("RELEASE write")
+                outcomes.append((future, result, None, notifications))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # BEGIN or COMMIT failed, or a write left the transaction unusable: none of the batch was written
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._lock:
+                self._failed += len(batch)
+            for future, write, args, kwargs in batch:
+                future.set_exception(e)
+            return
+
+        # Listeners first, so a client that sees its write acknowledged cannot read a stale cached response.
+        # notify_write logs a listener that raises; the finally covers anything else, since the writes are
+        # committed either way and their Futures must not be left pending.
+        try:
+            for future, result, exception, notifications in outcomes:
+                for arguments in notifications:
+                    model.notify_write(*arguments)
+            with self._lock:
+                self._batches += 1
+                self._writes += len(batch)
+                self._failed += sum(exception is not None for future, result, exception, notifications in outcomes)
+                self._largest_batch = max(self._largest_batch, len(batch))
+        finally:
+            for future, result, exception, notifications in outcomes:
+                if exception is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exception)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_delay': self.max_delay,
+                'max_batch': self.max_batch,
+                'queued': self._queue.qsize(),
+                'batches': self._batches,
+                'writes': self._writes,
+                'failed': self._failed,
+                'largest_batch': self._largest_batch,
+            }